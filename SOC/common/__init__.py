@@ -1,3 +1,12 @@
 """common"""
-from .simulation import Simulation, clean_boundary_inplace
+from .simulation import Simulation, clean_boundary_inplace, inside_sum
+from .observables import ObservableStore, read_observables
+from .snapshots import Snapshots, SnapshotWriter, create_snapshots
+from .pyramid import Pyramid
+from .cache import StateCache
+from .stationarity import StationarityMonitor
+from .ensemble import run_ensemble, job_name
+from .batch import Batch
+from .powerlaw import LogHistogram, fit_power_law
+from . import tiles, driving, footprint, video, pyramid
 from matplotlib import pyplot as plt
\ No newline at end of file
@@ -0,0 +1,73 @@
+"""Contains the batch of independent replicas advanced together by batched kernels."""
+import numpy as np
+import pandas
+from tqdm import auto as tqdm
+
+
+class Batch:
+    """
+    `K` independent replicas of a model, advanced together by the model's parallel
+    batched kernel (see `Simulation._run_batch`), using every core in one process.
+
+    The replicas' `BATCH_ARRAYS` are stacked into arrays of shape (K, L+2, L+2) (in `arrays`),
+    and every replica's attributes are views into them, so each replica in `replicas` can still be
+    inspected (e.g. `plot_state`) and keeps its own observables in its `data_acquisition`.
+
+    :param model: simulation class with a batched kernel, e.g. `BTW`
+    :param K: number of replicas
+    :type K: int
+    :param params: keyword arguments of the model, e.g. L=16, engine="worklist"
+    """
+
+    def __init__(self, model, K: int, **params):
+        self.replicas = [model(**params) for _ in range(K)]
+        if not model.BATCH_ARRAYS or not all(hasattr(self.replicas[0], name) for name in model.BATCH_ARRAYS):
+            raise ValueError(f"{model.__name__} has no batched kernel for the parameters {params}")
+        self.arrays = {}
+        for name in model.BATCH_ARRAYS:
+            self.arrays[name] = np.stack([getattr(replica, name) for replica in self.replicas])
+            for replica, view in zip(self.replicas, self.arrays[name]):
+                setattr(replica, name, view)
+
+    def __len__(self) -> int:
+        return len(self.replicas)
+
+    def run(self, N_iterations: int, wait_for_n_iters: int = 10):
+        """
+        Run `N_iterations` iterations of every replica, after `wait_for_n_iters` iterations without
+        collecting data. Snapshots are not saved.
+
+        The replicas' random generators are seeded from numpy's global one, so the results only
+        depend on it (and not on the number of threads).
+
+        :param N_iterations: number of iterations per replica
+        :type N_iterations: int
+        :param wait_for_n_iters: wait this many iterations before collecting data
+        :type wait_for_n_iters: int
+        """
+        model = self.replicas[0]
+        total = N_iterations + wait_for_n_iters
+        progress = tqdm.tqdm(total=total)
+        i = 0
+        while i < total:
+            stop = min(total, i + model.COMPILED_BLOCK_SIZE)
+            if i < wait_for_n_iters:
+                stop = min(stop, wait_for_n_iters)
+            seeds = np.random.randint(2**31, size=len(self))
+            columns = model._run_batch(self.replicas, self.arrays, seeds, stop - i)
+            if i >= wait_for_n_iters:
+                for k, replica in enumerate(self.replicas):
+                    replica.data_acquisition.extend({name: column[k] for name, column in columns.items()})
+            progress.update(stop - i)
+            i = stop
+        progress.close()
+
+    @property
+    def data_df(self) -> pandas.DataFrame:
+        """
+        The observables of all replicas, with a `replica` column.
+
+        :rtype: pandas.DataFrame
+        """
+        return pandas.concat([replica.data_df for replica in self.replicas],
+                             keys=range(len(self)), names=["replica", None]).reset_index(level=0)
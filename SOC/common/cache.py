@@ -0,0 +1,162 @@
+"""Contains the on-disk cache of thermalized simulation states."""
+import hashlib
+import json
+import os
+import shutil
+import zarr
+
+#: parameters that do not change the stationary state of a model
+IGNORED_PARAMS = ("save_every", "wait_for_n_iters", "engine", "packed_visited", "tile_size")
+
+
+def _directory_size(path: str) -> int:
+    size = 0
+    for directory, _, names in os.walk(path):
+        for name in names:
+            try:
+                size += os.path.getsize(os.path.join(directory, name))
+            except FileNotFoundError:     # removed by another process meanwhile
+                pass
+    return size
+
+
+def _mtime(path: str) -> float:
+    try:
+        return os.path.getmtime(path)
+    except FileNotFoundError:
+        return 0.
+
+
+def _publish(temporary: str, path: str):
+    """
+    Move the directory `temporary` to `path`, replacing it, with other processes possibly
+    storing the same entry at the same time.
+
+    Every step is a single rename. If another process puts its own entry in place first,
+    `temporary` is dropped: a state from any writer is as good as any other's.
+    """
+    old = f"{os.path.splitext(path)[0]}.{os.getpid()}.old"
+    try:
+        os.rename(path, old)
+    except FileNotFoundError:     # no entry yet, or another writer moved it away
+        pass
+    try:
+        os.rename(temporary, path)
+    except OSError:               # another writer got there first
+        shutil.rmtree(temporary, ignore_errors=True)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+class StateCache:
+    """
+    Size-bounded, least-recently-used cache of thermalized lattices on disk.
+
+    Entries are keyed by the model class and its `params` (L, `critical_value`, `abelian`,
+    `conservation_lvl`, `p`, `f`...) but not its engine, since all engines reach the same
+    stationary state. They hold the model's `STATE_ARRAYS` and `STATE_ATTRIBUTES` together
+    with the number of iterations it was thermalized for; engines rebuild their own structures
+    on loading (see `Simulation.build_engine`). Once the cache grows over `max_bytes`,
+    the entries used longest ago are removed.
+
+    :param directory: where to keep the cache; by default $SOC_CACHE_DIR or ~/.cache/SOC
+    :type directory: str
+    :param max_bytes: size limit of the cache
+    :type max_bytes: int
+    """
+
+    def __init__(self, directory: str = None, max_bytes: int = 2**30):
+        if directory is None:
+            directory = os.environ.get("SOC_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "SOC"))
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, simulation) -> str:
+        """
+        Key of the entry for the state of `simulation`.
+
+        :param simulation: simulation
+        :type simulation: Simulation
+        :rtype: str
+        """
+        params = {name: value for name, value in simulation.params.items() if name not in IGNORED_PARAMS}
+        description = json.dumps(dict(model=simulation.__class__.__name__, params=params), sort_keys=True)
+        return hashlib.sha1(description.encode()).hexdigest()[:16]
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".zarr")
+
+    def __len__(self) -> int:
+        return len(self.entries())
+
+    def entries(self) -> list:
+        """
+        Paths of the entries, least recently used first.
+
+        :rtype: list
+        """
+        paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                 if name.endswith(".zarr")]
+        return sorted(paths, key=_mtime)
+
+    def load(self, simulation) -> int:
+        """
+        Load the cached state for `simulation` into it.
+
+        :param simulation: simulation
+        :type simulation: Simulation
+        :return: number of iterations the cached state was thermalized for; 0 if there is none
+        :rtype: int
+        """
+        path = self._path(self.key(simulation))
+        try:
+            group = zarr.open_group(path, mode='r')
+            iterations = group.attrs['iterations']
+            simulation._load_state(group)
+            os.utime(path)
+        except (FileNotFoundError, KeyError, ValueError):
+            return 0
+        simulation.build_engine()
+        return iterations
+
+    def store(self, simulation, iterations: int):
+        """
+        Save the state of `simulation` as thermalized for `iterations` iterations,
+        then evict old entries if the cache is too big.
+
+        :param simulation: simulation
+        :type simulation: Simulation
+        :param iterations: number of iterations the state was thermalized for
+        :type iterations: int
+        """
+        key = self.key(simulation)
+        path = self._path(key)
+        temporary = os.path.join(self.directory, f"{key}.{os.getpid()}.tmp")
+        group = zarr.open_group(temporary, mode='w')
+        group.attrs['model'] = simulation.__class__.__name__
+        group.attrs['params'] = simulation.params
+        group.attrs['iterations'] = iterations
+        simulation._save_state(group, simulation.STATE_ARRAYS, simulation.STATE_ATTRIBUTES)
+        _publish(temporary, path)
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in `max_bytes`.
+        The most recent entry is always kept.
+        """
+        entries = self.entries()
+        sizes = [_directory_size(path) for path in entries]
+        total = sum(sizes)
+        for path, size in zip(entries[:-1], sizes):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """
+        Remove every entry.
+        """
+        for path in self.entries():
+            shutil.rmtree(path, ignore_errors=True)
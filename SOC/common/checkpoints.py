@@ -0,0 +1,96 @@
+"""Contains helpers for checkpointing simulations: random number generator state and atomic writes."""
+import os
+import shutil
+import numpy as np
+import zarr
+import numba
+from numba import _helperlib
+
+
+def save_array(group, name: str, data: np.ndarray):
+    """
+    Store `data` as a single-chunk array `name` of a zarr group.
+    """
+    create = getattr(group, 'create_array', None) or group.create_dataset
+    array = create(name, shape=data.shape, dtype=data.dtype, chunks=tuple(max(n, 1) for n in data.shape))
+    array[...] = data
+    return array
+
+
+def save_rng_state(group):
+    """
+    Store the state of numpy's global random generator and of numba's
+    (which compiled functions use instead of numpy's) in a zarr group.
+
+    :param group: zarr group
+    """
+    name, keys, position, has_gauss, cached_gaussian = np.random.get_state()
+    save_array(group, 'numpy', keys)
+    group.attrs['numpy'] = dict(name=name, position=int(position), has_gauss=int(has_gauss),
+                                cached_gaussian=float(cached_gaussian))
+    index, numba_keys = _helperlib.rnd_get_state(_helperlib.rnd_get_np_state_ptr())
+    save_array(group, 'numba', np.array(numba_keys, dtype=np.uint32))
+    group.attrs['numba'] = dict(index=int(index))
+
+
+def load_rng_state(group):
+    """
+    Restore the random generator states stored by `save_rng_state`.
+
+    :param group: zarr group
+    """
+    numpy_attrs = group.attrs['numpy']
+    np.random.set_state((numpy_attrs['name'], group['numpy'][:], numpy_attrs['position'],
+                         numpy_attrs['has_gauss'], numpy_attrs['cached_gaussian']))
+    _helperlib.rnd_set_state(_helperlib.rnd_get_np_state_ptr(),
+                             (group.attrs['numba']['index'], [int(key) for key in group['numba'][:]]))
+
+
+@numba.njit
+def _seed_numba(seed: int):
+    np.random.seed(seed)
+
+
+def seed(seed: int):
+    """
+    Seed numpy's global random generator and numba's.
+
+    :param seed: seed, between 0 and 2**32 - 1
+    :type seed: int
+    """
+    np.random.seed(seed)
+    _seed_numba(seed)
+
+
+def replace_directory(source: str, destination: str):
+    """
+    Move the directory `source` to `destination`, replacing it, such that
+    one of the two complete versions of `destination` exists at any time.
+
+    :param source: path of the new directory
+    :type source: str
+    :param destination: path to replace
+    :type destination: str
+    """
+    old = destination + ".old"
+    if os.path.exists(old):
+        shutil.rmtree(old)
+    if os.path.exists(destination):
+        os.rename(destination, old)
+    os.rename(source, destination)
+    if os.path.exists(old):
+        shutil.rmtree(old)
+
+
+def open_checkpoint(filename: str):
+    """
+    Open a checkpoint written by `Simulation.checkpoint`, falling back to the previous
+    one if the job was killed while replacing it.
+
+    :param filename: path of the checkpoint
+    :type filename: str
+    :return: zarr group
+    """
+    if not os.path.exists(filename) and os.path.exists(filename + ".old"):
+        filename = filename + ".old"
+    return zarr.open_group(filename, mode='r')
@@ -0,0 +1,134 @@
+"""Contains the kernels of skip-ahead driving, which deposits grains that start no avalanche in bulk."""
+import numpy as np
+import numba
+
+
+@numba.njit
+def count_at_threshold(values: np.ndarray, critical_value: int, boundary_size: int) -> int:
+    """
+    Number of sites inside the boundary holding exactly `critical_value`,
+    i.e. that topple when they receive one more grain.
+    """
+    count = 0
+    for x in range(boundary_size, values.shape[0] - boundary_size):
+        for y in range(boundary_size, values.shape[1] - boundary_size):
+            count += values[x, y] == critical_value
+    return count
+
+
+@numba.njit
+def mark_at_threshold(values: np.ndarray, critical_value: int, boundary_size: int, mask: np.ndarray) -> int:
+    """
+    Set `mask` at the sites inside the boundary holding exactly `critical_value`, clear it elsewhere.
+
+    :param mask: boolean array of the shape of `values`
+    :type mask: np.ndarray
+    :return: number of sites at the threshold, as `count_at_threshold`
+    """
+    mask[...] = False
+    count = 0
+    for x in range(boundary_size, values.shape[0] - boundary_size):
+        for y in range(boundary_size, values.shape[1] - boundary_size):
+            if values[x, y] == critical_value:
+                mask[x, y] = True
+                count += 1
+    return count
+
+
+@numba.njit
+def update_at_threshold(values: np.ndarray, critical_value: int, boundary_size: int, mask: np.ndarray,
+                        touched: np.ndarray, row: int, at_threshold: int) -> int:
+    """
+    Bring `mask` (see `mark_at_threshold`) and `at_threshold` up to date after an avalanche,
+    going over the sites of its footprint only.
+
+    Before the avalanche, `mask` was set exactly at the sites at the threshold; the avalanche
+    changed `values` only at the sites listed in `touched` and at the driven site, which
+    `drive_at_threshold` has already taken out of `mask`.
+
+    :param touched: touched list of the avalanche, see `footprint`
+    :type touched: np.ndarray
+    :param row: length of a row of the flat indices in `touched` (see `footprint.row_length`)
+    :type row: int
+    :param at_threshold: number of sites set in `mask`
+    :type at_threshold: int
+    :return: the updated `at_threshold`
+    """
+    width, height = values.shape
+    for i in range(1, touched[0] + 1):
+        x, y = touched[i] // row, touched[i] % row
+        if boundary_size <= x < width - boundary_size and boundary_size <= y < height - boundary_size:
+            now = values[x, y] == critical_value
+            if now != mask[x, y]:
+                at_threshold += 1 if now else -1
+                mask[x, y] = now
+    return at_threshold
+
+
+@numba.njit
+def deposit_quiet_grains(values: np.ndarray, critical_value: int, boundary_size: int, mask: np.ndarray,
+                         at_threshold: int, max_grains: int):
+    """
+    Drop grains one at a time on uniformly random sites of a stable lattice, as `drive` does,
+    for as long as they land below the threshold and start no avalanche.
+
+    While `at_threshold` sites are at the threshold, the number of such quiet grains before the
+    next grain that starts an avalanche is geometric, so it is drawn at once, and the quiet grains
+    are dropped on uniformly random sites below the threshold. A quiet grain that brings its site
+    to the threshold changes the odds; the rest of the draw is then discarded and a new one made,
+    which by memorylessness leaves the statistics unchanged.
+
+    :param mask: boolean array set at the sites at the threshold (see `mark_at_threshold`), kept up to date
+    :type mask: np.ndarray
+    :param at_threshold: number of sites at the threshold (see `count_at_threshold`)
+    :type at_threshold: int
+    :param max_grains: drop at most this many grains
+    :type max_grains: int
+    :return: number of quiet grains dropped - if less than `max_grains`, the next grain
+        lands at the threshold (see `drive_at_threshold`) - and the updated `at_threshold`
+    """
+    low, high = boundary_size, values.shape[0] - boundary_size
+    size = (high - low) * (values.shape[1] - 2 * boundary_size)
+    deposited = 0
+    while deposited < max_grains and at_threshold < size:
+        if at_threshold == 0:
+            quiet = max_grains - deposited
+        else:
+            quiet = min(np.random.geometric(at_threshold / size) - 1, max_grains - deposited)
+        changed = False
+        for _ in range(quiet):
+            x = np.random.randint(low, high)
+            y = np.random.randint(boundary_size, values.shape[1] - boundary_size)
+            while values[x, y] >= critical_value:
+                x = np.random.randint(low, high)
+                y = np.random.randint(boundary_size, values.shape[1] - boundary_size)
+            values[x, y] += 1
+            deposited += 1
+            if values[x, y] == critical_value:
+                mask[x, y] = True
+                at_threshold += 1
+                changed = True
+                break
+        if not changed:
+            break
+    return deposited, at_threshold
+
+
+@numba.njit
+def drive_at_threshold(values: np.ndarray, critical_value: int, boundary_size: int,
+                       mask: np.ndarray) -> np.ndarray:
+    """
+    Drop a grain on a uniformly random site among those at the threshold,
+    clearing the site in `mask` (see `deposit_quiet_grains`).
+
+    :return: 1x2 array with the site
+    """
+    location = np.empty((1, 2), dtype=np.int64)
+    while True:
+        x = np.random.randint(boundary_size, values.shape[0] - boundary_size)
+        y = np.random.randint(boundary_size, values.shape[1] - boundary_size)
+        if values[x, y] == critical_value:
+            values[x, y] += 1
+            mask[x, y] = False
+            location[0, 0], location[0, 1] = x, y
+            return location
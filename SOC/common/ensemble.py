@@ -0,0 +1,180 @@
+"""Contains the runner for ensembles of simulations over parameter grids."""
+import concurrent.futures
+import itertools
+import multiprocessing
+import os
+import shutil
+import zlib
+import numpy as np
+import pandas
+import zarr
+from tqdm import auto as tqdm
+from .checkpoints import seed as seed_all
+
+
+def job_name(model, params: dict, replica: int) -> str:
+    """
+    Name of the store of one job of `run_ensemble`.
+
+    :param model: simulation class
+    :param params: keyword arguments of the model
+    :type params: dict
+    :param replica: index of the replica
+    :type replica: int
+    :rtype: str
+    """
+    description = "_".join(f"{name}={value}" for name, value in sorted(params.items()))
+    return f"{model.__name__}_{description}_r{replica}".replace(os.sep, "-")
+
+
+def _job_seed(seed: int, name: str) -> int:
+    """
+    Independent seed for the job `name`, that does not depend on which other jobs are run.
+    """
+    return int(np.random.SeedSequence([seed, zlib.crc32(name.encode())]).generate_state(1)[0])
+
+
+def _summarize(path: str) -> dict:
+    """
+    Number of rows and per-column sums and sums of squares of the observables streamed to `path`
+    (see `read_observables`), from which means and standard deviations pool over replicas.
+
+    Columns are read a chunk at a time, so that long jobs are summarized in bounded memory.
+    """
+    group = zarr.open_group(path, mode='r')
+    arrays = {name: group[name] for name in sorted(group.array_keys())}
+    length = min((array.shape[0] for array in arrays.values()), default=0)
+    sums, sums_of_squares = {}, {}
+    for name, array in arrays.items():
+        total = total_of_squares = 0.
+        for start in range(0, length, array.chunks[0]):
+            values = array[start:min(start + array.chunks[0], length)].astype(float)
+            total += values.sum()
+            total_of_squares += values @ values
+        sums[name], sums_of_squares[name] = float(total), float(total_of_squares)
+    return dict(count=length, sum=sums, sum_of_squares=sums_of_squares)
+
+
+def _run_job(model, params: dict, seed: int, N_iterations: int, run_kwargs: dict, path: str) -> dict:
+    """
+    Run a single job in a worker process, streaming its observables to `path`.
+    """
+    if os.path.exists(path):     # left over by an interrupted job
+        shutil.rmtree(path)
+    seed_all(seed)
+    simulation = model(**params)
+    simulation.run(N_iterations, observables_filename=path, **run_kwargs)
+    summary = _summarize(path)
+    group = zarr.open_group(path, mode='a')
+    group.attrs['params'] = params
+    group.attrs['seed'] = seed
+    group.attrs['summary'] = summary
+    group.attrs['complete'] = True
+    return summary
+
+
+def _finished_summary(path: str):
+    """
+    The summary of the job stored at `path`, or None if it did not finish.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        attrs = zarr.open_group(path, mode='r').attrs
+    except (FileNotFoundError, ValueError):
+        return None
+    return attrs['summary'] if attrs.get('complete', False) else None
+
+
+def run_ensemble(model, grid: dict, N_iterations: int, directory: str,
+                 replicas: int = 1,
+                 seed: int = 0,
+                 max_workers: int = None,
+                 model_kwargs: dict = None,
+                 **run_kwargs) -> pandas.DataFrame:
+    """
+    Run `replicas` simulations for every combination of parameters in `grid` on a local process pool.
+
+    Every job is seeded independently (from `seed` and its name) and streams its observables
+    to its own zarr group in `directory` (see `ObservableStore.stream_to`, `read_observables`),
+    named by `job_name`. Only small per-job summaries travel back to this process. Jobs that
+    finished in an earlier call with the same `directory` are skipped, so an interrupted
+    ensemble continues where it stopped when called again.
+
+    :param model: simulation class, e.g. `Manna`
+    :param grid: lists of values of the model's keyword arguments, e.g. dict(L=[16, 32], critical_value=[1, 2])
+    :type grid: dict
+    :param N_iterations: number of iterations of every run
+    :type N_iterations: int
+    :param directory: where to keep the observables of the jobs
+    :type directory: str
+    :param replicas: number of runs per combination of parameters
+    :type replicas: int
+    :param seed: seed of the whole ensemble
+    :type seed: int
+    :param max_workers: number of processes; 0 runs the jobs one by one in this process
+    :type max_workers: int
+    :param model_kwargs: keyword arguments of the model common to all jobs, e.g. dict(engine="frontier")
+    :type model_kwargs: dict
+    :param run_kwargs: further arguments of `Simulation.run`
+    :return: mean and standard deviation of every observable over all rows of all replicas,
+             indexed by the parameters in `grid`, with the number of finished replicas
+    :rtype: pandas.DataFrame
+    """
+    os.makedirs(directory, exist_ok=True)
+    names = list(grid)
+    points = [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+    wait_for_n_iters = run_kwargs.get('wait_for_n_iters', 10)
+    # with a state cache or "auto", `Simulation.run` thermalizes before the run that saves snapshots
+    thermalized_apart = wait_for_n_iters == "auto" or run_kwargs.get('state_cache') is not None
+    total = N_iterations + (0 if thermalized_apart else wait_for_n_iters)
+
+    summaries = {}
+    pending = {}
+    for point_index, point in enumerate(points):
+        # a single snapshot per run, unless asked otherwise
+        params = dict(dict(save_every=total), **(model_kwargs or {}), **point)
+        for replica in range(replicas):
+            name = job_name(model, dict(model_kwargs or {}, **point), replica)
+            path = os.path.join(directory, name + ".zarr")
+            summary = _finished_summary(path)
+            if summary is None:
+                pending[point_index, replica] = (model, params, _job_seed(seed, name), N_iterations, run_kwargs, path)
+            else:
+                summaries[point_index, replica] = summary
+
+    progress = tqdm.tqdm(total=len(points) * replicas, initial=len(summaries), desc="jobs")
+    if max_workers == 0:
+        for key, job in pending.items():
+            summaries[key] = _run_job(*job)
+            progress.update()
+    else:
+        # numba's threading layer may already run in this process and must not be forked
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        with concurrent.futures.ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context(method)) as executor:
+            futures = {executor.submit(_run_job, *job): key for key, job in pending.items()}
+            for future in concurrent.futures.as_completed(futures):
+                summaries[futures[future]] = future.result()
+                progress.update()
+    progress.close()
+    return _aggregate(names, points, replicas, summaries)
+
+
+def _aggregate(names: list, points: list, replicas: int, summaries: dict) -> pandas.DataFrame:
+    """
+    Pool the per-job summaries of every point of the grid into a table of means and standard deviations.
+    """
+    rows = []
+    for point_index, point in enumerate(points):
+        jobs = [summaries[point_index, replica] for replica in range(replicas)]
+        count = sum(job['count'] for job in jobs)
+        row = dict(point, replicas=len(jobs), rows=count)
+        for column in jobs[0]['sum']:
+            total = sum(job['sum'][column] for job in jobs)
+            total_of_squares = sum(job['sum_of_squares'][column] for job in jobs)
+            mean = total / count if count else np.nan
+            row[f"{column}_mean"] = mean
+            row[f"{column}_std"] = np.sqrt(max(total_of_squares / count - mean**2, 0) * count / (count - 1)) if count > 1 else np.nan
+        rows.append(row)
+    table = pandas.DataFrame(rows)
+    return table.set_index(names) if names else table
@@ -0,0 +1,286 @@
+"""
+Contains the sparse tracking of avalanche footprints.
+
+The sites an avalanche reaches are marked in the simulation's `visited` array and also
+listed in a touched list: an integer array whose first entry is the number of sites listed
+after it, as flat indices. Clearing `visited` and measuring the avalanche size and shape
+(`geometry`) then only go over the listed sites instead of the whole lattice.
+
+`visited` is either a boolean array or a bit-packed uint8 array with 8 sites per byte along
+the second axis (see `visited_array`). The functions below work on both, from Python as well
+as from numba-compiled kernels. Packing only shrinks `visited` itself, from 1 byte to 1/8 byte
+per site: the touched list, which can hold every site, takes 4 bytes per site (see `touched_list`),
+so tracking footprints costs about 4.1 instead of 5 bytes per site.
+
+Touched lists are scratch space, emptied at the start of every avalanche; checkpoints do not
+save them, `relist` rebuilds them from `visited` instead.
+"""
+import numpy as np
+import numba
+from numba.extending import overload
+
+
+def visited_array(width: int, packed: bool = False) -> np.ndarray:
+    """
+    Empty `visited` array for a `width` x `width` lattice.
+
+    :param width: width of the lattice, with boundaries
+    :type width: int
+    :param packed: pack 8 sites per byte
+    :type packed: bool
+    :rtype: np.ndarray
+    """
+    if packed:
+        return np.zeros((width, -(-width // 8)), dtype=np.uint8)
+    return np.zeros((width, width), dtype=bool)
+
+
+def touched_list(width: int) -> np.ndarray:
+    """
+    Empty touched list for a `width` x `width` lattice.
+
+    Flat indices are stored as int32, 4 bytes per site, on lattices small enough for them
+    (widths up to about 46000); as int64 beyond.
+
+    :param width: width of the lattice, with boundaries
+    :type width: int
+    :rtype: np.ndarray
+    """
+    # rows of packed `visited` are rounded up to whole bytes, see `row_length`
+    dtype = np.int32 if width * (width + 8) < 2**31 else np.int64
+    return np.zeros(width * width + 1, dtype=dtype)
+
+
+def relist(mask: np.ndarray, touched: np.ndarray, row: int):
+    """
+    Fill the touched list with the sites set in the boolean `mask`,
+    e.g. to rebuild it from `visited` after loading a checkpoint.
+
+    :param row: length of a row of the flat indices (see `row_length`)
+    :type row: int
+    """
+    x, y = np.nonzero(mask)
+    touched[0] = len(x)
+    touched[1:len(x) + 1] = x * row + y
+
+
+def unpack(visited: np.ndarray, width: int) -> np.ndarray:
+    """
+    `visited` as a boolean `width` x `width` array.
+
+    :rtype: np.ndarray
+    """
+    if visited.dtype == np.bool_:
+        return visited
+    return np.unpackbits(visited, axis=1, count=width, bitorder='little').astype(bool)
+
+
+@numba.njit
+def _mark_bool(visited, touched, x, y):
+    if not visited[x, y]:
+        visited[x, y] = True
+        touched[0] += 1
+        touched[touched[0]] = x * visited.shape[1] + y
+
+
+@numba.njit
+def _mark_packed(visited, touched, x, y):
+    bit = np.uint8(1 << (y & 7))
+    if not visited[x, y >> 3] & bit:
+        visited[x, y >> 3] |= bit
+        touched[0] += 1
+        touched[touched[0]] = x * visited.shape[1] * 8 + y
+
+
+@numba.njit
+def _clear_bool(visited, touched):
+    for i in range(1, touched[0] + 1):
+        visited[touched[i] // visited.shape[1], touched[i] % visited.shape[1]] = False
+    touched[0] = 0
+
+
+@numba.njit
+def _clear_packed(visited, touched):
+    row = visited.shape[1] * 8
+    for i in range(1, touched[0] + 1):
+        x, y = touched[i] // row, touched[i] % row
+        visited[x, y >> 3] &= ~np.uint8(1 << (y & 7))
+    touched[0] = 0
+
+
+@numba.njit
+def _size(row, touched, boundary_size, width, height):
+    size = 0
+    for i in range(1, touched[0] + 1):
+        x, y = touched[i] // row, touched[i] % row
+        if boundary_size <= x < width - boundary_size and boundary_size <= y < height - boundary_size:
+            size += 1
+    return size
+
+
+@numba.njit
+def _gyration_radius(n, sx, sy, sxx, syy):
+    if n == 0:
+        return 0.
+    return np.sqrt(max((sxx + syy) / n - (sx / n) ** 2 - (sy / n) ** 2, 0.))
+
+
+@numba.njit
+def _geometry(row, touched, boundary_size, width, height):
+    n = sx = sy = sxx = syy = 0
+    x_min, x_max, y_min, y_max = width, -1, height, -1
+    for i in range(1, touched[0] + 1):
+        x, y = touched[i] // row, touched[i] % row
+        if boundary_size <= x < width - boundary_size and boundary_size <= y < height - boundary_size:
+            n += 1
+            sx += x
+            sy += y
+            sxx += x * x
+            syy += y * y
+            x_min, x_max = min(x_min, x), max(x_max, x)
+            y_min, y_max = min(y_min, y), max(y_max, y)
+    if n == 0:
+        return 0, 0, 0.
+    return x_max - x_min + 1, y_max - y_min + 1, _gyration_radius(n, sx, sy, sxx, syy)
+
+
+def row_length(visited: np.ndarray) -> int:
+    """
+    Length of a row of the flat indices in the touched list of `visited`:
+    site (`x`, `y`) is listed as `x * row_length(visited) + y`.
+
+    :rtype: int
+    """
+    return visited.shape[1] if visited.dtype == np.bool_ else visited.shape[1] * 8
+
+
+def mark(visited: np.ndarray, touched: np.ndarray, x: int, y: int):
+    """
+    Mark site (`x`, `y`) as visited, listing it if it was not yet.
+    """
+    if visited.dtype == np.bool_:
+        _mark_bool(visited, touched, x, y)
+    else:
+        _mark_packed(visited, touched, x, y)
+
+
+def clear(visited: np.ndarray, touched: np.ndarray):
+    """
+    Unmark the listed sites and empty the list.
+    """
+    if visited.dtype == np.bool_:
+        _clear_bool(visited, touched)
+    else:
+        _clear_packed(visited, touched)
+
+
+def size(visited: np.ndarray, touched: np.ndarray, boundary_size: int, width: int, height: int) -> int:
+    """
+    Number of listed sites inside the boundary of a `width` x `height` lattice: the avalanche size.
+
+    :rtype: int
+    """
+    return _size(row_length(visited), touched, boundary_size, width, height)
+
+
+def geometry(visited: np.ndarray, touched: np.ndarray, boundary_size: int, width: int, height: int):
+    """
+    Shape of the listed sites inside the boundary of a `width` x `height` lattice:
+    the avalanche's extent along both axes (sides of its bounding box) and its radius of gyration.
+
+    The sums of coordinates behind the radius are kept in integers, so the result does not
+    depend on the order of the list and equals `mask_geometry` of the same sites.
+
+    :return: extent along the first axis, extent along the second axis, radius of gyration
+    :rtype: tuple
+    """
+    return _geometry(row_length(visited), touched, boundary_size, width, height)
+
+
+@numba.njit
+def mask_geometry(mask: np.ndarray, boundary_size: int):
+    """
+    `geometry` of the sites set in a boolean `mask` inside the boundary,
+    for engines that keep no touched list.
+
+    :rtype: tuple
+    """
+    n = sx = sy = sxx = syy = 0
+    x_min, x_max, y_min, y_max = mask.shape[0], -1, mask.shape[1], -1
+    for x in range(boundary_size, mask.shape[0] - boundary_size):
+        for y in range(boundary_size, mask.shape[1] - boundary_size):
+            if mask[x, y]:
+                n += 1
+                sx += x
+                sy += y
+                sxx += x * x
+                syy += y * y
+                x_min, x_max = min(x_min, x), max(x_max, x)
+                y_min, y_max = min(y_min, y), max(y_max, y)
+    if n == 0:
+        return 0, 0, 0.
+    return x_max - x_min + 1, y_max - y_min + 1, _gyration_radius(n, sx, sy, sxx, syy)
+
+
+@overload(mark)
+def _overload_mark(visited, touched, x, y):
+    if visited.dtype == numba.types.boolean:
+        return lambda visited, touched, x, y: _mark_bool(visited, touched, x, y)
+    return lambda visited, touched, x, y: _mark_packed(visited, touched, x, y)
+
+
+@overload(clear)
+def _overload_clear(visited, touched):
+    if visited.dtype == numba.types.boolean:
+        return lambda visited, touched: _clear_bool(visited, touched)
+    return lambda visited, touched: _clear_packed(visited, touched)
+
+
+@overload(size)
+def _overload_size(visited, touched, boundary_size, width, height):
+    if visited.dtype == numba.types.boolean:
+        return lambda visited, touched, boundary_size, width, height: _size(
+            visited.shape[1], touched, boundary_size, width, height)
+    return lambda visited, touched, boundary_size, width, height: _size(
+        visited.shape[1] * 8, touched, boundary_size, width, height)
+
+
+@overload(geometry)
+def _overload_geometry(visited, touched, boundary_size, width, height):
+    if visited.dtype == numba.types.boolean:
+        return lambda visited, touched, boundary_size, width, height: _geometry(
+            visited.shape[1], touched, boundary_size, width, height)
+    return lambda visited, touched, boundary_size, width, height: _geometry(
+        visited.shape[1] * 8, touched, boundary_size, width, height)
+
+
+@numba.njit
+def mark_mask(visited: np.ndarray, touched: np.ndarray, mask: np.ndarray):
+    """
+    Mark every site where the boolean `mask` is set.
+    """
+    for x in range(mask.shape[0]):
+        for y in range(mask.shape[1]):
+            if mask[x, y]:
+                mark(visited, touched, x, y)
+
+
+@numba.njit
+def increment(counts: np.ndarray, touched: np.ndarray, x: int, y: int):
+    """
+    Increment `counts` at site (`x`, `y`), listing the site if it was zero.
+    """
+    if counts[x, y] == 0:
+        touched[0] += 1
+        touched[touched[0]] = x * counts.shape[1] + y
+    counts[x, y] += 1
+
+
+@numba.njit
+def clear_counts(counts: np.ndarray, touched: np.ndarray):
+    """
+    Zero `counts` at the listed sites and empty the list.
+    """
+    for i in range(1, touched[0] + 1):
+        counts[touched[i] // counts.shape[1], touched[i] % counts.shape[1]] = 0
+    touched[0] = 0
@@ -0,0 +1,293 @@
+"""Contains the columnar store for observables gathered during a simulation."""
+import os
+import numpy as np
+import pandas
+import zarr
+from .powerlaw import LogHistogram
+
+#: Compact default dtypes of the observables; columns are widened automatically if a value does not fit.
+DTYPES = dict(
+    AvalancheSize=np.uint32,
+    NumberOfReleases=np.uint32,
+    number_of_iterations=np.uint16,
+)
+
+
+def _fit(dtype: np.dtype, values: np.ndarray) -> np.dtype:
+    """
+    Smallest widening of `dtype` that can hold all of `values`.
+
+    :param dtype: current dtype of the column
+    :type dtype: np.dtype
+    :param values: new values for the column
+    :type values: np.ndarray
+    :rtype: np.dtype
+    """
+    dtype = np.dtype(dtype)
+    if values.size == 0 or np.can_cast(values.dtype, dtype, casting='safe'):
+        return dtype
+    if dtype.kind == 'f' or values.dtype.kind not in 'biu':
+        return np.promote_types(dtype, values.dtype)
+    low, high = values.min(), values.max()
+    while not (np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max):
+        if dtype.kind == 'u' and low < 0:
+            dtype = np.dtype(f"i{min(2 * dtype.itemsize, 8)}")
+        elif dtype.itemsize == 8:
+            return np.dtype(np.float64)
+        else:
+            dtype = np.dtype(f"{dtype.kind}{2 * dtype.itemsize}")
+    return dtype
+
+
+class ObservableStore:
+    """
+    Growable struct-of-arrays buffer for the observables of a simulation.
+
+    Every observable is kept in its own numpy array with a compact dtype (see `DTYPES`),
+    grown by doubling. `to_dataframe` returns a zero-copy DataFrame over the filled part
+    of the arrays, cached until new data arrives.
+
+    After `stream_to`, full chunks of rows are appended to an on-disk zarr group and
+    dropped from memory, so memory use stays bounded however many rows are added.
+
+    Every column is also summarized in a `LogHistogram` (see `histograms`), kept up to
+    date block by block, so that distributions can be fitted without the rows.
+
+    :param dtypes: dtypes of the columns, on top of `DTYPES`; other columns take the dtype of their first value
+    :type dtypes: dict
+    :param capacity: initial number of rows
+    :type capacity: int
+    """
+
+    def __init__(self, dtypes: dict = None, capacity: int = 1024):
+        self.dtypes = dict(DTYPES, **(dtypes or {}))
+        self._arrays = {}
+        self._capacity = capacity
+        self._length = 0
+        self._dataframe = None
+        self._group = None
+        self._path = None
+        self._flushed = 0
+        self._histograms = {}
+        # number of rows already counted in the histograms
+        self._histogrammed = 0
+
+    def __len__(self) -> int:
+        return self._flushed + self._length
+
+    @property
+    def columns(self) -> dict:
+        """
+        Every column, read back from disk if it is being streamed. Without streaming,
+        these are views of the filled part of the in-memory arrays.
+
+        :rtype: dict
+        """
+        columns = {name: array[:self._length] for name, array in self._arrays.items()}
+        if self._flushed:
+            columns = {name: np.concatenate([self._group[name][:self._flushed], column])
+                       for name, column in columns.items()}
+        return columns
+
+    @property
+    def histograms(self) -> dict:
+        """
+        Log-binned histogram of every column, over all the rows gathered so far.
+
+        :rtype: dict
+        """
+        self._update_histograms()
+        return self._histograms
+
+    def _update_histograms(self):
+        """
+        Count the rows added since the last update in the histograms.
+        """
+        if self._histogrammed == len(self):
+            return
+        for name, array in self._arrays.items():
+            histogram = self._histograms.setdefault(name, LogHistogram())
+            if self._histogrammed < self._flushed:
+                # only in checkpoints saved without histograms
+                stored = self._group[name]
+                for start in range(self._histogrammed, self._flushed, self._chunk_size):
+                    histogram.add(stored[start:min(start + self._chunk_size, self._flushed)])
+            histogram.add(array[max(self._histogrammed - self._flushed, 0):self._length])
+        self._histogrammed = len(self)
+
+    def stream_to(self, path, chunk_size: int = 2**16):
+        """
+        Keep the gathered observables in an appendable zarr group on disk from now on.
+
+        Rows are written in chunks of `chunk_size`; the rows already in memory are
+        written immediately. The group can be read with `read_observables` while
+        data is still being added.
+
+        :param path: path of the zarr group (str or path-like), or an open zarr group
+        :param chunk_size: number of rows per write (and per zarr chunk)
+        :type chunk_size: int
+        """
+        if isinstance(path, (str, os.PathLike)):
+            path = os.fspath(path)
+            self._group, self._path = zarr.open_group(path, mode='a'), path
+        else:
+            self._group, self._path = path, None
+        self._chunk_size = chunk_size
+        self.flush()
+
+    def flush(self):
+        """
+        Write all rows held in memory to disk, if streaming.
+        """
+        self._flush(self._length)
+
+    def _flush(self, n: int):
+        if self._group is None or n == 0:
+            return
+        self._update_histograms()
+        for name, array in self._arrays.items():
+            if name not in self._group:
+                _create_array(self._group, name, array.dtype, self._chunk_size)
+            stored = self._group[name]
+            if _fit(stored.dtype, array[:n]) != stored.dtype:
+                # rare: rewrite the column on disk with the wider dtype
+                old = stored[:]
+                del self._group[name]
+                stored = _create_array(self._group, name, _fit(old.dtype, array[:n]), self._chunk_size)
+                stored.append(old)
+            stored.append(array[:n])
+            array[:self._length - n] = array[n:self._length]
+        self._flushed += n
+        self._length -= n
+        self._dataframe = None
+
+    def checkpoint(self, group):
+        """
+        Save the store into a zarr group. If streaming, the rows are flushed to disk
+        and only their number is saved.
+
+        :param group: zarr group
+        """
+        if self._group is not None:
+            if self._path is None:
+                raise ValueError("Only observables streamed to a path can be checkpointed")
+            self.flush()
+            group.attrs['stream'] = dict(path=self._path, length=len(self), chunk_size=self._chunk_size)
+        group.attrs['columns'] = list(self._arrays)
+        group.attrs['histograms'] = {name: histogram.to_dict() for name, histogram in self.histograms.items()}
+        if self._group is not None:
+            return
+        for name, column in self.columns.items():
+            _create_array(group, name, column.dtype, max(len(self), 1)).append(column)
+
+    @classmethod
+    def from_checkpoint(cls, group) -> "ObservableStore":
+        """
+        Restore a store saved by `checkpoint`. Streamed observables written after
+        the checkpoint are dropped from disk.
+
+        :param group: zarr group
+        :rtype: ObservableStore
+        """
+        self = cls()
+        stream = group.attrs.get('stream')
+        if stream is None:
+            self.extend({name: group[name][:] for name in group.attrs['columns']})
+        else:
+            self._group = zarr.open_group(stream['path'], mode='a')
+            self._path, self._chunk_size = stream['path'], stream['chunk_size']
+            for name in group.attrs['columns']:
+                self._group[name].resize((stream['length'],))
+                self._arrays[name] = np.empty(self._capacity, dtype=self._group[name].dtype)
+            self._flushed = stream['length']
+        if 'histograms' in group.attrs:
+            self._histograms = {name: LogHistogram.from_dict(state)
+                                for name, state in group.attrs['histograms'].items()}
+            self._histogrammed = len(self)
+        return self
+
+    def _reserve(self, n: int):
+        if self._length + n > self._capacity:
+            while self._length + n > self._capacity:
+                self._capacity *= 2
+            for name, array in self._arrays.items():
+                grown = np.empty(self._capacity, dtype=array.dtype)
+                grown[:self._length] = array[:self._length]
+                self._arrays[name] = grown
+
+    def _column(self, name: str, values: np.ndarray) -> np.ndarray:
+        """
+        The array for column `name`, created or widened so that it can hold `values`.
+        """
+        array = self._arrays.get(name)
+        if array is None:
+            if self._length > 0:
+                raise KeyError(f"Unknown observable {name!r}")
+            array = self._arrays[name] = np.empty(self._capacity, dtype=self.dtypes.get(name, values.dtype))
+        dtype = _fit(array.dtype, values)
+        if dtype != array.dtype:
+            array = self._arrays[name] = array.astype(dtype)
+        return array
+
+    def append(self, observables: dict):
+        """
+        Add a single row of observables.
+
+        :param observables: dictionary of scalar observables, as returned by `Simulation.AvalancheLoop`
+        :type observables: dict
+        """
+        self.extend({name: np.asarray(value)[np.newaxis] for name, value in observables.items()})
+
+    def extend(self, columns: dict):
+        """
+        Add a block of rows.
+
+        :param columns: dictionary of equally long observable arrays
+        :type columns: dict
+        """
+        n = len(next(iter(columns.values()))) if columns else 0
+        if n == 0:
+            return
+        if self._arrays and set(columns) != set(self._arrays):
+            raise KeyError(f"Observables {sorted(columns)} do not match the stored {sorted(self._arrays)}")
+        self._reserve(n)
+        for name, values in columns.items():
+            values = np.asarray(values)
+            self._column(name, values)[self._length:self._length + n] = values
+        self._length += n
+        self._dataframe = None
+        if self._group is not None and self._length >= self._chunk_size:
+            # write up to a chunk boundary on disk
+            self._flush(len(self) - len(self) % self._chunk_size - self._flushed)
+
+    def to_dataframe(self) -> pandas.DataFrame:
+        """
+        The gathered observables as a DataFrame sharing memory with the store
+        (unless it is being streamed to disk).
+
+        :rtype: pandas.DataFrame
+        """
+        if self._dataframe is None:
+            self._dataframe = pandas.DataFrame(self.columns, copy=False)
+        return self._dataframe
+
+
+def _create_array(group, name: str, dtype: np.dtype, chunk_size: int):
+    create = getattr(group, 'create_array', None) or group.create_dataset
+    return create(name, shape=(0,), chunks=(chunk_size,), dtype=dtype)
+
+
+def read_observables(path) -> pandas.DataFrame:
+    """
+    Read the observables streamed to disk by `ObservableStore.stream_to`.
+
+    Safe to use while the simulation is still writing: only the rows that
+    are already complete in every column are returned.
+
+    :param path: path of the zarr group
+    :rtype: pandas.DataFrame
+    """
+    group = zarr.open_group(path, mode='r')
+    arrays = {name: group[name] for name in sorted(group.array_keys())}
+    length = min((array.shape[0] for array in arrays.values()), default=0)
+    return pandas.DataFrame({name: array[:length] for name, array in arrays.items()})
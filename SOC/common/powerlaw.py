@@ -0,0 +1,345 @@
+"""Contains streaming log-binned histograms of observables and maximum-likelihood power-law fits to them."""
+import numpy as np
+import numba
+
+#: default resolution of `LogHistogram`
+BINS_PER_DECADE = 20
+#: the bins of `LogHistogram` reach up to 10**MAX_DECADE
+MAX_DECADE = 18
+
+# B_2j / (2j)! for the Euler-Maclaurin tail of `hurwitz_zeta`
+_BERNOULLI = np.array([1 / 12, -1 / 720, 1 / 30240, -1 / 1209600, 1 / 47900160,
+                       -691 / 1307674368000, 1 / 74724249600])
+
+
+def bin_edges(bins_per_decade: int = BINS_PER_DECADE) -> np.ndarray:
+    """
+    Edges of the bins of `LogHistogram`: integers spaced by a factor of 10**(1 / `bins_per_decade`),
+    so that bin i holds the values `edges[i] <= x < edges[i + 1]`. Below about `bins_per_decade`,
+    every integer gets its own bin.
+
+    :rtype: np.ndarray
+    """
+    exponents = np.arange(MAX_DECADE * bins_per_decade + 1) / bins_per_decade
+    return np.unique(np.ceil(10.**exponents))
+
+
+class LogHistogram:
+    """
+    Histogram of an observable in logarithmic bins (see `bin_edges`), accumulated block by block,
+    so that it takes O(bins) memory however many values it has seen.
+
+    Values below 1 (e.g. avalanches that did not happen) are only counted in `underflow`.
+
+    :param bins_per_decade: number of bins per factor of 10
+    :type bins_per_decade: int
+    """
+
+    def __init__(self, bins_per_decade: int = BINS_PER_DECADE):
+        self.bins_per_decade = bins_per_decade
+        self.edges = bin_edges(bins_per_decade)
+        self.counts = np.zeros(self.edges.size - 1, dtype=np.int64)
+        self.underflow = 0
+        #: whether the observable takes integer values; decided by the first block
+        self.discrete = None
+
+    @property
+    def total(self) -> int:
+        """
+        Number of values seen, including `underflow`.
+
+        :rtype: int
+        """
+        return int(self.counts.sum()) + self.underflow
+
+    def add(self, values: np.ndarray):
+        """
+        Count a block of values.
+
+        :param values: 1D array
+        :type values: np.ndarray
+        """
+        values = np.asarray(values)
+        if values.size == 0:
+            return
+        if self.discrete is None:
+            self.discrete = values.dtype.kind in 'biu'
+        index = np.searchsorted(self.edges, values, side='right') - 1
+        self.underflow += int(np.count_nonzero(index < 0))
+        index = np.minimum(index[index >= 0], self.counts.size - 1)
+        self.counts += np.bincount(index, minlength=self.counts.size)
+
+    def __iadd__(self, other: "LogHistogram") -> "LogHistogram":
+        if other.bins_per_decade != self.bins_per_decade:
+            raise ValueError("Histograms with different bins cannot be merged")
+        self.counts += other.counts
+        self.underflow += other.underflow
+        if self.discrete is None:
+            self.discrete = other.discrete
+        return self
+
+    def density(self):
+        """
+        The normalized histogram, for plotting: counts divided by the number of values
+        and the widths of the bins, at the geometric centers of the non-empty bins.
+
+        :return: centers, density
+        :rtype: tuple
+        """
+        nonzero = self.counts > 0
+        low, high = self.edges[:-1][nonzero], self.edges[1:][nonzero]
+        if self.discrete:
+            # the bin holds the integers low, ..., high - 1
+            centers, widths = np.sqrt(low * (high - 1)), high - low
+        else:
+            centers, widths = np.sqrt(low * high), high - low
+        return centers, self.counts[nonzero] / widths / max(self.total, 1)
+
+    def to_dict(self) -> dict:
+        """
+        JSON-serializable state, for checkpoints (see `from_dict`).
+
+        :rtype: dict
+        """
+        last = np.flatnonzero(self.counts)
+        counts = self.counts[:last[-1] + 1] if last.size else self.counts[:0]
+        return dict(bins_per_decade=self.bins_per_decade, counts=counts.tolist(),
+                    underflow=self.underflow, discrete=self.discrete)
+
+    @classmethod
+    def from_dict(cls, state: dict) -> "LogHistogram":
+        """
+        Restore a histogram saved by `to_dict`.
+
+        :rtype: LogHistogram
+        """
+        self = cls(state['bins_per_decade'])
+        self.counts[:len(state['counts'])] = state['counts']
+        self.underflow = state['underflow']
+        self.discrete = state['discrete']
+        return self
+
+
+@numba.njit
+def hurwitz_zeta(s: float, q: float) -> float:
+    """
+    Hurwitz zeta function, sum of (q + k)**-s over k >= 0, for s > 1 and q > 0.
+
+    Sums the first terms directly until q + k >= 10, then adds the Euler-Maclaurin
+    tail, accurate to double precision from there on.
+
+    :rtype: float
+    """
+    total = 0.
+    while q < 10.:
+        total += q ** -s
+        q += 1.
+    total += q ** (1. - s) / (s - 1.) + 0.5 * q ** -s
+    term = s * q ** (-s - 1.)
+    for j in range(_BERNOULLI.shape[0]):
+        total += _BERNOULLI[j] * term
+        term *= (s + 2 * j + 1) * (s + 2 * j + 2) / (q * q)
+    return total
+
+
+@numba.njit
+def _tail(alpha: float, x: float, discrete: bool) -> float:
+    """
+    Unnormalized probability of the values >= `x` under the power law x**-alpha.
+    """
+    if x == np.inf:
+        return 0.
+    if discrete:
+        return hurwitz_zeta(alpha, x)
+    return x ** (1. - alpha) / (alpha - 1.)
+
+
+@numba.njit
+def _log_likelihood(alpha: float, counts: np.ndarray, edges: np.ndarray, first: int, stop: int,
+                    upper: float, discrete: bool) -> float:
+    """
+    Log-likelihood of the counts of bins `first` to `stop` - 1 under the power law with exponent
+    `alpha`, restricted to the values `edges[first] <= x < upper` (Virkar & Clauset 2014).
+    """
+    norm = _tail(alpha, edges[first], discrete) - _tail(alpha, upper, discrete)
+    total = 0.
+    n = 0
+    high = _tail(alpha, edges[first], discrete)
+    for i in range(first, stop):
+        low = high
+        high = _tail(alpha, edges[i + 1] if i + 1 < stop else upper, discrete)
+        if counts[i] > 0:
+            total += counts[i] * np.log(max(low - high, 1e-300))
+            n += counts[i]
+    return total - n * np.log(norm)
+
+
+@numba.njit
+def _maximize(counts: np.ndarray, edges: np.ndarray, first: int, stop: int, upper: float, discrete: bool) -> float:
+    """
+    Maximum-likelihood exponent, by golden-section search (the log-likelihood is unimodal).
+    Exponents up to 1 are only normalizable with an upper cutoff.
+    """
+    a, b = (1e-3 if upper < np.inf else 1. + 1e-6), 10.
+    ratio = (np.sqrt(5.) - 1.) / 2.
+    c, d = b - ratio * (b - a), a + ratio * (b - a)
+    fc = _log_likelihood(c, counts, edges, first, stop, upper, discrete)
+    fd = _log_likelihood(d, counts, edges, first, stop, upper, discrete)
+    while b - a > 1e-9:
+        if fc > fd:
+            b, d, fd = d, c, fc
+            c = b - ratio * (b - a)
+            fc = _log_likelihood(c, counts, edges, first, stop, upper, discrete)
+        else:
+            a, c, fc = c, d, fd
+            d = a + ratio * (b - a)
+            fd = _log_likelihood(d, counts, edges, first, stop, upper, discrete)
+    return (a + b) / 2.
+
+
+@numba.njit
+def _ks_distance(alpha: float, counts: np.ndarray, edges: np.ndarray, first: int, stop: int,
+                 upper: float, discrete: bool) -> float:
+    """
+    Largest difference between the empirical and fitted cumulative distributions, at the bin edges.
+    """
+    n = counts[first:stop].sum()
+    top = _tail(alpha, upper, discrete)
+    norm = _tail(alpha, edges[first], discrete) - top
+    seen = 0
+    distance = 0.
+    for i in range(first, stop - 1):
+        seen += counts[i]
+        model = 1. - (_tail(alpha, edges[i + 1], discrete) - top) / norm
+        distance = max(distance, abs(seen / n - model))
+    return distance
+
+
+@numba.njit
+def _fit(counts: np.ndarray, edges: np.ndarray, fixed_first: int, stop: int, upper: float,
+         discrete: bool, min_tail: int, min_decades: float):
+    """
+    Fit the bins below `stop`, from bin `fixed_first` on or, if it is negative, from the bin that
+    minimizes the KS distance among those leaving at least `min_tail` values in two or more bins,
+    spanning at least `min_decades` decades.
+
+    :return: exponent, first bin, KS distance; a negative first bin if nothing could be fitted
+    """
+    best_alpha, best_first, best_distance = np.nan, -1, np.inf
+    tail = counts[:stop].sum()
+    nonempty = (counts[:stop] > 0).sum()
+    top = edges[stop]
+    for first in range(stop):
+        if first > 0:
+            tail -= counts[first - 1]
+            nonempty -= counts[first - 1] > 0
+        if fixed_first >= 0 and first != fixed_first:
+            continue
+        if tail < min_tail or nonempty < 2 or top < edges[first] * 10. ** min_decades:
+            break
+        alpha = _maximize(counts, edges, first, stop, upper, discrete)
+        distance = _ks_distance(alpha, counts, edges, first, stop, upper, discrete)
+        if distance < best_distance:
+            best_alpha, best_first, best_distance = alpha, first, distance
+    return best_alpha, best_first, best_distance
+
+
+@numba.njit(parallel=True)
+def _bootstrap(counts: np.ndarray, edges: np.ndarray, fixed_first: int, stop: int, upper: float,
+               discrete: bool, min_tail: int, min_decades: float, seeds: np.ndarray) -> np.ndarray:
+    """
+    Exponents fitted to resamplings of the values counted in `counts`, one per seed, in parallel.
+    """
+    exponents = np.empty(seeds.shape[0])
+    total = counts.sum()
+    for k in numba.prange(seeds.shape[0]):
+        np.random.seed(seeds[k])
+        resampled = np.zeros_like(counts)
+        left, p_left = total, 1.
+        for i in range(counts.shape[0]):
+            if left == 0 or counts[i] == 0:
+                continue
+            p = counts[i] / total
+            resampled[i] = np.random.binomial(left, min(p / p_left, 1.))
+            left -= resampled[i]
+            p_left -= p
+        exponents[k] = _fit(resampled, edges, fixed_first, stop, upper, discrete, min_tail, min_decades)[0]
+    return exponents
+
+
+def fit_power_law(histogram: LogHistogram,
+                  xmin: float = None,
+                  xmax: float = None,
+                  n_bootstrap: int = 0,
+                  confidence: float = 0.95,
+                  min_tail: int = 50,
+                  min_decades: float = 1.) -> dict:
+    """
+    Maximum-likelihood fit of a power law p(x) ~ x**-exponent to a `LogHistogram`.
+
+    The likelihood of the binned counts is exact for the discrete (zeta) distribution of integer
+    observables, and for the continuous one otherwise. Unless given, `xmin` is the bin edge that
+    minimizes the Kolmogorov-Smirnov distance between the data above it and the fit
+    (Clauset, Shalizi & Newman 2009), among those leaving at least `min_decades` decades of
+    data to fit - which keeps it from settling on the finite-size bump at the end of the
+    distribution. The confidence interval comes from `n_bootstrap`
+    resamplings of the data, each fitted the same way (xmin included), in parallel; it depends
+    only on numpy's global random generator.
+
+    :param histogram: histogram of the observable
+    :type histogram: LogHistogram
+    :param xmin: fit only the values from the bin edge at or above `xmin` on; chosen automatically if None
+    :type xmin: float
+    :param xmax: fit only the values below the bin edge at or below `xmax`; no upper cutoff if None
+    :type xmax: float
+    :param n_bootstrap: number of resamplings for the confidence interval; none if 0
+    :type n_bootstrap: int
+    :param confidence: coverage of the confidence interval
+    :type confidence: float
+    :param min_tail: least number of values above an automatically chosen `xmin`
+    :type min_tail: int
+    :param min_decades: least span of the fitted data above an automatically chosen `xmin`, in decades
+    :type min_decades: float
+    :return: `exponent`, `xmin`, `xmax` (as bin edges; xmax is inf without a cutoff), `ks` distance,
+        `n_tail` number of fitted values and, with `n_bootstrap`, the `confidence_interval`
+    :rtype: dict
+    """
+    counts, edges = histogram.counts, histogram.edges
+    discrete = bool(histogram.discrete)
+    nonzero = np.flatnonzero(counts)
+    if xmax is None:
+        stop, upper = (nonzero[-1] + 1 if nonzero.size else 0), np.inf
+    else:
+        stop = int(np.searchsorted(edges, xmax, side='right')) - 1
+        upper = edges[stop]
+    fixed_first = -1 if xmin is None else int(np.searchsorted(edges, xmin, side='left'))
+    if xmin is not None:
+        min_tail, min_decades = 1, 0.
+    exponent, first, distance = _fit(counts, edges, fixed_first, stop, upper, discrete, min_tail, min_decades)
+    if first < 0:
+        raise ValueError("Too few values to fit a power law")
+    result = dict(exponent=exponent, xmin=float(edges[first]), xmax=float(upper), ks=distance,
+                  n_tail=int(counts[first:stop].sum()))
+    if n_bootstrap:
+        seeds = np.random.randint(2**31, size=n_bootstrap)
+        exponents = _bootstrap(counts, edges, fixed_first, stop, upper, discrete, min_tail, min_decades, seeds)
+        exponents = exponents[np.isfinite(exponents)]
+        low, high = np.quantile(exponents, [(1 - confidence) / 2, (1 + confidence) / 2])
+        result['confidence_interval'] = (float(low), float(high))
+    return result
+
+
+def power_law_density(x: np.ndarray, fit: dict, histogram: LogHistogram) -> np.ndarray:
+    """
+    The fitted power law, normalized like `LogHistogram.density`, for plotting over the data.
+
+    :param x: points at which to evaluate it
+    :type x: np.ndarray
+    :param fit: result of `fit_power_law` on `histogram`
+    :type fit: dict
+    :rtype: np.ndarray
+    """
+    discrete = bool(histogram.discrete)
+    alpha = fit['exponent']
+    norm = _tail(alpha, fit['xmin'], discrete) - _tail(alpha, fit['xmax'], discrete)
+    return fit['n_tail'] / histogram.total * np.asarray(x, dtype=float) ** -alpha / norm
@@ -0,0 +1,251 @@
+"""Contains the multi-resolution pyramids of snapshots, for viewing very large lattices."""
+import numpy as np
+import numba
+import zarr
+from .checkpoints import save_array
+from .snapshots import Snapshots, SnapshotWriter
+
+REDUCTIONS = ("mean", "max")
+
+
+@numba.njit(parallel=True)
+def reduce_level(mean: np.ndarray, maximum: np.ndarray, block: int, width: int, height: int,
+                 out_mean: np.ndarray, out_max: np.ndarray):
+    """
+    One level up a pyramid: mean and maximum over 2x2 blocks of the level below.
+
+    The level below covers a `width` x `height` lattice with blocks of `block` x `block` sites,
+    cut short at the far edges; the means are weighted by the number of sites in the blocks,
+    so that every level holds the exact means of its blocks of the lattice.
+
+    :param mean: means of the level below (the lattice itself, with `block` 1)
+    :param maximum: maxima of the level below (again the lattice itself, with `block` 1)
+    :param block: linear size of the blocks of the level below
+    :param width: first dimension of the lattice
+    :param height: second dimension of the lattice
+    :param out_mean: means of this level, of shape ceil(`mean.shape` / 2)
+    :param out_max: maxima of this level
+    """
+    full_rows = width // (2 * block)
+    full_columns = height // (2 * block)
+    for i in numba.prange(out_mean.shape[0]):
+        for j in range(out_mean.shape[1]):
+            if i < full_rows and j < full_columns:
+                out_mean[i, j] = (np.float64(mean[2 * i, 2 * j]) + mean[2 * i, 2 * j + 1]
+                                  + mean[2 * i + 1, 2 * j] + mean[2 * i + 1, 2 * j + 1]) / 4
+                out_max[i, j] = max(max(maximum[2 * i, 2 * j], maximum[2 * i, 2 * j + 1]),
+                                    max(maximum[2 * i + 1, 2 * j], maximum[2 * i + 1, 2 * j + 1]))
+                continue
+            # blocks cut short at the far edges
+            total = 0.
+            count = 0
+            largest = maximum[2 * i, 2 * j]
+            for a in range(2 * i, min(2 * i + 2, mean.shape[0])):
+                rows = min(block, width - a * block)
+                for b in range(2 * j, min(2 * j + 2, mean.shape[1])):
+                    sites = rows * min(block, height - b * block)
+                    total += mean[a, b] * sites
+                    count += sites
+                    largest = max(largest, maximum[a, b])
+            out_mean[i, j] = total / count
+            out_max[i, j] = largest
+
+
+def level_shape(shape: tuple, level: int) -> tuple:
+    """
+    Shape of `level` of the pyramid of a lattice of `shape`; level 0 is the lattice itself.
+
+    :rtype: tuple
+    """
+    return tuple(-(-n // 2**level) for n in shape)
+
+
+def max_levels(shape: tuple) -> int:
+    """
+    Number of levels of the pyramid of a lattice of `shape` up to a single block.
+
+    :rtype: int
+    """
+    return int(np.ceil(np.log2(max(shape))))
+
+
+def reduce(frame: np.ndarray, levels: int) -> list:
+    """
+    Pyramid of a lattice, every level computed from the one below.
+
+    :param frame: lattice
+    :type frame: np.ndarray
+    :param levels: number of levels above the lattice
+    :type levels: int
+    :return: (means, maxima) of levels 1 to `levels`
+    :rtype: list
+    """
+    width, height = frame.shape
+    mean, maximum = frame, frame
+    pyramid = []
+    for level in range(1, levels + 1):
+        shape = level_shape(frame.shape, level)
+        out_mean, out_max = np.empty(shape, dtype=np.float32), np.empty(shape, dtype=frame.dtype)
+        reduce_level(mean, maximum, 2**(level - 1), width, height, out_mean, out_max)
+        mean, maximum = out_mean, out_max
+        pyramid.append((mean, maximum))
+    return pyramid
+
+
+def choose_level(width: int, pixels: int, levels: int) -> int:
+    """
+    Coarsest level, at most `levels`, that still has at least as many blocks across `width` sites
+    as there are `pixels`, or the finest one that fits when every level has more.
+
+    :rtype: int
+    """
+    level = 0
+    while level < levels and -(-width // 2**(level + 1)) >= pixels:
+        level += 1
+    return level
+
+
+class Pyramid:
+    """
+    Block means and maxima of the inside of every snapshot, at `levels` resolutions halving
+    one after another, stored alongside the snapshots in a zarr group.
+
+    Every level and reduction is an array of full snapshots without boundaries
+    (see `Snapshots`), named e.g. "mean_2" for the means over 4x4 blocks.
+
+    :param group: zarr group made by `create`
+    """
+
+    def __init__(self, group):
+        self.group = group
+        self.levels = group.attrs['levels']
+        self.shape = tuple(group.attrs['shape'])
+        self.arrays = {(level, reduction): Snapshots(group[f"{reduction}_{level}"])
+                       for level in range(1, self.levels + 1) for reduction in REDUCTIONS}
+        self._writers = None
+
+    @classmethod
+    def create(cls, filename, levels: int, n_frames: int, shape: tuple, dtype: np.dtype,
+               chunk_length: int) -> "Pyramid":
+        """
+        Create the arrays of a pyramid.
+
+        :param filename: path of the zarr group; None keeps it in memory
+        :param levels: number of levels above the lattice
+        :type levels: int
+        :param n_frames: number of snapshots
+        :type n_frames: int
+        :param shape: shape of the inside of the lattice
+        :type shape: tuple
+        :param dtype: dtype of the snapshots, kept by the maxima
+        :type dtype: np.dtype
+        :param chunk_length: number of snapshots per chunk
+        :type chunk_length: int
+        :rtype: Pyramid
+        """
+        if not 1 <= levels <= max_levels(shape):
+            raise ValueError(f"A pyramid of a {shape} lattice has between 1 and {max_levels(shape)} levels, not {levels}")
+        group = zarr.open_group(filename, mode='w')
+        create = getattr(group, 'create_array', None) or group.create_dataset
+        for level in range(1, levels + 1):
+            level_size = level_shape(shape, level)
+            for reduction in REDUCTIONS:
+                array = create(f"{reduction}_{level}", shape=(n_frames,) + level_size,
+                               chunks=(chunk_length,) + level_size,
+                               dtype=np.float32 if reduction == "mean" else dtype)
+                array.attrs['format'] = "full"
+                array.attrs['boundary_size'] = 0
+        group.attrs['levels'] = levels
+        group.attrs['shape'] = list(shape)
+        group.attrs['chunk_length'] = chunk_length
+        return cls(group)
+
+    @classmethod
+    def open(cls, filename, mode: str = 'a') -> "Pyramid":
+        """
+        Open a saved pyramid.
+
+        :param filename: path of the zarr group
+        :param mode: zarr persistence mode
+        :type mode: str
+        :rtype: Pyramid
+        """
+        return cls(zarr.open_group(filename, mode=mode))
+
+    def level(self, level: int, reduction: str = "mean") -> Snapshots:
+        """
+        Snapshots of one level of the pyramid.
+
+        :param level: from 1 (2x2 blocks) to `levels`
+        :type level: int
+        :param reduction: "mean" or "max"
+        :type reduction: str
+        :rtype: Snapshots
+        """
+        if reduction not in REDUCTIONS:
+            raise ValueError(f"reduction must be one of {REDUCTIONS}, got {reduction!r}")
+        return self.arrays[level, reduction]
+
+    def start_writing(self, background: bool = True):
+        """
+        Write the following frames one whole chunk at a time from background threads (see `SnapshotWriter`).
+        """
+        if background:
+            self._writers = {key: SnapshotWriter(snapshots.array, max_workers=1)
+                             for key, snapshots in self.arrays.items()}
+
+    def save(self, index: int, frame: np.ndarray):
+        """
+        Reduce the inside of a lattice and store it as frame `index` of every level.
+
+        :param index: index of the snapshot
+        :type index: int
+        :param frame: inside of the lattice
+        :type frame: np.ndarray
+        """
+        for level, reductions in enumerate(reduce(frame, self.levels), 1):
+            for reduction, reduced in zip(REDUCTIONS, reductions):
+                if self._writers is not None:
+                    self._writers[level, reduction].write(index, reduced)
+                else:
+                    self.arrays[level, reduction].array[index] = reduced
+
+    def flush(self):
+        """
+        Wait until the frames saved so far are written.
+        """
+        for writer in (self._writers or {}).values():
+            writer.flush()
+
+    def close(self):
+        """
+        Flush and stop the writer threads, if any.
+        """
+        for writer in (self._writers or {}).values():
+            writer.close()
+        self._writers = None
+
+    def checkpoint(self, group):
+        """
+        Copy a pyramid kept in memory into a checkpoint group.
+        """
+        group.attrs.update(dict(self.group.attrs))
+        for (level, reduction), snapshots in self.arrays.items():
+            stored = save_array(group, f"{reduction}_{level}", snapshots.array[:])
+            stored.attrs.update(dict(snapshots.attrs))
+
+    @classmethod
+    def from_checkpoint(cls, group) -> "Pyramid":
+        """
+        Pyramid in memory, with the same chunks as its snapshots, restored from `checkpoint`.
+        """
+        chunk_length = group.attrs['chunk_length']
+        memory = zarr.open_group(None, mode='w')
+        memory.attrs.update(dict(group.attrs))
+        create = getattr(memory, 'create_array', None) or memory.create_dataset
+        for name in group.array_keys():
+            stored = group[name]
+            array = create(name, shape=stored.shape, chunks=(chunk_length,) + stored.shape[1:], dtype=stored.dtype)
+            array[...] = stored[...]
+            array.attrs.update(dict(stored.attrs))
+        return cls(memory)
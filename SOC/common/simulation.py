@@ -8,6 +8,15 @@ import pandas
 import zarr
 import datetime
 import typing
+import os
+import warnings
+from .observables import ObservableStore
+from .snapshots import Snapshots, SnapshotWriter, create_snapshots
+from .pyramid import Pyramid
+from .cache import StateCache
+from .stationarity import StationarityMonitor
+from .checkpoints import save_array, save_rng_state, load_rng_state, replace_directory, open_checkpoint
+from . import driving, footprint, powerlaw, video, pyramid
 
 class Simulation:
     """Base class for SOC simulations.
@@ -18,17 +27,45 @@ class Simulation:
     :type save_every: int or None
     :param wait_for_n_iters: How many iterations to skip to skip before saving data?
     :type wait_for_n_iters: int
+    :param packed_visited: store `visited` bit-packed, 8 sites per byte; needs an engine that tracks
+        footprints, whose touched list stays the bulk of their memory (see `footprint`)
+    :type packed_visited: bool
     """
     values = NotImplemented
     saved_snapshots = NotImplemented
 
     BOUNDARY_SIZE = BC = 1
-    def __init__(self, L: int, save_every: int = 1, wait_for_n_iters: int = 10):
+    #: arrays (and scalar attributes) saved by `checkpoint`, when the simulation has them
+    CHECKPOINT_ARRAYS = ("values", "visited")
+    CHECKPOINT_ATTRIBUTES = ()
+    #: arrays (and scalar attributes) that make up the state of the model whatever its engine,
+    #: shared through a `StateCache`; unlike counters of the run, such as Manna's `topplings`
+    STATE_ARRAYS = ("values",)
+    STATE_ATTRIBUTES = ()
+    #: buffers of random numbers, saved by `checkpoint` but not shared through a `StateCache`
+    RANDOM_ARRAYS = ()
+    #: arrays stacked across replicas by `Batch`, for models with a batched kernel
+    BATCH_ARRAYS = ()
+    #: whether `topple_dissipate` leaves the number of topplings and the largest height of the
+    #: avalanche in `_avalanche`, for `AvalancheLoop` to report them with its shape (see `_geometry`)
+    GEOMETRY = False
+    COMPILED_BLOCK_SIZE = 10000
+    SNAPSHOT_CHUNK_BYTES = 2**26
+    def __init__(self, L: int, save_every: int = 1, wait_for_n_iters: int = 10, packed_visited: bool = False):
         self.L = L
-        self.visited = np.zeros((self.L_with_boundary, self.L_with_boundary), dtype=bool)
-        self.data_acquisition = []
+        self.packed_visited = packed_visited
+        self.visited = footprint.visited_array(self.L_with_boundary, packed_visited)
+        self.data_acquisition = ObservableStore()
         self.save_every = save_every
         self.wait_for_n_iters = wait_for_n_iters
+        self._driven_sites = None
+        self._snapshot_writer = None
+        self.pyramid = None
+        self.iteration = 0
+        self._run_settings = None
+        self.thermalization_time = None
+        self._at_threshold = None
+        self._avalanche = None
 
     @property
     def size(self) -> int:
@@ -44,6 +81,42 @@ class Simulation:
         """
         return self.L + 2 * self.BOUNDARY_SIZE
 
+    def _track_footprint(self, enabled: bool):
+        """
+        Keep a touched list (`_touched`) next to `visited`, for engines whose kernels maintain
+        it, so that `AvalancheLoop` clears and measures only the footprint of the avalanche.
+
+        :param enabled: whether the engine maintains the list
+        :type enabled: bool
+        """
+        if enabled:
+            self._touched = footprint.touched_list(self.L_with_boundary)
+        elif self.packed_visited:
+            raise ValueError("Bit-packed visited needs an engine that tracks footprints")
+
+    def _relist_footprint(self):
+        """
+        Rebuild the touched lists, which checkpoints do not save, from the arrays they list.
+
+        Extended in subclasses with touched lists of their own.
+        """
+        if hasattr(self, '_touched'):
+            footprint.relist(footprint.unpack(self.visited, self.L_with_boundary), self._touched,
+                             footprint.row_length(self.visited))
+
+    @property
+    def drive_threshold(self) -> typing.Optional[int]:
+        """
+        Value at which a site starts an avalanche when `drive` adds a grain to it, for models whose
+        `drive` adds one grain to a uniformly random site - which allows skip-ahead driving
+        (`run(..., skip_ahead=True)`); None otherwise.
+
+        Overriden in subclasses.
+
+        :rtype: int
+        """
+        return None
+
     def drive(self):
         """
         Drive the simulation by adding particles from the outside.
@@ -52,6 +125,23 @@ class Simulation:
         """
         raise NotImplementedError("Your model needs to override the drive method!")
 
+    def _pop_seeds(self, critical_value) -> np.ndarray:
+        """
+        Sites from which an event-driven toppling engine should start.
+
+        These are the sites touched by the last `drive`; they are consumed by the
+        call, so a subsequent call (e.g. after the user edited `values` by hand)
+        falls back to scanning the whole lattice for sites above `critical_value`.
+
+        :param critical_value: nodes topple above this value
+        :return: Nx2 array of site indices, including the boundary offset
+        :rtype: np.ndarray
+        """
+        seeds, self._driven_sites = self._driven_sites, None
+        if seeds is None:
+            seeds = np.argwhere(self.inside(self.values) > critical_value) + self.BC
+        return seeds
+
     def topple_dissipate(self):
         """
         Distribute material from overloaded sites to neighbors.
@@ -60,6 +150,13 @@ class Simulation:
         """
         raise NotImplementedError("Your model needs to override the topple method!")
 
+    def build_engine(self):
+        """
+        (Re)build the auxiliary structures of the engine from `values`, e.g. after loading them from a `StateCache`.
+
+        Overriden in subclasses whose engines keep such structures.
+        """
+
     @classmethod
     def clean_boundary_inplace(cls, array: np.ndarray) -> np.ndarray:
         """
@@ -90,19 +187,119 @@ class Simulation:
         toppling and dissipating.
 
         Returns a dictionary with the total size of the avalanche
-        and the number of iterations the avalanche took.
+        and the number of iterations the avalanche took, followed by
+        its geometry (see `_geometry`) in models that track it.
 
         :rtype: dict
         """
-        self.visited[...] = False
-        number_of_iterations = self.topple_dissipate()
-        
-        AvalancheSize = self.inside(self.visited).sum()
-        return dict(AvalancheSize=AvalancheSize, number_of_iterations=number_of_iterations)
+        if not hasattr(self, '_touched'):
+            self.visited[...] = False
+            number_of_iterations = self.topple_dissipate()
+            AvalancheSize = self.inside(self.visited).sum()
+        else:
+            footprint.clear(self.visited, self._touched)
+            number_of_iterations = self.topple_dissipate()
+            AvalancheSize = footprint.size(self.visited, self._touched, self.BC, *self.values.shape)
+        observables = dict(AvalancheSize=AvalancheSize, number_of_iterations=number_of_iterations)
+        if self.GEOMETRY:
+            observables.update(self._geometry())
+        return observables
+
+    def _geometry(self) -> dict:
+        """
+        Geometry of the last avalanche, for finite-size scaling:
+
+        - `Topplings`: number of topplings,
+        - `ExtentX`, `ExtentY`: sides of the bounding box of the visited sites,
+        - `GyrationRadius`: radius of gyration of the visited sites,
+        - `MaxHeight`: largest height of a toppling site at the start of its wave.
+
+        The visited sites are those counted in `AvalancheSize`. The engines that track
+        footprints (see `footprint`) only go over them; the others scan `visited`.
+
+        :rtype: dict
+        """
+        topplings, max_height = self._avalanche
+        if hasattr(self, '_touched'):
+            ExtentX, ExtentY, GyrationRadius = footprint.geometry(self.visited, self._touched, self.BC,
+                                                                  *self.values.shape)
+        else:
+            ExtentX, ExtentY, GyrationRadius = footprint.mask_geometry(self.visited, self.BC)
+        return dict(Topplings=topplings, ExtentX=ExtentX, ExtentY=ExtentY,
+                    GyrationRadius=GyrationRadius, MaxHeight=max_height)
+
+    def _geometry_columns(self, shape) -> dict:
+        """
+        Empty columns of the `_geometry` observables, for compiled and batched kernels to fill in.
+
+        :param shape: shape of every column
+        :rtype: dict
+        """
+        return dict(Topplings=np.empty(shape, dtype=np.int64), ExtentX=np.empty(shape, dtype=np.int64),
+                    ExtentY=np.empty(shape, dtype=np.int64), GyrationRadius=np.empty(shape),
+                    MaxHeight=np.empty(shape, dtype=self.values.dtype))
+
+    def _quiet_observables(self, n_iterations: int) -> dict:
+        """
+        Observables of `n_iterations` drives that started no avalanche, as `AvalancheLoop` would give them.
+
+        :rtype: dict
+        """
+        zeros = np.zeros(n_iterations, dtype=np.int64)
+        observables = dict(AvalancheSize=zeros, number_of_iterations=zeros)
+        if self.GEOMETRY:
+            observables.update(Topplings=zeros, ExtentX=zeros, ExtentY=zeros, GyrationRadius=np.zeros(n_iterations),
+                               MaxHeight=np.zeros(n_iterations, dtype=self.values.dtype))
+        return observables
+
+    def _run_compiled(self, n_iterations: int) -> dict:
+        """
+        Advance the simulation by `n_iterations` drives and avalanches inside a single
+        numba-compiled loop.
+
+        Overriden in subclasses that have a compiled driver.
+
+        :param n_iterations: number of iterations
+        :type n_iterations: int
+        :return: dictionary of observable columns, each `n_iterations` long
+        :rtype: dict
+        """
+        raise NotImplementedError(f"{self.__class__.__name__} has no compiled driver!")
+
+    def _run_batch(self, replicas: list, arrays: dict, seeds: np.ndarray, n_iterations: int) -> dict:
+        """
+        Advance a whole `Batch` of replicas like this one by `n_iterations` drives and
+        avalanches each, inside a single parallel numba kernel.
+
+        Overriden in subclasses that have a batched kernel, which also update the scalar
+        state (e.g. counters) of the `replicas`.
+
+        :param replicas: the simulations of the batch, whose arrays are views into `arrays`
+        :type replicas: list
+        :param arrays: the `BATCH_ARRAYS` of all the replicas, stacked along a new first axis
+        :type arrays: dict
+        :param seeds: seed of the random generator for every replica
+        :type seeds: np.ndarray
+        :param n_iterations: number of iterations
+        :type n_iterations: int
+        :return: dictionary of observable columns, each of shape (replicas, `n_iterations`)
+        :rtype: dict
+        """
+        raise NotImplementedError(f"{self.__class__.__name__} has no batched kernel!")
 
     def run(self, N_iterations: int,
             filename: str  = None,
-            wait_for_n_iters: int = 10,
+            wait_for_n_iters: typing.Union[int, str] = 10,
+            compiled: bool = False,
+            observables_filename: typing.Union[str, bool, None] = None,
+            background_snapshots: bool = True,
+            snapshot_format: str = "full",
+            delta: bool = True,
+            checkpoint_filename: typing.Optional[str] = None,
+            checkpoint_every: typing.Optional[int] = None,
+            state_cache: typing.Optional[StateCache] = None,
+            skip_ahead: bool = False,
+            pyramid_levels: int = 0,
             ) -> str:
 
         """
@@ -114,11 +311,68 @@ class Simulation:
         :param filename: filename for saving snapshots. if None, saves to memory; by default if False, makes something like array_Manna_2019-12-17T19:40:00.546426.zarr
         :type filename: str
         :param wait_for_n_iters: wait this many iterations before collecting data
-                                 (lets model thermalize)
-        :type wait_for_n_iters: int
+                                 (lets model thermalize); "auto" waits until the model
+                                 looks stationary (see `thermalize_until_stationary`).
+                                 The thermalization time is saved in the snapshots' attrs
+                                 as 'thermalization_iterations'
+        :type wait_for_n_iters: int or str
+        :param compiled: run blocks of iterations inside the model's numba-compiled driver
+                         (see `_run_compiled`), returning to Python only to save snapshots
+                         and update progress
+        :type compiled: bool
+        :param observables_filename: if given, stream the gathered observables in chunks to this zarr group
+                                     (see `ObservableStore.stream_to`), keeping memory use bounded;
+                                     True puts it next to the snapshots, e.g. array_Manna_2019-12-17T19:40:00.546426.observables.zarr
+        :type observables_filename: str
+        :param background_snapshots: buffer snapshots in memory and write them one whole zarr chunk
+                                     at a time from background threads (see `SnapshotWriter`)
+        :type background_snapshots: bool
+        :param snapshot_format: "full" saves whole lattices; "compact" saves only their inside,
+                                as `snapshot_dtype`, compressed harder (see `create_snapshots`)
+        :type snapshot_format: str
+        :param delta: with "compact", store snapshots as differences against a keyframe per chunk
+        :type delta: bool
+        :param checkpoint_filename: where to save automatic checkpoints (see `checkpoint`);
+                                    an interrupted run continues with `from_checkpoint(...).resume()`
+        :type checkpoint_filename: str
+        :param checkpoint_every: save a checkpoint every this many iterations, and at the end of the run
+        :type checkpoint_every: int
+        :param state_cache: thermalize through this cache instead (see `thermalize`): the
+                            `wait_for_n_iters` iterations are then done (or loaded) before the run,
+                            and the run itself collects data from its first iteration
+        :type state_cache: StateCache
+        :param skip_ahead: skip ahead to the next grain that starts an avalanche, dropping the grains before it
+                           in bulk and recording them as avalanches of size zero, with the same statistics as
+                           driving one grain at a time (see `driving.deposit_quiet_grains`); needs a
+                           `drive_threshold` and is not available for compiled runs
+        :type skip_ahead: bool
+        :param pyramid_levels: also save this many levels of block means and maxima of the snapshots,
+                               over 2x2, 4x4, ... sites (see `Pyramid`), which `plot_state` and
+                               `animate_states` show instead of lattices larger than the screen;
+                               kept next to the snapshots, e.g. array_Manna_2019-12-17T19:40:00.546426.pyramid.zarr
+        :type pyramid_levels: int
         """
+        if skip_ahead and (compiled or self.drive_threshold is None):
+            raise ValueError(f"Skip-ahead driving is not available for {self.__class__.__name__}"
+                             + (" in compiled runs" if compiled else ""))
         if filename is False:
             filename = f"array_{self.__class__.__name__}_{datetime.datetime.now().isoformat()}.zarr"
+        if checkpoint_every is not None and checkpoint_filename is None:
+            raise ValueError("checkpoint_every needs a checkpoint_filename")
+        if wait_for_n_iters == "auto":
+            cached = state_cache.load(self) if state_cache is not None else 0
+            needed = self.thermalize_until_stationary(compiled=compiled, warm_start=cached > 0)
+            self.thermalization_time = cached + needed
+            if state_cache is not None and (needed or not cached):
+                state_cache.store(self, self.thermalization_time)
+            print(f"Stationary state detected after {self.thermalization_time} iterations.")
+            wait_for_n_iters = 0
+        elif state_cache is not None:
+            self.thermalize(wait_for_n_iters, state_cache, compiled=compiled)
+            self.thermalization_time = wait_for_n_iters
+            wait_for_n_iters = 0
+        else:
+            self.thermalization_time = wait_for_n_iters
         scaled_wait_for_n_iters = wait_for_n_iters
         scaled_n_iterations = N_iterations + scaled_wait_for_n_iters
         if scaled_n_iterations % self.save_every != 0:
@@ -126,29 +380,271 @@ class Simulation:
         print(f"Waiting for wait_for_n_iters={wait_for_n_iters} iterations before collecting data. This should let the system thermalize.")
 
         total_snapshots = max([scaled_n_iterations // self.save_every, 1])
-        self.saved_snapshots = zarr.open(filename,
-                                         shape=(
-                                             total_snapshots,                            # czas
-                                             self.L_with_boundary,                       # x
-                                             self.L_with_boundary,                       # y
-                                         ),
-                                         chunks=(
-                                             100,
-                                             self.L_with_boundary,
-                                             self.L_with_boundary,
-                                         ),
-                                         dtype=self.values.dtype,
-                                         )
+        frame_bytes = self.L_with_boundary**2 * self.values.dtype.itemsize
+        chunk_length = int(np.clip(self.SNAPSHOT_CHUNK_BYTES // frame_bytes, 1, 100))
+        self.saved_snapshots = create_snapshots(filename, total_snapshots, self.L_with_boundary,
+                                                self.values.dtype, chunk_length,
+                                                snapshot_format=snapshot_format,
+                                                boundary_size=self.BOUNDARY_SIZE,
+                                                compact_dtype=self.snapshot_dtype,
+                                                delta=delta)
         self.saved_snapshots.attrs['save_every'] = self.save_every
+        self.saved_snapshots.attrs['thermalization_iterations'] = self.thermalization_time
+        pyramid_filename = None
+        if pyramid_levels:
+            if isinstance(filename, str):
+                pyramid_filename = os.path.splitext(filename)[0] + ".pyramid.zarr"
+            self.pyramid = Pyramid.create(pyramid_filename, pyramid_levels, total_snapshots, (self.L, self.L),
+                                          self._snapshot().dtype, chunk_length)
+        else:
+            self.pyramid = None
+        if observables_filename is True:
+            if not isinstance(filename, str):
+                raise ValueError("Streaming observables next to the snapshots needs a snapshot filename")
+            observables_filename = os.path.splitext(filename)[0] + ".observables.zarr"
+        if observables_filename:
+            self.data_acquisition.stream_to(observables_filename)
+
+        self.iteration = 0
+        self._run_settings = dict(N_iterations=N_iterations, filename=filename,
+                                  wait_for_n_iters=wait_for_n_iters, compiled=compiled,
+                                  observables_filename=observables_filename or None,
+                                  background_snapshots=background_snapshots,
+                                  checkpoint_filename=checkpoint_filename,
+                                  checkpoint_every=checkpoint_every,
+                                  thermalization_time=self.thermalization_time,
+                                  skip_ahead=skip_ahead,
+                                  pyramid_levels=pyramid_levels,
+                                  pyramid_filename=pyramid_filename)
+        return self._continue_run()
+
+    def thermalize(self, n_iterations: int, state_cache: typing.Optional[StateCache] = None,
+                   burn_in: typing.Optional[int] = None, compiled: bool = False) -> int:
+        """
+        Bring the simulation to its stationary state by running `n_iterations` iterations
+        without collecting data.
+
+        With a `state_cache`, a state of the same model and parameters thermalized for at
+        least `n_iterations` is loaded from it instead, and decorrelated from other runs
+        starting from it by `burn_in` further iterations. Cached states thermalized for fewer
+        iterations are continued from, and the cache is updated.
+
+        :param n_iterations: number of thermalization iterations
+        :type n_iterations: int
+        :param state_cache: cache of thermalized states
+        :type state_cache: StateCache
+        :param burn_in: iterations run after loading a cached state; by default one per site
+        :type burn_in: int
+        :param compiled: use the model's compiled driver (see `_run_compiled`)
+        :type compiled: bool
+        :return: number of iterations actually run
+        :rtype: int
+        """
+        if state_cache is None:
+            self._advance(n_iterations, compiled)
+            return n_iterations
+        cached = state_cache.load(self)
+        if cached >= n_iterations:
+            burn_in = self.size if burn_in is None else burn_in
+            self._advance(burn_in, compiled)
+            return burn_in
+        self._advance(n_iterations - cached, compiled)
+        state_cache.store(self, n_iterations)
+        return n_iterations - cached
+
+    def thermalize_until_stationary(self, block: typing.Optional[int] = None, window: int = 10,
+                                    threshold: float = 3.0, max_iterations: typing.Optional[int] = None,
+                                    compiled: bool = False, warm_start: bool = False) -> int:
+        """
+        Run the simulation until it looks stationary, without collecting data.
+
+        After every `block` iterations, the mean of the lattice (density) and the mean
+        avalanche size over the block are passed to a `StationarityMonitor`. The density is
+        that of `_snapshot`, e.g. of OFC's loads relative to its drifting threshold.
+
+        :param block: iterations per measurement; by default one per site
+        :type block: int
+        :param window: measurements per half of the stationarity test window
+        :type window: int
+        :param threshold: allowed difference of the half-window means, in standard errors
+        :type threshold: float
+        :param max_iterations: give up (with a warning) after this many iterations;
+            by default `100 * window` blocks
+        :type max_iterations: int
+        :param compiled: use the model's compiled driver (see `_run_compiled`)
+        :type compiled: bool
+        :param warm_start: the initial state was thermalized before, e.g. loaded from a `StateCache`;
+            if it passes the test on the first window, no iterations were needed and 0 is returned
+        :type warm_start: bool
+        :return: thermalization time, in iterations
+        :rtype: int
+        """
+        block = self.size if block is None else block
+        max_iterations = 100 * window * block if max_iterations is None else max_iterations
+        monitor = StationarityMonitor(window, threshold)
+        iterations = 0
+        while not monitor.stationary:
+            if iterations >= max_iterations:
+                warnings.warn(f"No stationary state detected after {iterations} iterations")
+                break
+            sizes = self._advance(block, compiled)
+            iterations += block
+            monitor.update(inside_sum(self._snapshot(), self.BC) / self.size, sizes.mean())
+        if warm_start and monitor.stationary and len(monitor.history) == 2 * window:
+            return 0
+        return iterations
+
+    def _advance(self, n_iterations: int, compiled: bool = False) -> np.ndarray:
+        """
+        Run `n_iterations` iterations, discarding their observables.
+
+        :return: avalanche sizes
+        :rtype: np.ndarray
+        """
+        sizes = []
+        i = 0
+        while i < n_iterations:
+            if compiled:
+                stop = min(n_iterations, i + self.COMPILED_BLOCK_SIZE)
+                sizes.append(self._run_compiled(stop - i)['AvalancheSize'])
+            else:
+                stop = n_iterations
+                block = np.empty(stop - i, dtype=np.int64)
+                for j in range(stop - i):
+                    self.drive()
+                    block[j] = self.AvalancheLoop()['AvalancheSize']
+                sizes.append(block)
+            i = stop
+        return np.concatenate(sizes) if sizes else np.empty(0)
 
-        for i in tqdm.trange(scaled_n_iterations):
-            self.drive()
-            observables = self.AvalancheLoop()
-            if i >= scaled_wait_for_n_iters:
-                self.data_acquisition.append(observables)
-            if self.save_every is not None and (i % self.save_every) == 0:
-                self._save_snapshot(i)
-        return filename
+    def resume(self) -> str:
+        """
+        Finish the run that was interrupted after the checkpoint this simulation
+        was loaded from (see `from_checkpoint`), exactly as if it had not stopped.
+
+        :return: filename of the snapshots
+        :rtype: str
+        """
+        if self._run_settings is None:
+            raise RuntimeError("There is no run to resume")
+        return self._continue_run()
+
+    def _continue_run(self) -> str:
+        """
+        Run the iterations of the current run from `self.iteration` on.
+        """
+        settings = self._run_settings
+        scaled_n_iterations = settings['N_iterations'] + settings['wait_for_n_iters']
+        if settings['background_snapshots']:
+            self._snapshot_writer = SnapshotWriter(self.saved_snapshots.array)
+        if self.pyramid is not None:
+            self.pyramid.start_writing(settings['background_snapshots'])
+        try:
+            self._run_blocks(scaled_n_iterations, settings['wait_for_n_iters'], settings['compiled'],
+                             settings['checkpoint_filename'], settings['checkpoint_every'],
+                             settings.get('skip_ahead', False))
+        finally:
+            self.data_acquisition.flush()
+            self.saved_snapshots.save_range()
+            if self._snapshot_writer is not None:
+                self._snapshot_writer.close()
+                self._snapshot_writer = None
+            if self.pyramid is not None:
+                self.pyramid.close()
+        return settings['filename']
+
+    def _run_blocks(self, scaled_n_iterations: int, scaled_wait_for_n_iters: int, compiled: bool,
+                    checkpoint_filename: typing.Optional[str] = None,
+                    checkpoint_every: typing.Optional[int] = None,
+                    skip_ahead: bool = False):
+        """
+        The main loop of `run`.
+        """
+        progress = tqdm.tqdm(total=scaled_n_iterations, initial=self.iteration)
+        if skip_ahead:
+            self._threshold_mask = np.zeros(self.values.shape, dtype=bool)
+            self._at_threshold = driving.mark_at_threshold(self.values, self.drive_threshold, self.BC,
+                                                           self._threshold_mask)
+        i = self.iteration
+        while i < scaled_n_iterations:
+            # a block ends right after an iteration that saves a snapshot,
+            # where data collection starts, or where a checkpoint is due
+            stop = scaled_n_iterations
+            if self.save_every is not None:
+                stop = min(stop, -(-i // self.save_every) * self.save_every + 1)
+            if i < scaled_wait_for_n_iters:
+                stop = min(stop, scaled_wait_for_n_iters)
+            if checkpoint_every is not None:
+                stop = min(stop, (i // checkpoint_every + 1) * checkpoint_every)
+            if compiled:
+                stop = min(stop, i + self.COMPILED_BLOCK_SIZE)
+                observables = self._run_compiled(stop - i)
+                if i >= scaled_wait_for_n_iters:
+                    self.data_acquisition.extend(observables)
+            elif skip_ahead:
+                self._skip_ahead(stop - i, collect=i >= scaled_wait_for_n_iters)
+            else:
+                for j in range(i, stop):
+                    self.drive()
+                    observables = self.AvalancheLoop()
+                    if j >= scaled_wait_for_n_iters:
+                        self.data_acquisition.append(observables)
+            progress.update(stop - i)
+            i = self.iteration = stop
+            if self.save_every is not None and ((i - 1) % self.save_every) == 0:
+                self._save_snapshot(i - 1)
+            if checkpoint_every is not None and (i % checkpoint_every == 0 or i == scaled_n_iterations):
+                self.checkpoint(checkpoint_filename)
+        progress.close()
+
+    def _skip_ahead(self, n_iterations: int, collect: bool):
+        """
+        Run `n_iterations` iterations with skip-ahead driving (see `run`).
+
+        The sites at the threshold are kept in `_threshold_mask` and counted in `_at_threshold`.
+        Engines that track footprints update both over the footprint of each avalanche;
+        the others rescan the lattice.
+        """
+        threshold, mask = self.drive_threshold, self._threshold_mask
+        j = 0
+        while j < n_iterations:
+            quiet, self._at_threshold = driving.deposit_quiet_grains(self.values, threshold, self.BC, mask,
+                                                                     self._at_threshold, n_iterations - j)
+            if collect and quiet:
+                self.data_acquisition.extend(self._quiet_observables(quiet))
+            j += quiet
+            if j < n_iterations:
+                self._driven_sites = driving.drive_at_threshold(self.values, threshold, self.BC, mask)
+                self._at_threshold -= 1
+                observables = self.AvalancheLoop()
+                if hasattr(self, '_touched'):
+                    self._at_threshold = driving.update_at_threshold(
+                        self.values, threshold, self.BC, mask, self._touched,
+                        footprint.row_length(self.visited), self._at_threshold)
+                else:
+                    self._at_threshold = driving.mark_at_threshold(self.values, threshold, self.BC, mask)
+                if collect:
+                    self.data_acquisition.append(observables)
+                j += 1
+
+    def _snapshot(self) -> np.ndarray:
+        """
+        The current state, as it should be saved in a snapshot.
+
+        :rtype: np.ndarray
+        """
+        return self.values
+
+    @property
+    def snapshot_dtype(self) -> np.dtype:
+        """
+        Narrowest dtype that holds every value of a snapshot, used by the "compact" snapshot format.
+
+        Overriden in subclasses whose states are known to be small.
+
+        :rtype: np.dtype
+        """
+        return self._snapshot().dtype
 
     def _save_snapshot(self, i: int):
         """
@@ -157,24 +653,58 @@ class Simulation:
         :param i: timestep index
         :type i: int
         """
-        self.saved_snapshots[i // self.save_every] = self.values
+        index = i // self.save_every
+        frame = self.saved_snapshots.encode(index, self._snapshot())
+        if self._snapshot_writer is not None:
+            self._snapshot_writer.write(index, frame)
+        else:
+            self.saved_snapshots.array[index] = frame
+        if self.pyramid is not None:
+            self.pyramid.save(index, self.inside(self._snapshot()))
 
     @property
     def data_df(self) -> pandas.DataFrame:
         """
         Displays the gathered data as a Pandas DataFrame.
 
+        The DataFrame shares memory with `data_acquisition` and is cached until new data arrives.
+
         :return: dataframe with gathered data
         :rtype: pandas.DataFrame
         """
-        return pandas.DataFrame(self.data_acquisition)
+        return self.data_acquisition.to_dataframe()
 
-    def plot_state(self, with_boundaries: bool = False) -> plt.Figure:
+    @property
+    def histograms(self) -> dict:
+        """
+        Log-binned histograms of the gathered observables (see `powerlaw.LogHistogram`),
+        kept in O(bins) memory for runs whose rows do not fit in it.
+
+        :rtype: dict
+        """
+        return self.data_acquisition.histograms
+
+    def plot_state(self, with_boundaries: bool = False,
+                   region: typing.Optional[tuple] = None,
+                   reduction: str = "mean",
+                   max_pixels: typing.Optional[int] = None,
+                   ) -> plt.Figure:
         """
         Plots the current state of the simulation.
 
+        Lattices with more sites across than the plot has pixels are shown as the means (or maxima)
+        of blocks of 2x2, 4x4, ... sites, reduced by the compiled pyramid kernel (see `pyramid.reduce`),
+        so that very large lattices plot quickly.
+
         :param with_boundaries: should the boundaries be displayed as well?
         :type with_boundaries: bool
+        :param region: zoom into the sites (x_start, x_stop, y_start, y_stop) of the displayed lattice;
+                       None entries stand for its edges
+        :type region: tuple
+        :param reduction: "mean" or "max" of the blocks of sites shown as one pixel
+        :type reduction: str
+        :param max_pixels: number of pixels across the plot; by default, that of the axes
+        :type max_pixels: int
         :return: figure with plot
         :rtype: plt.Figure
         """
@@ -184,20 +714,65 @@ class Simulation:
             values = self.values
         else:
             values = self.values[self.BOUNDARY_SIZE:-self.BOUNDARY_SIZE, self.BOUNDARY_SIZE:-self.BOUNDARY_SIZE]
+        (rows, columns), extent = self._zoom(region, values.shape)
+        values = values[rows, columns]
+        level = self._display_level(ax, values.shape, max_pixels, pyramid.max_levels(values.shape))
+        if level:
+            values = pyramid.reduce(values, level)[-1][self._reduction_index(reduction)]
         
-        IM = ax.imshow(values, interpolation='nearest')
+        IM = ax.imshow(values, interpolation='nearest', extent=extent)
         
         plt.colorbar(IM)
         return fig
 
+    @staticmethod
+    def _zoom(region: typing.Optional[tuple], shape: tuple, block: int = 1):
+        """
+        Slices of the blocks of `block` x `block` sites covering `region` of a lattice of `shape`,
+        and the `extent` of `imshow` that puts them at their sites.
+        """
+        x_start, x_stop, y_start, y_stop = region if region is not None else (None,) * 4
+        x_start, x_stop, _ = slice(x_start, x_stop).indices(shape[0])
+        y_start, y_stop, _ = slice(y_start, y_stop).indices(shape[1])
+        rows = slice(x_start // block, -(-x_stop // block))
+        columns = slice(y_start // block, -(-y_stop // block))
+        x_start, x_stop = rows.start * block, min(rows.stop * block, shape[0])
+        y_start, y_stop = columns.start * block, min(columns.stop * block, shape[1])
+        return (rows, columns), (y_start - 0.5, y_stop - 0.5, x_stop - 0.5, x_start - 0.5)
+
+    @staticmethod
+    def _display_level(ax: plt.Axes, shape: tuple, max_pixels: typing.Optional[int], levels: int) -> int:
+        """
+        Level of a pyramid whose blocks match the pixels of `ax` showing a lattice of `shape`.
+        """
+        if max_pixels is None:
+            box = ax.get_window_extent()
+            max_pixels = max(int(box.width), int(box.height), 1)
+        return pyramid.choose_level(max(shape), max_pixels, levels)
+
+    @staticmethod
+    def _reduction_index(reduction: str) -> int:
+        if reduction not in pyramid.REDUCTIONS:
+            raise ValueError(f"reduction must be one of {pyramid.REDUCTIONS}, got {reduction!r}")
+        return pyramid.REDUCTIONS.index(reduction)
+
     def animate_states(self,
                        notebook: bool = False,
                        with_boundaries: bool = False,
                        interval: int = 30,
+                       region: typing.Optional[tuple] = None,
+                       reduction: str = "mean",
+                       max_pixels: typing.Optional[int] = None,
                        ):
         """
         Animates the collected states of the simulation.
 
+        Frames are read lazily, a chunk at a time with the next one prefetched (see `FrameCache`)
+        until the animation is rendered or its figure closed, and colored by the range of values stored with the snapshots (see `Snapshots.value_range`),
+        so that long runs animate without loading every snapshot into memory.
+        Like in `plot_state`, lattices larger than the plot are shown as block means or maxima,
+        read from the `pyramid` saved with the snapshots if there is one.
+
         :param notebook: if True, displays via html5 video in a notebook;
                         otherwise returns MPL animation
         :type notebook: bool
@@ -205,26 +780,52 @@ class Simulation:
         :type with_boundaries: bool
         :param interval: number of miliseconds to wait between each frame.
         :type interval: int
+        :param region: zoom into the sites (x_start, x_stop, y_start, y_stop) of the displayed lattices
+        :type region: tuple
+        :param reduction: "mean" or "max" of the blocks of sites shown as one pixel
+        :type reduction: str
+        :param max_pixels: number of pixels across the animation; by default, that of the axes
+        :type max_pixels: int
         """
         fig, ax = plt.subplots()
 
-        if with_boundaries:
-            values = np.dstack(self.saved_snapshots)
+        crop = 0 if with_boundaries else self.BOUNDARY_SIZE
+        width = self.L_with_boundary - 2 * crop
+        (rows, columns), _ = self._zoom(region, (width, width))
+        shape = (rows.stop - rows.start, columns.stop - columns.start)
+        index = self._reduction_index(reduction)
+        if self.pyramid is not None and not with_boundaries:
+            level = self._display_level(ax, shape, max_pixels, self.pyramid.levels)
+            reduce_levels = 0
+        else:
+            level = 0
+            reduce_levels = self._display_level(ax, shape, max_pixels, pyramid.max_levels(shape))
+        if level:
+            frames = self.pyramid.level(level, reduction).frames()
         else:
-            values = np.dstack(self.saved_snapshots)[self.BOUNDARY_SIZE:-self.BOUNDARY_SIZE, self.BOUNDARY_SIZE:-self.BOUNDARY_SIZE, :]
+            frames = self.saved_snapshots.frames(crop=crop)
+        (rows, columns), extent = self._zoom(region, (width, width), 2**level)
+        vmin, vmax = self.saved_snapshots.value_range
 
-        IM = ax.imshow(values[:, :, 0],
+        def frame(i):
+            values = frames[i][rows, columns]
+            if reduce_levels:
+                values = pyramid.reduce(values, reduce_levels)[-1][index]
+            return values
+
+        IM = ax.imshow(frame(0),
                        interpolation='nearest',
-                       vmin = values.min(),
-                       vmax = values.max()
+                       extent=extent,
+                       vmin = vmin,
+                       vmax = vmax
                        )
         
         plt.colorbar(IM)
-        iterations = values.shape[2]
+        iterations = len(frames)
         title = ax.set_title("Iteration {}/{}".format(0, iterations * self.save_every))
 
         def animate(i):
-            IM.set_data(values[:,:,i])
+            IM.set_data(frame(i))
             title.set_text("Iteration {}/{}".format(i * self.save_every, iterations * self.save_every))
             return IM, title
 
@@ -236,32 +837,164 @@ class Simulation:
         if notebook:
             from IPython.display import HTML, display
             plt.close(anim._fig)
-            display(HTML(anim.to_html5_video()))
+            with frames:
+                display(HTML(anim.to_html5_video()))
         else:
+            # otherwise the prefetching thread stops when `frames` is garbage collected
+            fig.canvas.mpl_connect('close_event', lambda event: frames.close())
             return anim
 
-    def save(self, file_name = 'sim'):
-        """ serialization of object and saving it to file"""
-
-        root = zarr.open_group('state/' + file_name + '.zarr', mode = 'w')
-        values = root.create_dataset('values', shape = (self.L_with_boundary, self.L_with_boundary), chunks = (10, 10), dtype = 'i4')
-        # TODO this probably still needs fixing
-        values = zarr.array(self.values)
-        #data_acquisition = root.create_dataset('data_acquisition', shape = (len(self.data_acquisition)), chunks = (1000), dtype = 'i4')
-        #data_acquisition = zarr.array(self.data_acquisition)
-        root.attrs['L'] = self.L
-        root.attrs['save_every'] = self.save_every
-
-        return root
-
-    # TODO should be a classmethod
-    def open(self, file_name = 'sim'):
-        root = zarr.open_group('state/' + file_name + '.zarr', mode = 'r')
-        self.values = np.array(root['values'][:])
-        #self.data_acquisition = root['data_acquisition'][:]
-        self.L = root.attrs['L']
-        self.save_every = root.attrs['save_every']
-    
+    def export_animation(self, filename: str, fps: float = 30, with_boundaries: bool = False,
+                         cmap: str = 'viridis', max_workers: int = None) -> str:
+        """
+        Renders the collected states to a video or an image sequence, without a display.
+
+        Chunks of frames are rendered in parallel worker processes (see `video.export`),
+        so that runs with very many snapshots export in bounded memory.
+
+        :param filename: path of the video, e.g. "avalanches.mp4" (needs ffmpeg),
+                         or of a directory to fill with one png file per snapshot
+        :type filename: str
+        :param fps: frames per second of the video
+        :type fps: float
+        :param with_boundaries: include boundaries in the frames?
+        :type with_boundaries: bool
+        :param cmap: name of a matplotlib colormap
+        :type cmap: str
+        :param max_workers: number of processes; 0 renders in this process
+        :type max_workers: int
+        :return: `filename`
+        :rtype: str
+        """
+        return video.export(self.saved_snapshots, filename, fps=fps,
+                            crop=0 if with_boundaries else self.BOUNDARY_SIZE,
+                            cmap=cmap, max_workers=max_workers)
+
+    @property
+    def params(self) -> dict:
+        """
+        Keyword arguments that construct a simulation like this one.
+
+        Extended in subclasses with their own parameters.
+
+        :rtype: dict
+        """
+        params = dict(L=self.L, save_every=self.save_every, wait_for_n_iters=self.wait_for_n_iters)
+        if self.packed_visited:
+            params['packed_visited'] = True
+        return params
+
+    def checkpoint(self, filename: str):
+        """
+        Save everything needed to continue the simulation exactly: the lattice and auxiliary
+        arrays (`CHECKPOINT_ARRAYS`), `params`, the gathered observables, the progress of the
+        current run and the states of the numpy and numba random generators.
+
+        The checkpoint is written next to `filename` first and then moved in place, so
+        a job killed while checkpointing still leaves the previous checkpoint intact.
+
+        :param filename: path of the checkpoint (a zarr group)
+        :type filename: str
+        """
+        if self._snapshot_writer is not None:
+            self._snapshot_writer.flush()
+        if self.pyramid is not None:
+            self.pyramid.flush()
+        filename = os.path.normpath(filename)
+        temporary = filename + ".tmp"
+        root = zarr.open_group(temporary, mode='w')
+        root.attrs['model'] = self.__class__.__name__
+        root.attrs['params'] = self.params
+        root.attrs['iteration'] = self.iteration
+        root.attrs['run'] = self._run_settings
+        self._save_state(root, self.CHECKPOINT_ARRAYS + self.RANDOM_ARRAYS, self.CHECKPOINT_ATTRIBUTES)
+        self.data_acquisition.checkpoint(root.create_group('observables'))
+        if self._run_settings is not None:
+            self.saved_snapshots.save_range()
+        if self._run_settings is not None and self._run_settings['filename'] is None:
+            # snapshots kept in memory go into the checkpoint
+            snapshots = save_array(root, 'snapshots', self.saved_snapshots.array[:])
+            snapshots.attrs.update(dict(self.saved_snapshots.attrs))
+        if self.pyramid is not None and self._run_settings['pyramid_filename'] is None:
+            self.pyramid.checkpoint(root.create_group('pyramid'))
+        save_rng_state(root.create_group('rng'))
+        replace_directory(temporary, filename)
+
+    def _save_state(self, group, array_names: tuple, attribute_names: tuple):
+        """
+        Save the arrays `array_names` and the scalar attributes `attribute_names` into a zarr group.
+        """
+        group.attrs['state'] = {name: getattr(self, name).item() if isinstance(getattr(self, name), np.generic)
+                                else getattr(self, name)
+                                for name in attribute_names if hasattr(self, name)}
+        arrays = group.create_group('arrays')
+        for name in array_names:
+            if hasattr(self, name):
+                save_array(arrays, name, getattr(self, name))
+
+    def _load_state(self, group):
+        """
+        Restore the state saved by `_save_state`.
+        """
+        for name in group['arrays'].array_keys():
+            setattr(self, name, group['arrays'][name][...])
+        for name, value in group.attrs['state'].items():
+            setattr(self, name, value)
+
+    @classmethod
+    def from_checkpoint(cls, filename: str) -> "Simulation":
+        """
+        Load a simulation saved by `checkpoint`, including its random generator states.
+        If it was saved during a run, `resume` finishes that run.
+
+        :param filename: path of the checkpoint
+        :type filename: str
+        :return: simulation object, of the subclass you used
+        :rtype: Simulation
+        """
+        root = open_checkpoint(filename)
+        if root.attrs['model'] != cls.__name__:
+            raise ValueError(f"{filename} holds a {root.attrs['model']}, not a {cls.__name__}")
+        self = cls(**root.attrs['params'])
+        self._load_state(root)
+        self._relist_footprint()
+        self.data_acquisition = ObservableStore.from_checkpoint(root['observables'])
+        self.iteration = root.attrs['iteration']
+        self._run_settings = root.attrs['run']
+        if self._run_settings is not None:
+            if self._run_settings['filename'] is None:
+                stored = root['snapshots']
+                array = zarr.open(None, mode='w', shape=stored.shape, chunks=stored.chunks, dtype=stored.dtype)
+                array[...] = stored[...]
+                array.attrs.update(dict(stored.attrs))
+                self.saved_snapshots = Snapshots(array)
+            else:
+                self.saved_snapshots = Snapshots.open(self._run_settings['filename'], mode='r+')
+            if self._run_settings.get('pyramid_levels'):
+                if self._run_settings['pyramid_filename'] is None:
+                    self.pyramid = Pyramid.from_checkpoint(root['pyramid'])
+                else:
+                    self.pyramid = Pyramid.open(self._run_settings['pyramid_filename'], mode='r+')
+        load_rng_state(root['rng'])
+        return self
+
+    def save(self, file_name: str = 'sim'):
+        """
+        Save a checkpoint (see `checkpoint`) as state/`file_name`.zarr.
+
+        :param file_name: name of the checkpoint
+        :type file_name: str
+        """
+        self.checkpoint('state/' + file_name + '.zarr')
+
+    def open(self, file_name: str = 'sim'):
+        """
+        Restore this simulation from the checkpoint saved by `save` (see `from_checkpoint`).
+
+        :param file_name: name of the checkpoint
+        :type file_name: str
+        """
+        self.__dict__.update(self.from_checkpoint('state/' + file_name + '.zarr').__dict__)
 
     def get_exponent(self,
                      column: str = 'AvalancheSize',
@@ -272,6 +1005,10 @@ class Simulation:
         """
         Plot histogram of gathered data from data_df,
 
+        .. deprecated::
+            Least-squares fit of the log-log histogram, biased for power laws;
+            use `fit_exponent`, whose `exponent` is positive, instead.
+
         :param column: which column of data_df should be visualized?
         :type column: str
         :param low: lower cutoff for log-log-linear fit
@@ -285,6 +1022,7 @@ class Simulation:
         :return: fit parameters
         :rtype: dict
         """
+        warnings.warn("get_exponent is deprecated, use fit_exponent", DeprecationWarning, stacklevel=2)
         df = self.data_df
         filtered = df.loc[df.number_of_iterations != 0, column]
         sizes, counts = np.unique(filtered, return_counts=True)
@@ -316,6 +1054,59 @@ class Simulation:
         print(f"y = {10**coef_b:.3f} exp({coef_a:.4f} x)")
         return dict(exponent=coef_a, intercept = coef_b)
 
+    def fit_exponent(self,
+                     column: str = 'AvalancheSize',
+                     low: typing.Optional[float] = None,
+                     high: typing.Optional[float] = None,
+                     plot: bool = True,
+                     plot_filename: typing.Optional[str] = None,
+                     n_bootstrap: int = 0) -> dict:
+        """
+        Fit a power law p(x) ~ x**-exponent to the distribution of a gathered observable, by maximum
+        likelihood on its log-binned histogram (see `powerlaw.fit_power_law`), and plot both.
+
+        :param column: which column of data_df should be visualized?
+        :type column: str
+        :param low: lower cutoff of the fit; chosen by the Kolmogorov-Smirnov distance if None
+        :type low: float
+        :param high: upper cutoff of the fit; none if None
+        :type high: float
+        :param plot: if False, skips all plotting and just returns fit parameters
+        :type plot: bool
+        :param plot_filename: optional filename for saved plot. This skips displaying the plot!
+        :type plot_filename: bool
+        :param n_bootstrap: number of bootstrap resamplings for the confidence interval of the exponent
+        :type n_bootstrap: int
+        :return: fit parameters: `exponent` (positive), the cutoffs `xmin` and `xmax` actually used,
+            `ks` distance, `n_tail` number of fitted events and, with `n_bootstrap`, the `confidence_interval`
+        :rtype: dict
+        """
+        histogram = self.histograms[column]
+        fit = powerlaw.fit_power_law(histogram, low, high, n_bootstrap=n_bootstrap)
+        if plot:
+            fig, ax = plt.subplots()
+            ax.loglog(*histogram.density(), ".", label="data")
+            x_plot = np.array([fit['xmin'], min(fit['xmax'], histogram.edges[np.flatnonzero(histogram.counts)[-1] + 1])])
+            ax.loglog(x_plot, powerlaw.power_law_density(x_plot, fit, histogram),
+                      label=fr"$p(x) \sim x^{{-{fit['exponent']:.4f}}}$",
+                      alpha=0.5)
+
+            ax.axvline(fit['xmin'], linestyle="--", label=f"Low cutoff: {fit['xmin']:.3f}")
+            if np.isfinite(fit['xmax']):
+                ax.axvline(fit['xmax'],  linestyle="--", label=f"High cutoff: {fit['xmax']:.3f}")
+            ax.grid()
+            ax.legend(loc='best')
+            ax.set_xlabel(column)
+            ax.set_ylabel(f"p[{column}]")
+            plt.tight_layout()
+            if plot_filename is None:
+                plt.show()
+            else:
+                fig.savefig(plot_filename)
+                plt.close()
+        print(f"p(x) ~ x^-{fit['exponent']:.4f} for x >= {fit['xmin']:g}")
+        return fit
+
     # TODO how is this different from `load`?
     @classmethod
     def from_file(cls, filename: str):
@@ -327,12 +1118,15 @@ class Simulation:
         :return: simulation object, of the subclass you used
         :rtype: Simulation
         """
-        saved_snapshots = zarr.open(filename)
+        saved_snapshots = Snapshots.open(filename)
         save_every = saved_snapshots.attrs['save_every']
         L = saved_snapshots.shape[1] - 2 * cls.BOUNDARY_SIZE
         self = cls(L=L, save_every=save_every)
-        self.values = saved_snapshots[-1]
+        self.values = saved_snapshots[-1].astype(self.values.dtype)
         self.saved_snapshots = saved_snapshots
+        pyramid_filename = os.path.splitext(filename)[0] + ".pyramid.zarr"
+        if os.path.exists(pyramid_filename):
+            self.pyramid = Pyramid.open(pyramid_filename)
         return self
         
 @numba.njit
@@ -357,3 +1151,21 @@ def clean_boundary_inplace(array: np.ndarray, boundary_size: int, fill_value = F
     array[:, -boundary_size:] = fill_value
     return array
 
+
+
+@numba.njit
+def inside_sum(array: np.ndarray, boundary_size: int) -> int:
+    """
+    Sum of `array` without the boundaries, for use inside compiled loops.
+
+    :param array: array to be summed
+    :type array: np.ndarray
+    :param boundary_size:
+    :type boundary_size: int
+    :rtype: int
+    """
+    total = 0
+    for x in range(boundary_size, array.shape[0] - boundary_size):
+        for y in range(boundary_size, array.shape[1] - boundary_size):
+            total += array[x, y]
+    return total
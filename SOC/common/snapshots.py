@@ -0,0 +1,420 @@
+"""Contains the storage format, the lazy reader and the background writer for simulation snapshots."""
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import os
+import weakref
+import numpy as np
+import zarr
+
+FORMATS = ("full", "compact")
+
+
+def _compression() -> dict:
+    """
+    Keyword arguments for `zarr.open` selecting a compressor tuned for small-integer lattices.
+    """
+    try:
+        from zarr.codecs import BloscCodec, BytesCodec
+    except ImportError:     # zarr 2
+        from numcodecs import Blosc
+        return dict(compressor=Blosc(cname='zstd', clevel=5, shuffle=Blosc.BITSHUFFLE))
+    return dict(codecs=[BytesCodec(), BloscCodec(cname='zstd', clevel=5, shuffle='bitshuffle')])
+
+
+def create_snapshots(filename, n_frames: int, width: int, dtype: np.dtype, chunk_length: int,
+                     snapshot_format: str = "full", boundary_size: int = 1,
+                     compact_dtype: np.dtype = None, delta: bool = True) -> "Snapshots":
+    """
+    Create the zarr array for the snapshots of a run.
+
+    :param filename: path of the array; None keeps it in memory
+    :param n_frames: number of snapshots
+    :type n_frames: int
+    :param width: width of the lattice, with boundaries
+    :type width: int
+    :param dtype: dtype of the lattice
+    :type dtype: np.dtype
+    :param chunk_length: number of snapshots per chunk (and, for "compact", per keyframe)
+    :type chunk_length: int
+    :param snapshot_format: "full" stores whole lattices, boundaries included, with `dtype`;
+        "compact" stores only the inside of the lattice, as `compact_dtype`, compressed
+        with zstd + bitshuffle
+    :type snapshot_format: str
+    :param boundary_size: size of the lattice's boundary, which "compact" drops
+    :type boundary_size: int
+    :param compact_dtype: dtype for "compact", by default `dtype`
+    :type compact_dtype: np.dtype
+    :param delta: for "compact", store every snapshot but the first of each chunk (the keyframe)
+        XORed with that keyframe, so that sites which did not change compress to zeros
+    :type delta: bool
+    :rtype: Snapshots
+    """
+    if snapshot_format not in FORMATS:
+        raise ValueError(f"snapshot_format must be one of {FORMATS}, got {snapshot_format!r}")
+    kwargs = {}
+    if snapshot_format == "compact":
+        width -= 2 * boundary_size
+        dtype = dtype if compact_dtype is None else compact_dtype
+        kwargs = _compression()
+    array = zarr.open(filename, mode='w', shape=(n_frames, width, width),
+                      chunks=(chunk_length, width, width), dtype=dtype, **kwargs)
+    array.attrs['format'] = snapshot_format
+    array.attrs['boundary_size'] = boundary_size
+    if snapshot_format == "compact":
+        array.attrs['delta'] = delta
+    return Snapshots(array)
+
+
+class Snapshots:
+    """
+    Read (and encode) the snapshots of a run, whatever their storage format.
+
+    Indexing along the first (time) axis returns numpy arrays of whole lattices,
+    boundaries included; for "compact" snapshots the boundaries are filled with zeros.
+
+    The smallest and largest values inside the lattice of the encoded frames, whatever their
+    format, are kept as they go by and stored in the attrs by `save_range`, so that animations
+    can fix their colors without reading every frame first (see `value_range`).
+
+    :param array: zarr array made by `create_snapshots`, or a plain array of full snapshots
+    """
+
+    def __init__(self, array):
+        self.array = array
+        self.attrs = array.attrs
+        self.format = self.attrs.get('format', 'full')
+        self.lattice_boundary = self.attrs.get('boundary_size', 0)
+        self.boundary_size = self.lattice_boundary if self.format == "compact" else 0
+        self.delta = self.attrs.get('delta', False) if self.format == "compact" else False
+        self.chunk_length = array.chunks[0]
+        self._keyframe = None
+        self._range = None
+
+    @classmethod
+    def open(cls, filename, mode: str = 'a') -> "Snapshots":
+        """
+        Open saved snapshots.
+
+        :param filename: path of the zarr array
+        :param mode: zarr persistence mode
+        :type mode: str
+        :rtype: Snapshots
+        """
+        return cls(zarr.open(filename, mode=mode))
+
+    @property
+    def shape(self) -> tuple:
+        n_frames, width, height = self.array.shape
+        return n_frames, width + 2 * self.boundary_size, height + 2 * self.boundary_size
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.array.dtype
+
+    @property
+    def filename(self):
+        """
+        Path of the array on disk, or None for arrays kept in memory.
+        """
+        store = getattr(self.array, 'store', None)
+        root = getattr(store, 'root', None) or getattr(store, 'path', None)    # zarr 3, zarr 2
+        if root is None:
+            return None
+        return os.path.join(str(root), self.array.path) if self.array.path else str(root)
+
+    def __len__(self) -> int:
+        return self.array.shape[0]
+
+    def encode(self, index: int, frame: np.ndarray) -> np.ndarray:
+        """
+        Turn a lattice into what is stored as frame `index`. Frames must be encoded in increasing order.
+
+        :param index: index of the frame
+        :type index: int
+        :param frame: whole lattice, boundaries included
+        :type frame: np.ndarray
+        :rtype: np.ndarray
+        """
+        bc = self.lattice_boundary
+        inside = frame[bc:-bc, bc:-bc] if bc else frame
+        if inside.size:
+            low, high = inside.min(), inside.max()
+            if self._range is not None:
+                low, high = min(low, self._range[0]), max(high, self._range[1])
+            self._range = low, high
+        if self.format == "full":
+            return frame
+        frame = inside
+        if self.dtype.kind in 'iu' and frame.size and (self._range[0] < np.iinfo(self.dtype).min
+                                                       or self._range[1] > np.iinfo(self.dtype).max):
+            raise ValueError(f"Snapshot values do not fit in {self.dtype}")
+        frame = frame.astype(self.dtype)
+        if not self.delta:
+            return frame
+        if index % self.chunk_length == 0:
+            self._keyframe = frame
+            return frame
+        if self._keyframe is None:     # e.g. resuming a run in the middle of a chunk
+            self._keyframe = self.array[index - index % self.chunk_length]
+        return _xor(frame, self._keyframe)
+
+    def _decode(self, start: int, stop: int) -> np.ndarray:
+        """
+        Frames `start` to `stop`, as stored, decoded against their keyframes.
+        """
+        if not self.delta:
+            return self.array[start:stop]
+        first = start - start % self.chunk_length
+        frames = self.array[first:stop]
+        for keyframe in range(0, frames.shape[0], self.chunk_length):
+            chunk = frames[keyframe:keyframe + self.chunk_length]
+            chunk[1:] = _xor(chunk[1:], chunk[0])
+        return frames[start - first:]
+
+    def save_range(self):
+        """
+        Store the range of the values encoded so far in `attrs['value_range']`,
+        widening the one stored before, e.g. by the part of the run before a checkpoint.
+        """
+        if self._range is None:
+            return
+        low, high = self._range
+        if 'value_range' in self.attrs:
+            stored_low, stored_high = self.attrs['value_range']
+            low, high = min(low, stored_low), max(high, stored_high)
+        self.attrs['value_range'] = [np.asarray(low).item(), np.asarray(high).item()]
+
+    @property
+    def value_range(self) -> tuple:
+        """
+        Smallest and largest value inside the lattice over all frames.
+
+        Read from the attrs if `save_range` stored it; otherwise computed a chunk at a time
+        and, if the array is writable, stored for the next time.
+
+        :rtype: tuple
+        """
+        if 'value_range' not in self.attrs:
+            low = high = None
+            for start in range(0, len(self), self.chunk_length):
+                frames = self.read(start, start + self.chunk_length, self.lattice_boundary)
+                if frames.size:
+                    low = frames.min() if low is None else min(low, frames.min())
+                    high = frames.max() if high is None else max(high, frames.max())
+            if low is None:
+                return 0, 0
+            value_range = [np.asarray(low).item(), np.asarray(high).item()]
+            if getattr(self.array, 'read_only', False):
+                return tuple(value_range)
+            self.attrs['value_range'] = value_range
+        return tuple(self.attrs['value_range'])
+
+    def read(self, start: int, stop: int, crop: int = 0) -> np.ndarray:
+        """
+        Frames `start` to `stop` with `crop` sites cut off every side of the whole lattices,
+        without padding what would be cut off again.
+
+        :param start: first frame
+        :type start: int
+        :param stop: frame after the last one
+        :type stop: int
+        :param crop: number of sites to drop at every side, e.g. the boundary size
+        :type crop: int
+        :rtype: np.ndarray
+        """
+        frames = self._decode(start, max(start, min(stop, len(self))))
+        if crop >= self.boundary_size:
+            cut = crop - self.boundary_size
+            return frames[:, cut:frames.shape[1] - cut, cut:frames.shape[2] - cut]
+        pad = self.boundary_size - crop
+        return np.pad(frames, ((0, 0), (pad, pad), (pad, pad)))
+
+    def frames(self, crop: int = 0, max_chunks: int = 3, prefetch: bool = True) -> "FrameCache":
+        """
+        Lazy random access to single frames (see `FrameCache`).
+
+        :param crop: number of sites to drop at every side of the lattices
+        :type crop: int
+        :param max_chunks: number of decoded chunks kept in memory
+        :type max_chunks: int
+        :param prefetch: read the next chunk in the background while the current one is used
+        :type prefetch: bool
+        :rtype: FrameCache
+        """
+        return FrameCache(self, crop, max_chunks, prefetch)
+
+    def _pad(self, frames: np.ndarray) -> np.ndarray:
+        if self.boundary_size == 0:
+            return frames
+        bc = self.boundary_size
+        return np.pad(frames, ((0, 0), (bc, bc), (bc, bc)))
+
+    def __getitem__(self, key) -> np.ndarray:
+        if not isinstance(key, tuple):
+            key = (key,)
+        time, rest = key[0], key[1:]
+        if time is Ellipsis:
+            time, rest = slice(None), (Ellipsis,) + rest
+        if isinstance(time, slice):
+            start, stop, step = time.indices(len(self))
+            if step < 0:
+                raise IndexError("Snapshots can only be read forwards")
+            frames = self._pad(self._decode(start, max(start, stop)))[::step]
+            rest = (slice(None),) + rest
+        else:
+            index = range(len(self))[time]
+            frames = self._pad(self._decode(index, index + 1))[0]
+        return frames[rest] if rest else frames
+
+    def __iter__(self):
+        for start in range(0, len(self), self.chunk_length):
+            yield from self[start:start + self.chunk_length]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self[:], dtype=dtype)
+
+
+class FrameCache:
+    """
+    Single frames of `Snapshots`, read a whole chunk at a time when first asked for.
+
+    The last `max_chunks` decoded chunks are kept in memory, and the chunk after the one
+    last read is fetched by a background thread, so that playing the frames in order
+    never waits for the disk and never holds more than a few chunks. `close` the cache,
+    or use it as a context manager, to stop the thread once done.
+
+    :param snapshots: snapshots to read
+    :type snapshots: Snapshots
+    :param crop: number of sites to drop at every side of the lattices
+    :type crop: int
+    :param max_chunks: number of decoded chunks kept in memory
+    :type max_chunks: int
+    :param prefetch: read the next chunk in the background
+    :type prefetch: bool
+    """
+
+    def __init__(self, snapshots: Snapshots, crop: int = 0, max_chunks: int = 3, prefetch: bool = True):
+        self.snapshots = snapshots
+        self.crop = crop
+        self.max_chunks = max(max_chunks, 2 if prefetch else 1)
+        self._chunks = collections.OrderedDict()
+        self._executor = ThreadPoolExecutor(1) if prefetch else None
+        # stops the prefetching thread when the cache is closed or garbage collected
+        self._shutdown = weakref.finalize(self, self._executor.shutdown) if prefetch else None
+
+    def __len__(self) -> int:
+        return len(self.snapshots)
+
+    def _read(self, chunk: int) -> np.ndarray:
+        start = chunk * self.snapshots.chunk_length
+        return self.snapshots.read(start, start + self.snapshots.chunk_length, self.crop)
+
+    def _chunk(self, chunk: int) -> np.ndarray:
+        if chunk not in self._chunks:
+            self._chunks[chunk] = self._executor.submit(self._read, chunk) if self._executor else self._read(chunk)
+        self._chunks.move_to_end(chunk)
+        while len(self._chunks) > self.max_chunks:
+            self._chunks.popitem(last=False)
+        frames = self._chunks[chunk]
+        return frames if isinstance(frames, np.ndarray) else frames.result()
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        index = range(len(self))[index]
+        chunk, offset = divmod(index, self.snapshots.chunk_length)
+        frames = self._chunk(chunk)
+        following = chunk + 1
+        if self._executor is not None and following * self.snapshots.chunk_length < len(self) \
+                and following not in self._chunks:
+            self._chunks[following] = self._executor.submit(self._read, following)
+        return frames[offset]
+
+    def close(self):
+        """
+        Stop the prefetching thread and drop the cached chunks.
+        """
+        if self._shutdown is not None:
+            self._shutdown()
+        self._chunks.clear()
+
+    def __enter__(self) -> "FrameCache":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _xor(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    Bitwise XOR of two arrays of any (same) dtype.
+    """
+    view = np.dtype(f"u{a.dtype.itemsize}")
+    return (a.view(view) ^ b.view(view)).view(a.dtype)
+
+
+class SnapshotWriter:
+    """
+    Writes consecutive snapshots into a zarr array from background threads.
+
+    Snapshots are gathered in memory until a whole chunk (along the first axis)
+    is complete, which is then compressed and written by one of `max_workers`
+    threads while the simulation goes on. Every chunk is thus written exactly
+    once, instead of being re-read and rewritten for every snapshot in it.
+
+    :param array: zarr array of shape (time, ...) to write into
+    :param max_workers: number of writer threads; at most `max_workers + 1` chunks wait to be written
+    :type max_workers: int
+    """
+
+    def __init__(self, array, max_workers: int = 2):
+        self.array = array
+        self.chunk_length = array.chunks[0]
+        self._executor = ThreadPoolExecutor(max_workers)
+        self._max_pending = max_workers + 1
+        self._pending = collections.deque()
+        self._buffer = None
+
+    def write(self, index: int, frame: np.ndarray):
+        """
+        Store `frame` as `array[index]`. Indices must be given in increasing order.
+
+        :param index: index along the first axis of the array
+        :type index: int
+        :param frame: snapshot; it is copied, so it can be modified afterwards
+        :type frame: np.ndarray
+        """
+        start = index - index % self.chunk_length
+        if self._buffer is not None and start != self._start:
+            self._submit()
+        if self._buffer is None:
+            self._buffer = np.empty((self.chunk_length,) + self.array.shape[1:], dtype=self.array.dtype)
+            self._start, self._low = start, index
+        self._buffer[index - start] = frame
+        self._high = index + 1
+        if self._high - start == self.chunk_length or self._high == self.array.shape[0]:
+            self._submit()
+
+    def _submit(self):
+        low, high = self._low, self._high
+        buffer = self._buffer[low - self._start:high - self._start]
+        self._pending.append(self._executor.submit(self.array.__setitem__, slice(low, high), buffer))
+        self._buffer = None
+        while len(self._pending) > self._max_pending:
+            self._pending.popleft().result()
+
+    def flush(self):
+        """
+        Write out the snapshots gathered so far and wait until all writes are done.
+        """
+        if self._buffer is not None:
+            self._submit()
+        while self._pending:
+            self._pending.popleft().result()
+
+    def close(self):
+        """
+        Flush and stop the writer threads.
+        """
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown()
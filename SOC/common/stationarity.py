@@ -0,0 +1,50 @@
+"""Contains the online test used to detect when a simulation has thermalized."""
+import numpy as np
+
+
+class StationarityMonitor:
+    """
+    Windowed test for the stationarity of a few statistics measured once per block of iterations.
+
+    The last `2 * window` measurements are split in two halves; the statistics are
+    considered stationary once, for every one of them, the means of the two halves
+    differ by at most `threshold` standard errors. A drift (e.g. the density of a
+    lattice still filling up) makes the halves differ by much more than that.
+
+    :param window: number of blocks per half
+    :type window: int
+    :param threshold: allowed difference of the means, in standard errors
+    :type threshold: float
+    """
+
+    def __init__(self, window: int = 10, threshold: float = 3.0):
+        if window < 2:
+            raise ValueError("window must be at least 2")
+        self.window = window
+        self.threshold = threshold
+        self.history = []
+
+    def update(self, *statistics: float) -> bool:
+        """
+        Add the statistics of one block.
+
+        :return: whether the statistics look stationary now
+        :rtype: bool
+        """
+        self.history.append(statistics)
+        return self.stationary
+
+    @property
+    def stationary(self) -> bool:
+        """
+        Whether the last `2 * window` measurements pass the test.
+
+        :rtype: bool
+        """
+        if len(self.history) < 2 * self.window:
+            return False
+        recent = np.array(self.history[-2 * self.window:], dtype=float)
+        first, second = recent[:self.window], recent[self.window:]
+        difference = np.abs(first.mean(axis=0) - second.mean(axis=0))
+        error = np.sqrt((first.var(axis=0, ddof=1) + second.var(axis=0, ddof=1)) / self.window)
+        return bool(np.all(difference <= self.threshold * error))
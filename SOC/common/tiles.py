@@ -0,0 +1,111 @@
+"""Contains helpers for the tiled (domain-decomposed) parallel relaxation of abelian models."""
+import numpy as np
+import numba
+
+#: `active` flag of a tile that only received grains on its edges
+EDGES = 1
+#: `active` flag of a tile that has to be scanned whole
+WHOLE = 2
+
+
+def tile_grid(L: int, tile_size: int) -> np.ndarray:
+    """
+    Array of flags of the tiles covering a lattice of linear size `L`, all inactive.
+
+    :param L: linear size of the lattice, without boundaries
+    :type L: int
+    :param tile_size: linear size of the tiles; at least 2, so that tiles of the same
+        colour (see `tile_index`) never write to the same site
+    :type tile_size: int
+    :rtype: np.ndarray
+    """
+    if tile_size < 2:
+        raise ValueError("Tiles must be at least 2 sites wide")
+    n_tiles = -(-L // tile_size)
+    return np.zeros((n_tiles, n_tiles), dtype=np.uint8)
+
+
+@numba.njit
+def tile_bounds(tx: int, ty: int, tile_size: int, boundary_size: int, width: int, height: int):
+    """
+    The sites of tile (`tx`, `ty`): x0 <= x < x1, y0 <= y < y1.
+    """
+    x0 = boundary_size + tx * tile_size
+    y0 = boundary_size + ty * tile_size
+    return x0, min(x0 + tile_size, width - boundary_size), y0, min(y0 + tile_size, height - boundary_size)
+
+
+@numba.njit
+def tile_index(t: int, color: int, active: np.ndarray):
+    """
+    Tile number `t` among those of colour `color`.
+
+    Tiles are coloured like a 2x2 checkerboard, so that tiles of the same colour are
+    at least one tile apart: relaxing them concurrently, each one writes only to its
+    own sites and to the edges of its neighbours, never to the same site as another.
+
+    :return: tx, ty
+    """
+    n_y = (active.shape[1] - color % 2 + 1) // 2
+    return color // 2 + 2 * (t // n_y), color % 2 + 2 * (t % n_y)
+
+
+@numba.njit
+def tiles_of_color(color: int, active: np.ndarray) -> int:
+    """
+    Number of tiles of colour `color`.
+    """
+    return ((active.shape[0] - color // 2 + 1) // 2) * ((active.shape[1] - color % 2 + 1) // 2)
+
+
+@numba.njit
+def activate_seeds(active: np.ndarray, seeds: np.ndarray, tile_size: int, boundary_size: int):
+    """
+    Mark the tiles holding `seeds` (Nx2 site indices) to be scanned whole.
+    """
+    for i in range(seeds.shape[0]):
+        active[(seeds[i, 0] - boundary_size) // tile_size, (seeds[i, 1] - boundary_size) // tile_size] = WHOLE
+
+
+@numba.njit
+def activate_site(active: np.ndarray, x: int, y: int, tile_size: int, boundary_size: int, width: int, height: int):
+    """
+    Mark the tile of site (`x`, `y`), which got grains from another tile, to have its edges scanned.
+    Sites on the boundary of the lattice belong to no tile.
+    """
+    if boundary_size <= x < width - boundary_size and boundary_size <= y < height - boundary_size:
+        tx, ty = (x - boundary_size) // tile_size, (y - boundary_size) // tile_size
+        if active[tx, ty] == 0:
+            active[tx, ty] = EDGES
+
+
+@numba.njit
+def _push(values: np.ndarray, critical_value, queued: np.ndarray, stack: np.ndarray, n: int, x: int, y: int) -> int:
+    if values[x, y] > critical_value and not queued[x, y]:
+        queued[x, y] = True
+        stack[n] = x * values.shape[1] + y
+        n += 1
+    return n
+
+
+@numba.njit
+def unstable_sites(values: np.ndarray, critical_value, queued: np.ndarray, stack: np.ndarray,
+                   x0: int, x1: int, y0: int, y1: int, mode: int) -> int:
+    """
+    Push the unstable sites of a tile onto `stack`, scanning the whole tile or only its edges.
+
+    :return: number of sites on the stack
+    """
+    n = 0
+    if mode == WHOLE:
+        for x in range(x0, x1):
+            for y in range(y0, y1):
+                n = _push(values, critical_value, queued, stack, n, x, y)
+        return n
+    for y in range(y0, y1):
+        n = _push(values, critical_value, queued, stack, n, x0, y)
+        n = _push(values, critical_value, queued, stack, n, x1 - 1, y)
+    for x in range(x0 + 1, x1 - 1):
+        n = _push(values, critical_value, queued, stack, n, x, y0)
+        n = _push(values, critical_value, queued, stack, n, x, y1 - 1)
+    return n
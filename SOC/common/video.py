@@ -0,0 +1,148 @@
+"""Contains the headless export of snapshots to videos and image sequences."""
+import collections
+import concurrent.futures
+import multiprocessing
+import os
+import shutil
+import subprocess
+import numpy as np
+import matplotlib
+import matplotlib.colors
+import matplotlib.image
+from tqdm import auto as tqdm
+from .snapshots import Snapshots
+
+VIDEO_EXTENSIONS = (".mp4", ".mkv", ".webm", ".mov", ".avi")
+
+
+def render(frames: np.ndarray, value_range: tuple, cmap: str = 'viridis') -> np.ndarray:
+    """
+    Color lattices as 8-bit RGB images, without going through a figure.
+
+    :param frames: lattices, of shape (time, width, height)
+    :type frames: np.ndarray
+    :param value_range: values mapped to both ends of the colormap
+    :type value_range: tuple
+    :param cmap: name of a matplotlib colormap
+    :type cmap: str
+    :return: images of shape (time, width, height, 3)
+    :rtype: np.ndarray
+    """
+    norm = matplotlib.colors.Normalize(*value_range, clip=True)
+    colormap = matplotlib.colormaps[cmap]
+    low, high = value_range
+    if frames.dtype.kind in 'iu' and high - low < 2**16:
+        # few distinct values: color them once and look the sites up
+        low, high = int(np.floor(low)), int(np.ceil(high))
+        table = colormap(norm(np.arange(low, high + 1)), bytes=True)[:, :3]
+        return table[np.clip(frames, low, high).astype(np.intp) - low]
+    return colormap(norm(frames), bytes=True)[..., :3]
+
+
+def _render_chunk(snapshots, start: int, stop: int, crop: int, value_range: tuple, cmap: str,
+                  directory: str = None):
+    """
+    Render frames `start` to `stop`, writing them to `directory` as png files if given
+    and returning them otherwise. `snapshots` is opened from its path in worker processes.
+    """
+    if isinstance(snapshots, str):
+        snapshots = Snapshots.open(snapshots, mode='r')
+    images = render(snapshots.read(start, stop, crop), value_range, cmap)
+    if directory is None:
+        return images
+    for index, image in enumerate(images, start):
+        matplotlib.image.imsave(os.path.join(directory, f"frame_{index:06d}.png"), image)
+    return len(images)
+
+
+def _ffmpeg(filename: str, width: int, height: int, fps: float) -> subprocess.Popen:
+    """
+    ffmpeg encoding raw RGB frames from its standard input into `filename`.
+    """
+    executable = shutil.which("ffmpeg")
+    if executable is None:
+        raise RuntimeError(f"Writing {filename} needs ffmpeg; export to a directory of png files instead")
+    command = [executable, "-y", "-loglevel", "error",
+               "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{height}x{width}", "-r", str(fps), "-i", "-",
+               # yuv420p, which every player reads, needs even sizes
+               "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-pix_fmt", "yuv420p", filename]
+    return subprocess.Popen(command, stdin=subprocess.PIPE)
+
+
+def export(snapshots: Snapshots, filename: str, fps: float = 30, crop: int = 0, cmap: str = 'viridis',
+           value_range: tuple = None, max_workers: int = None) -> str:
+    """
+    Render every snapshot to a video or to a directory of png files, one chunk of frames per task.
+
+    Tasks run on a local process pool; each worker opens the snapshots from disk and reads
+    only its own chunks, so neither the snapshots nor the video are ever all in memory.
+    Colors are fixed over the whole export by `value_range`.
+
+    :param snapshots: snapshots to render
+    :type snapshots: Snapshots
+    :param filename: path of the video, whose extension (one of `VIDEO_EXTENSIONS`) selects
+        encoding with ffmpeg; any other path is a directory that gets one frame_XXXXXX.png per snapshot
+    :type filename: str
+    :param fps: frames per second of the video
+    :type fps: float
+    :param crop: number of sites to drop at every side of the lattices, e.g. the boundary size
+    :type crop: int
+    :param cmap: name of a matplotlib colormap
+    :type cmap: str
+    :param value_range: values at both ends of the colormap; by default `snapshots.value_range`
+    :type value_range: tuple
+    :param max_workers: number of processes; 0 renders in this process, as do snapshots kept in memory
+    :type max_workers: int
+    :return: `filename`
+    :rtype: str
+    """
+    if value_range is None:
+        value_range = snapshots.value_range
+    video = os.path.splitext(filename)[1].lower() in VIDEO_EXTENSIONS
+    n_frames, width, height = snapshots.shape
+    encoder = _ffmpeg(filename, width - 2 * crop, height - 2 * crop, fps) if video else None
+    directory = None if video else filename
+    if directory is not None:
+        os.makedirs(directory, exist_ok=True)
+
+    path = snapshots.filename
+    in_process = max_workers == 0 or path is None
+    source = snapshots if in_process else path
+    tasks = [(source, start, start + snapshots.chunk_length, crop, value_range, cmap, directory)
+             for start in range(0, n_frames, snapshots.chunk_length)]
+    progress = tqdm.tqdm(total=n_frames, desc="frames")
+    try:
+        if in_process:
+            for task in tasks:
+                _consume(_render_chunk(*task), encoder, progress)
+        else:
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            with concurrent.futures.ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context(method)) as executor:
+                # frames are written in order, with a bounded number of rendered chunks waiting
+                window = 2 * (max_workers or os.cpu_count() or 1)
+                pending = collections.deque()
+                for task in tasks:
+                    pending.append(executor.submit(_render_chunk, *task))
+                    if len(pending) >= window:
+                        _consume(pending.popleft().result(), encoder, progress)
+                while pending:
+                    _consume(pending.popleft().result(), encoder, progress)
+    finally:
+        progress.close()
+        if encoder is not None:
+            encoder.stdin.close()
+            encoder.wait()
+    if encoder is not None and encoder.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to write {filename}")
+    return filename
+
+
+def _consume(result, encoder: subprocess.Popen, progress):
+    """
+    Pipe rendered frames to the encoder, or just count frames already written as png files.
+    """
+    if encoder is None:
+        progress.update(result)
+        return
+    encoder.stdin.write(np.ascontiguousarray(result).tobytes())
+    progress.update(len(result))
@@ -9,14 +9,59 @@ class BTW(common.Simulation):
 
     :param L: linear size of lattice, without boundary layers
     :type L: int
+    :param engine: "wave" by default - rescans the lattice on every wave (`topple`);
+        "worklist" only re-checks the neighbours of toppled sites (`topple_worklist`);
+        "tiled" relaxes tiles of `tile_size` sites on all cores (`topple_tiled`), for huge lattices.
+        All give identical values and avalanche sizes. Compiled runs (`run(..., compiled=True)`) need "worklist".
+    :type engine: str
+    :param tile_size: linear size of the tiles of the "tiled" engine; `TILE_SIZE` by default
+    :type tile_size: int
     """
 
-    def __init__(self, *args, **kwargs):
+    ENGINES = ("wave", "worklist", "tiled")
+    GEOMETRY = True
+    TILE_SIZE = 64
+    BATCH_ARRAYS = ("values", "visited", "_touched", "_current", "_upcoming", "_queued")
+
+    def __init__(self, *args, engine: str = "wave", tile_size: int = TILE_SIZE, **kwargs):
         super().__init__(*args, **kwargs)
+        if engine not in self.ENGINES:
+            raise ValueError(f"engine must be one of {self.ENGINES}, got {engine!r}")
+        self.engine = engine
+        self.tile_size = tile_size
         self.d = 2 #lattice dimmension 
         self.q = 2*self.d #grains amount used at driving 
         self.z_c = self.q - 1 #critical slope
         self.values = np.zeros((self.L_with_boundary, self.L_with_boundary), dtype=int)
+        if engine == "worklist":
+            self._current = np.empty(self.L_with_boundary**2, dtype=np.int64)
+            self._upcoming = np.empty(self.L_with_boundary**2, dtype=np.int64)
+            self._queued = np.zeros((self.L_with_boundary, self.L_with_boundary), dtype=bool)
+        self._track_footprint(engine == "worklist")
+        if engine == "tiled":
+            self._queued = np.zeros((self.L_with_boundary, self.L_with_boundary), dtype=bool)
+            self._active = common.tiles.tile_grid(self.L, self.tile_size)
+
+    @property
+    def params(self) -> dict:
+        params = dict(super().params, engine=self.engine)
+        if self.tile_size != self.TILE_SIZE:
+            params['tile_size'] = self.tile_size
+        return params
+
+    @property
+    def snapshot_dtype(self) -> np.dtype:
+        """
+        Stable heights never exceed the critical slope.
+        """
+        return np.min_scalar_type(self.z_c)
+
+    @property
+    def drive_threshold(self) -> int:
+        """
+        `drive` adds one grain to a random site, which topples above `z_c`.
+        """
+        return self.z_c
 
     def drive(self, num_particles: int = 1):
         """
@@ -28,17 +73,79 @@ class BTW(common.Simulation):
         location = np.random.randint(self.BOUNDARY_SIZE, self.L_with_boundary - 1, size = (num_particles, 2))
         for x, y in location:
             self.values[x, y] += 1
+        self._driven_sites = location
 
     def topple_dissipate(self) -> int:
         """
         Distribute material from overloaded sites to neighbors.
 
-        Convenience wrapper for the numba.njitted `topple` function defined in `manna.py`.
+        Convenience wrapper for the numba.njitted `topple` (or `topple_worklist`)
+        function defined in `btw.py`. The number of topplings and the largest height
+        are kept in `_avalanche`.
 
+        :return: number of waves
         :rtype: int
         """
+        if self.engine == "tiled":
+            number_of_iterations, *self._avalanche = topple_tiled(
+                self.values, self.visited, self.z_c, self.BOUNDARY_SIZE,
+                self._pop_seeds(self.z_c), self.tile_size, self._active, self._queued)
+        elif self.engine == "worklist":
+            number_of_iterations, *self._avalanche = topple_worklist(
+                self.values, self.visited, self.z_c, self.BOUNDARY_SIZE, self._pop_seeds(self.z_c),
+                self._current, self._upcoming, self._queued, self._touched)
+        else:
+            number_of_iterations, *self._avalanche = topple(self.values, self.visited, self.z_c, self.BOUNDARY_SIZE)
+        return number_of_iterations
 
-        return topple(self.values, self.visited, self.z_c, self.BOUNDARY_SIZE)    
+    def stabilize(self):
+        """
+        Topple all overloaded sites at once, however many grains they hold, by computing
+        the odometer - how many times every site topples - instead of toppling wave by wave
+        (see the module-level `stabilize`). Meant for huge initial piles, e.g. millions of
+        grains on a single site.
+
+        `values` end up exactly as after `topple_dissipate`, and `visited` marks the sites
+        that received grains.
+
+        :return: the stable `values` and the odometer, an array of the same shape
+        :rtype: tuple
+        """
+        odometer = stabilize(self.values, self.z_c, self.BOUNDARY_SIZE)
+        received = np.zeros(self.values.shape, dtype=bool)
+        toppled = odometer > 0
+        received[1:, :] |= toppled[:-1, :]
+        received[:-1, :] |= toppled[1:, :]
+        received[:, 1:] |= toppled[:, :-1]
+        received[:, :-1] |= toppled[:, 1:]
+        if hasattr(self, '_touched'):
+            common.footprint.mark_mask(self.visited, self._touched, received)
+        else:
+            self.visited |= received
+        self._driven_sites = None
+        return self.values, odometer
+
+    def _run_compiled(self, n_iterations: int) -> dict:
+        if self.engine != "worklist":
+            raise ValueError("Compiled runs need engine='worklist'")
+        AvalancheSize = np.empty(n_iterations, dtype=np.int64)
+        number_of_iterations = np.empty(n_iterations, dtype=np.int64)
+        geometry = self._geometry_columns(n_iterations)
+        run_block(self.values, self.visited, self.z_c, self.BOUNDARY_SIZE,
+                  self._current, self._upcoming, self._queued, self._touched,
+                  AvalancheSize, number_of_iterations, *geometry.values())
+        return dict(AvalancheSize=AvalancheSize, number_of_iterations=number_of_iterations, **geometry)
+
+    def _run_batch(self, replicas: list, arrays: dict, seeds: np.ndarray, n_iterations: int) -> dict:
+        if self.engine != "worklist":
+            raise ValueError("Batched runs need engine='worklist'")
+        AvalancheSize = np.empty((seeds.size, n_iterations), dtype=np.int64)
+        number_of_iterations = np.empty((seeds.size, n_iterations), dtype=np.int64)
+        geometry = self._geometry_columns((seeds.size, n_iterations))
+        run_batch(arrays['values'], arrays['visited'], self.z_c, self.BOUNDARY_SIZE,
+                  arrays['_current'], arrays['_upcoming'], arrays['_queued'], arrays['_touched'],
+                  seeds, AvalancheSize, number_of_iterations, *geometry.values())
+        return dict(AvalancheSize=AvalancheSize, number_of_iterations=number_of_iterations, **geometry)
 
 
 
@@ -57,11 +164,15 @@ def topple(values: np.ndarray, visited: np.ndarray, critical_value: int, boundar
     :type critical_value: int
     :param boundary_size: size of boundary for the array
     :type boundary_size: int
-    :rtype: int
+    :return: number of waves, number of topplings and the largest height of a toppling
+        site at the start of its wave
+    :rtype: tuple
     """
 
     # find a boolean array of active (overloaded) sites
     number_of_iterations = 0
+    topplings = 0
+    max_height = 0
     active_sites = common.clean_boundary_inplace(values > critical_value, boundary_size)
     
     while active_sites.any():
@@ -69,6 +180,10 @@ def topple(values: np.ndarray, visited: np.ndarray, critical_value: int, boundar
         # a Nx2 array of integer indices for overloaded sites
 
         N = indices.shape[0]
+        topplings += N
+        for i in range(N):
+            x, y = indices[i]
+            max_height = max(max_height, values[x, y])
         for i in range(N):
             x, y = indices[i]
             values[x, y] -= critical_value + 1
@@ -85,4 +200,484 @@ def topple(values: np.ndarray, visited: np.ndarray, critical_value: int, boundar
 
         active_sites = common.clean_boundary_inplace(values > critical_value, boundary_size)
 
-    return number_of_iterations
+    return number_of_iterations, topplings, max_height
+
+
+@numba.njit
+def topple_worklist(values: np.ndarray, visited: np.ndarray, critical_value: int, boundary_size: int,
+                    seeds: np.ndarray, current: np.ndarray, upcoming: np.ndarray, queued: np.ndarray,
+                    touched: np.ndarray) -> int:
+    """
+    Event-driven equivalent of `topple`.
+
+    Instead of rescanning the lattice, keeps the list of sites that are to topple
+    in the current wave and only re-checks the neighbours it has just updated.
+    Every wave topples exactly the sites that `topple` would, so `values`,
+    `visited` and the returned number of waves are identical.
+
+    :param values: data array of the simulation
+    :type values: np.ndarray
+    :param visited: visited array, boolean or bit-packed (see `common.footprint`), needs to be cleaned beforehand
+    :type visited: np.ndarray
+    :param critical_value: nodes topple above this value
+    :type critical_value: int
+    :param boundary_size: size of boundary for the array
+    :type boundary_size: int
+    :param seeds: Nx2 array of sites that may have become unstable since the last relaxation
+    :type seeds: np.ndarray
+    :param current: scratch buffer of flat indices, at least `values.size` long
+    :type current: np.ndarray
+    :param upcoming: scratch buffer of flat indices, at least `values.size` long
+    :type upcoming: np.ndarray
+    :param queued: boolean array, all False; left all False on return
+    :type queued: np.ndarray
+    :param touched: touched list of `visited`, see `common.footprint`
+    :type touched: np.ndarray
+    :return: number of waves, number of topplings and the largest height, as `topple`
+    :rtype: tuple
+    """
+    width, height = values.shape
+    n_upcoming = 0
+    for i in range(seeds.shape[0]):
+        x, y = seeds[i, 0], seeds[i, 1]
+        if (not queued[x, y]
+                and boundary_size <= x < width - boundary_size
+                and boundary_size <= y < height - boundary_size):
+            queued[x, y] = True
+            upcoming[n_upcoming] = x * height + y
+            n_upcoming += 1
+
+    number_of_iterations = 0
+    topplings = 0
+    max_height = 0
+    while True:
+        # the wave consists of the queued sites that are overloaded right now
+        current, upcoming = upcoming, current
+        N = 0
+        for i in range(n_upcoming):
+            site = current[i]
+            x, y = site // height, site % height
+            queued[x, y] = False
+            if values[x, y] > critical_value:
+                current[N] = site
+                N += 1
+                max_height = max(max_height, values[x, y])
+        n_upcoming = 0
+        if N == 0:
+            break
+        topplings += N
+
+        for i in range(N):
+            site = current[i]
+            x, y = site // height, site % height
+            values[x, y] -= critical_value + 1
+            if values[x, y] > critical_value and not queued[x, y]:
+                queued[x, y] = True
+                upcoming[n_upcoming] = site
+                n_upcoming += 1
+
+            for xn, yn in ((x - 1, y), (x, y - 1), (x + 1, y), (x, y + 1)):
+                values[xn, yn] += 1
+                common.footprint.mark(visited, touched, xn, yn)
+                if (values[xn, yn] > critical_value and not queued[xn, yn]
+                        and boundary_size <= xn < width - boundary_size
+                        and boundary_size <= yn < height - boundary_size):
+                    queued[xn, yn] = True
+                    upcoming[n_upcoming] = xn * height + yn
+                    n_upcoming += 1
+
+        number_of_iterations += 1
+
+    return number_of_iterations, topplings, max_height
+
+
+@numba.njit
+def run_block(values: np.ndarray, visited: np.ndarray, critical_value: int, boundary_size: int,
+              current: np.ndarray, upcoming: np.ndarray, queued: np.ndarray, touched: np.ndarray,
+              AvalancheSize: np.ndarray, number_of_iterations: np.ndarray, Topplings: np.ndarray,
+              ExtentX: np.ndarray, ExtentY: np.ndarray, GyrationRadius: np.ndarray, MaxHeight: np.ndarray):
+    """
+    Compiled equivalent of repeated `BTW.drive` and `BTW.AvalancheLoop` calls.
+
+    Runs as many iterations as `AvalancheSize` is long, writing the observables
+    of each into `AvalancheSize`, `number_of_iterations` and the geometry columns
+    (see `common.Simulation._geometry`).
+
+    :param values: data array of the simulation
+    :type values: np.ndarray
+    :param visited: visited array, see `topple_worklist`
+    :type visited: np.ndarray
+    :param critical_value: nodes topple above this value
+    :type critical_value: int
+    :param boundary_size: size of boundary for the array
+    :type boundary_size: int
+    :param current: scratch buffer, see `topple_worklist`
+    :type current: np.ndarray
+    :param upcoming: scratch buffer, see `topple_worklist`
+    :type upcoming: np.ndarray
+    :param queued: scratch array, see `topple_worklist`
+    :type queued: np.ndarray
+    :param touched: touched list of `visited`, see `topple_worklist`
+    :type touched: np.ndarray
+    :param AvalancheSize: output column
+    :type AvalancheSize: np.ndarray
+    :param number_of_iterations: output column
+    :type number_of_iterations: np.ndarray
+    :param Topplings: output column
+    :type Topplings: np.ndarray
+    :param ExtentX: output column
+    :type ExtentX: np.ndarray
+    :param ExtentY: output column
+    :type ExtentY: np.ndarray
+    :param GyrationRadius: output column
+    :type GyrationRadius: np.ndarray
+    :param MaxHeight: output column
+    :type MaxHeight: np.ndarray
+    """
+    width, height = values.shape
+    seeds = np.empty((1, 2), dtype=np.int64)
+    for i in range(AvalancheSize.shape[0]):
+        x = np.random.randint(boundary_size, width - boundary_size)
+        y = np.random.randint(boundary_size, height - boundary_size)
+        values[x, y] += 1
+        seeds[0, 0], seeds[0, 1] = x, y
+        common.footprint.clear(visited, touched)
+        number_of_iterations[i], Topplings[i], MaxHeight[i] = topple_worklist(
+            values, visited, critical_value, boundary_size, seeds, current, upcoming, queued, touched)
+        AvalancheSize[i] = common.footprint.size(visited, touched, boundary_size, width, height)
+        ExtentX[i], ExtentY[i], GyrationRadius[i] = common.footprint.geometry(
+            visited, touched, boundary_size, width, height)
+
+
+@numba.njit(parallel=True)
+def run_batch(values: np.ndarray, visited: np.ndarray, critical_value: int, boundary_size: int,
+              current: np.ndarray, upcoming: np.ndarray, queued: np.ndarray, touched: np.ndarray,
+              seeds: np.ndarray, AvalancheSize: np.ndarray, number_of_iterations: np.ndarray, Topplings: np.ndarray,
+              ExtentX: np.ndarray, ExtentY: np.ndarray, GyrationRadius: np.ndarray, MaxHeight: np.ndarray):
+    """
+    `run_block` for a batch of independent replicas, in parallel.
+
+    Every array has an extra first axis over the replicas. Each replica's random
+    generator is seeded with its entry of `seeds`, so that the results do not
+    depend on how replicas are scheduled on threads.
+
+    :param seeds: seed for every replica
+    :type seeds: np.ndarray
+    """
+    for k in numba.prange(values.shape[0]):
+        np.random.seed(seeds[k])
+        run_block(values[k], visited[k], critical_value, boundary_size,
+                  current[k], upcoming[k], queued[k], touched[k],
+                  AvalancheSize[k], number_of_iterations[k], Topplings[k],
+                  ExtentX[k], ExtentY[k], GyrationRadius[k], MaxHeight[k])
+
+
+@numba.njit
+def _relax_tile(values: np.ndarray, visited: np.ndarray, critical_value: int, boundary_size: int,
+                tile_size: int, active: np.ndarray, queued: np.ndarray, tx: int, ty: int, mode: int):
+    """
+    Topple tile (`tx`, `ty`) until all its sites are stable, sending grains to the
+    edges of the neighbouring tiles (and marking them active) or to the boundary.
+
+    An unstable site with h grains topples h // 4 times at once; since the model is
+    abelian, this gives the same final state and topplings as toppling wave by wave.
+
+    :return: number of topplings and the largest height of a toppling site
+    """
+    width, height = values.shape
+    x0, x1, y0, y1 = common.tiles.tile_bounds(tx, ty, tile_size, boundary_size, width, height)
+    stack = np.empty((x1 - x0) * (y1 - y0), dtype=np.int64)
+    n = common.tiles.unstable_sites(values, critical_value, queued, stack, x0, x1, y0, y1, mode)
+    topplings = 0
+    max_height = 0
+    while n > 0:
+        n -= 1
+        x, y = divmod(stack[n], height)
+        queued[x, y] = False
+        k = values[x, y] // (critical_value + 1)
+        topplings += k
+        max_height = max(max_height, values[x, y])
+        values[x, y] -= k * (critical_value + 1)
+        for xn, yn in ((x - 1, y), (x, y - 1), (x + 1, y), (x, y + 1)):
+            values[xn, yn] += k
+            visited[xn, yn] = True
+            if x0 <= xn < x1 and y0 <= yn < y1:
+                if values[xn, yn] > critical_value and not queued[xn, yn]:
+                    queued[xn, yn] = True
+                    stack[n] = xn * height + yn
+                    n += 1
+            else:
+                common.tiles.activate_site(active, xn, yn, tile_size, boundary_size, width, height)
+    return topplings, max_height
+
+
+@numba.njit(parallel=True)
+def topple_tiled(values: np.ndarray, visited: np.ndarray, critical_value: int, boundary_size: int,
+                 seeds: np.ndarray, tile_size: int, active: np.ndarray, queued: np.ndarray):
+    """
+    Distribute material from overloaded sites to neighbors, relaxing tiles of the lattice in parallel.
+
+    In every round, the active tiles of each of the four checkerboard colours (see
+    `common.tiles.tile_index`) are relaxed concurrently; grains crossing into a neighbouring
+    tile activate it for the following colours or rounds. Gives exactly the same `values`
+    and `visited` as `topple`.
+
+    :param values: data array of the simulation
+    :type values: np.ndarray
+    :param visited: boolean array, needs to be cleaned beforehand
+    :type visited: np.ndarray
+    :param critical_value: nodes topple above this value
+    :type critical_value: int
+    :param boundary_size: size of boundary for the array
+    :type boundary_size: int
+    :param seeds: Nx2 array of the only possibly unstable sites
+    :type seeds: np.ndarray
+    :param tile_size: linear size of the tiles
+    :type tile_size: int
+    :param active: flags of the tiles, see `common.tiles.tile_grid`; left all zero
+    :type active: np.ndarray
+    :param queued: scratch boolean array, all False; left all False
+    :type queued: np.ndarray
+    :return: number of rounds (not comparable with the number of waves of `topple`), number of
+        topplings and the largest height of a toppling site - which toppled as many times as it
+        could at once, so the height is not comparable with that of `topple` either
+    :rtype: tuple
+    """
+    common.tiles.activate_seeds(active, seeds, tile_size, boundary_size)
+    rounds = 0
+    topplings = 0
+    max_height = 0
+    while active.any():
+        rounds += 1
+        for color in range(4):
+            for t in numba.prange(common.tiles.tiles_of_color(color, active)):
+                tx, ty = common.tiles.tile_index(t, color, active)
+                mode = active[tx, ty]
+                if mode:
+                    active[tx, ty] = 0
+                    n, height = _relax_tile(values, visited, critical_value, boundary_size, tile_size,
+                                            active, queued, tx, ty, mode)
+                    topplings += n
+                    max_height = max(max_height, height)
+    return rounds, topplings, max_height
+
+
+def stabilize(values: np.ndarray, critical_value: int, boundary_size: int, min_size: int = 16) -> np.ndarray:
+    """
+    Stabilize `values` in place, returning the odometer: how many times every site topples.
+
+    The final configuration is `values + Laplacian(odometer)`, and by the least action principle
+    the odometer is the smallest non-negative integer function that makes it stable. It is found
+    exactly, in a number of steps that does not grow with the number of grains, by:
+
+    1. guessing it from the odometer of a twice coarser lattice (holding a quarter of the
+       grains of each 2x2 block, so the same density), solving `Laplacian(guess) = final - values`
+       with the coarse final heights standing in for the unknown fine ones (`_odometer`);
+    2. toppling every unstable site in bulk until the configuration is stable; the odometer
+       is now an upper bound (`_topple_bulk`);
+    3. while the toppled sites hold a forbidden subconfiguration, untoppling it once - which
+       keeps the configuration stable, so the odometer is still an upper bound - and once there is
+       none left, the odometer is the smallest one (`_forbidden_subconfiguration`).
+
+    :param values: data array of the simulation
+    :type values: np.ndarray
+    :param critical_value: nodes topple above this value; toppling sends one grain to each of the
+        four neighbours, so this should be 3 for the number of grains to be conserved
+    :type critical_value: int
+    :param boundary_size: size of boundary for the array
+    :type boundary_size: int
+    :param min_size: lattices up to this size are toppled from scratch, without a coarser guess
+    :type min_size: int
+    :return: the odometer, of the same shape as `values` (zero on the boundary)
+    :rtype: np.ndarray
+    """
+    # keep one layer of the boundary as the sink
+    window = (slice(boundary_size - 1, values.shape[0] - boundary_size + 1),
+              slice(boundary_size - 1, values.shape[1] - boundary_size + 1))
+    sandpile = np.zeros(values[window].shape, dtype=np.int64)
+    sandpile[1:-1, 1:-1] = values[window][1:-1, 1:-1]
+    _, inner_odometer = _odometer(sandpile, critical_value, min_size)
+    odometer = np.zeros(values.shape, dtype=np.int64)
+    odometer[window] = inner_odometer
+    values[...] += _laplacian(odometer).astype(values.dtype)
+    return odometer
+
+
+def _laplacian(odometer: np.ndarray) -> np.ndarray:
+    padded = np.pad(odometer, 1)
+    return padded[:-2, 1:-1] + padded[2:, 1:-1] + padded[1:-1, :-2] + padded[1:-1, 2:] - 4 * odometer
+
+
+def _odometer(sandpile: np.ndarray, critical_value: int, min_size: int):
+    """
+    Exact odometer of `sandpile`, an int64 array whose outer layer is the sink.
+
+    :return: final heights, odometer
+    """
+    L = sandpile.shape[0] - 2
+    odometer = np.zeros(sandpile.shape, dtype=np.int64)
+    if L > min_size:
+        L_coarse = (L + 1) // 2
+        blocks = np.zeros((2 * L_coarse, 2 * L_coarse), dtype=np.int64)
+        blocks[:L, :L] = sandpile[1:-1, 1:-1]
+        coarse = np.zeros((L_coarse + 2, L_coarse + 2), dtype=np.int64)
+        coarse[1:-1, 1:-1] = blocks.reshape(L_coarse, 2, L_coarse, 2).sum(axis=(1, 3)) // 4
+        coarse_heights, coarse_odometer = _odometer(coarse, critical_value, min_size)
+
+        def refine(array):
+            return np.repeat(np.repeat(array[1:-1, 1:-1], 2, axis=0), 2, axis=1)[:L, :L]
+
+        initial = sandpile[1:-1, 1:-1].astype(float)
+        final = np.where(refine(coarse_odometer) > 0, refine(coarse_heights), initial)
+        odometer[1:-1, 1:-1] = np.floor(np.maximum(_solve_poisson(final - initial), 0))
+
+    heights = _heights(sandpile, odometer)
+    stack = np.empty(sandpile.size, dtype=np.int64)
+    queued = np.zeros(sandpile.shape, dtype=bool)
+    _topple_bulk(heights, odometer, critical_value, stack, queued)
+    forbidden = np.zeros(sandpile.shape, dtype=bool)
+    degree = np.zeros(sandpile.shape, dtype=np.int64)
+    while _forbidden_subconfiguration(heights, odometer, critical_value, forbidden, degree, stack):
+        _untopple(heights, odometer, forbidden)
+    return heights, odometer
+
+
+def _dst(array: np.ndarray, axis: int) -> np.ndarray:
+    """
+    Type-I discrete sine transform along `axis`, through the FFT of the odd extension.
+    Applying it twice multiplies by (n + 1) / 2.
+    """
+    array = np.moveaxis(array, axis, -1)
+    n = array.shape[-1]
+    zeros = np.zeros(array.shape[:-1] + (1,))
+    extended = np.concatenate([zeros, array, zeros, -array[..., ::-1]], axis=-1)
+    transform = -np.fft.rfft(extended, axis=-1).imag[..., 1:n + 1] / 2
+    return np.moveaxis(transform, -1, axis)
+
+
+def _solve_poisson(source: np.ndarray) -> np.ndarray:
+    """
+    Solve `Laplacian(solution) = source` on a rectangle, the solution vanishing outside it.
+    """
+    n, m = source.shape
+    transform = _dst(_dst(source, 0), 1)
+    eigenvalues_x = 2 * np.cos(np.pi * np.arange(1, n + 1) / (n + 1)) - 2
+    eigenvalues_y = 2 * np.cos(np.pi * np.arange(1, m + 1) / (m + 1)) - 2
+    transform /= eigenvalues_x[:, None] + eigenvalues_y[None, :]
+    return _dst(_dst(transform, 0), 1) * (4 / ((n + 1) * (m + 1)))
+
+
+@numba.njit
+def _heights(sandpile: np.ndarray, odometer: np.ndarray) -> np.ndarray:
+    """
+    Heights after toppling every site of `sandpile` `odometer` times; the sink is left untouched.
+    """
+    heights = sandpile.copy()
+    n, m = sandpile.shape
+    for x in range(1, n - 1):
+        for y in range(1, m - 1):
+            heights[x, y] += (odometer[x - 1, y] + odometer[x + 1, y] + odometer[x, y - 1]
+                              + odometer[x, y + 1] - 4 * odometer[x, y])
+    return heights
+
+
+@numba.njit
+def _topple_bulk(heights: np.ndarray, odometer: np.ndarray, critical_value: int,
+                 stack: np.ndarray, queued: np.ndarray) -> int:
+    """
+    Topple unstable sites, each as many times in a row as it takes to become stable,
+    until all are stable, counting the topplings in `odometer`.
+
+    :param stack: scratch array of the size of `heights`
+    :param queued: scratch boolean array, all False; left all False
+    :return: number of bulk topplings
+    """
+    n, m = heights.shape
+    k = 0
+    for x in range(1, n - 1):
+        for y in range(1, m - 1):
+            if heights[x, y] > critical_value:
+                queued[x, y] = True
+                stack[k] = x * m + y
+                k += 1
+    number_of_topplings = 0
+    while k > 0:
+        k -= 1
+        x, y = divmod(stack[k], m)
+        queued[x, y] = False
+        topplings = heights[x, y] // (critical_value + 1)
+        number_of_topplings += 1
+        odometer[x, y] += topplings
+        heights[x, y] -= 4 * topplings
+        for xn, yn in ((x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)):
+            if 0 < xn < n - 1 and 0 < yn < m - 1:
+                heights[xn, yn] += topplings
+                if heights[xn, yn] > critical_value and not queued[xn, yn]:
+                    queued[xn, yn] = True
+                    stack[k] = xn * m + yn
+                    k += 1
+    return number_of_topplings
+
+
+@numba.njit
+def _forbidden_subconfiguration(heights: np.ndarray, odometer: np.ndarray, critical_value: int,
+                                forbidden: np.ndarray, degree: np.ndarray, stack: np.ndarray) -> int:
+    """
+    Find the largest set of toppled sites (`forbidden`) where every site would stay stable
+    if all of them untoppled once: each one holds at most `critical_value - 4` grains more
+    than it has neighbours in the set. Found by burning away the sites that do not qualify.
+
+    If the configuration is stable and no such set exists, `odometer` is the true one.
+
+    :param forbidden: output boolean array
+    :param degree: scratch array of the size of `heights`
+    :param stack: scratch array of the size of `heights`
+    :return: number of sites in the set
+    """
+    n, m = heights.shape
+    for x in range(n):
+        for y in range(m):
+            forbidden[x, y] = odometer[x, y] > 0 and 0 < x < n - 1 and 0 < y < m - 1
+    k = 0
+    for x in range(1, n - 1):
+        for y in range(1, m - 1):
+            if forbidden[x, y]:
+                degree[x, y] = forbidden[x - 1, y] + forbidden[x + 1, y] + forbidden[x, y - 1] + forbidden[x, y + 1]
+    for x in range(1, n - 1):
+        for y in range(1, m - 1):
+            if forbidden[x, y] and heights[x, y] > critical_value - 4 + degree[x, y]:
+                forbidden[x, y] = False
+                stack[k] = x * m + y
+                k += 1
+    while k > 0:
+        k -= 1
+        x, y = divmod(stack[k], m)
+        for xn, yn in ((x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)):
+            if forbidden[xn, yn]:
+                degree[xn, yn] -= 1
+                if heights[xn, yn] > critical_value - 4 + degree[xn, yn]:
+                    forbidden[xn, yn] = False
+                    stack[k] = xn * m + yn
+                    k += 1
+    size = 0
+    for x in range(1, n - 1):
+        for y in range(1, m - 1):
+            size += forbidden[x, y]
+    return size
+
+
+@numba.njit
+def _untopple(heights: np.ndarray, odometer: np.ndarray, forbidden: np.ndarray):
+    """
+    Undo one toppling of every site in `forbidden`.
+    """
+    n, m = heights.shape
+    for x in range(1, n - 1):
+        for y in range(1, m - 1):
+            if forbidden[x, y]:
+                odometer[x, y] -= 1
+                heights[x, y] += 4
+                heights[x - 1, y] -= 1
+                heights[x + 1, y] -= 1
+                heights[x, y - 1] -= 1
+                heights[x, y + 1] -= 1
@@ -17,25 +17,110 @@ class Forest(common.Simulation):
     :param f: probability of thunder setting a tree on fire; set 0 to disable lighting
     :param p: probability of a new tree growh per empty cell
     :type p: float
+    :param engine: "lattice" by default - sweeps the whole lattice every step (`burn_trees`);
+        "front" keeps the list of burning cells and advances it in one compiled pass (`step_front`),
+        so the cost of a step depends on the fire front rather than the lattice area.
+        With "front", call `build_front` after modifying `values` by hand.
+        "cluster" is the event-driven Drossel-Schwabl limit: `drive` grows on average p/f trees,
+        then `topple_dissipate` strikes one random site and burns its whole tree cluster at once
+        (`burn_cluster`). Clusters are tracked with union-find, so the fire size is recorded as
+        `AvalancheSize` and the burning time (in rings of neighbours) as `number_of_iterations`.
+        With "cluster", call `build_clusters` after modifying `values` by hand.
+        Compiled runs (`run(..., compiled=True)`) need "front" or "cluster".
+    :type engine: str
     """
 
-    def __init__(self, p: float=0.05, f: float = 0, *args, **kwargs):
+    ENGINES = ("lattice", "front", "cluster")
+    CHECKPOINT_ARRAYS = common.Simulation.CHECKPOINT_ARRAYS + ("new_values", "_front", "_parent", "_cluster_size")
+    CHECKPOINT_ATTRIBUTES = ("_n_front",)
+
+    def __init__(self, p: float=0.05, f: float = 0, *args, engine: str = "lattice", **kwargs):
         super().__init__(*args, **kwargs)
+        if engine not in self.ENGINES:
+            raise ValueError(f"engine must be one of {self.ENGINES}, got {engine!r}")
+        self.engine = engine
+        self._track_footprint(False)
         shape = (self.L_with_boundary, self.L_with_boundary)
         self.values = common.clean_boundary_inplace(np.random.choice([_ash, _tree, _burning], shape, p=[0.99, 0.01, 0]), self.BC)
         self.new_values = np.zeros_like(self.values)
         self.p = p
         self.f = f
+        if engine in ("front", "cluster"):
+            self._front = np.empty(self.size, dtype=np.int64)
+            self._new_front = np.empty(self.size, dtype=np.int64)
+        if engine == "front":
+            self.build_front()
+        if engine == "cluster":
+            if not f > 0:
+                raise ValueError("The cluster engine needs a nonzero lightning probability f")
+            self._parent = np.empty(self.L_with_boundary**2, dtype=np.int64)
+            self._cluster_size = np.empty(self.L_with_boundary**2, dtype=np.int64)
+            self.build_clusters()
+
+    @property
+    def params(self) -> dict:
+        return dict(super().params, p=self.p, f=self.f, engine=self.engine)
+
+    @property
+    def snapshot_dtype(self) -> np.dtype:
+        """
+        Sites only ever hold ash, a tree or fire.
+        """
+        return np.dtype(np.uint8)
+
+    def build_clusters(self):
+        """
+        (Re)build the union-find forest of tree clusters used by the "cluster" engine.
+        """
+        build_clusters(self.values, self._parent, self._cluster_size)
+
+    def cluster_sizes(self) -> np.ndarray:
+        """
+        Sizes of all the tree clusters currently on the lattice ("cluster" engine only).
+
+        :rtype: np.ndarray
+        """
+        flat = self.values.reshape(-1)
+        roots = (self._parent == np.arange(self._parent.size)) & (flat == _tree)
+        return self._cluster_size[roots]
+
+    def build_front(self):
+        """
+        (Re)build the list of burning cells used by the "front" engine.
+        """
+        burning = np.flatnonzero(self.clean_boundary_inplace(self.values == _burning))
+        self._n_front = burning.size
+        self._front[:self._n_front] = burning
+
+    def build_engine(self):
+        if self.engine == "front":
+            self.build_front()
+        elif self.engine == "cluster":
+            self.build_clusters()
 
     def drive(self):
         """
         Does nothing in FF!
+
+        With the "cluster" engine, grows trees at random sites: the number of attempts
+        before the next lightning strike is geometric with mean p/f.
         """
+        if self.engine == "cluster":
+            attempts = np.random.geometric(self.f / (self.p + self.f)) - 1
+            grow_trees(self.values, self._parent, self._cluster_size, attempts, self.BC)
 
     def topple_dissipate(self)->int:
         """
         Forest burning and turning into ash. 
         """
+        if self.engine == "cluster":
+            return burn_cluster(self.values, self.visited, self._parent, self._cluster_size,
+                                self._front, self.BC)[0]
+        if self.engine == "front":
+            n_burning = step_front(self.values, self._front, self._n_front, self._new_front, self.p, self.f, self.BC)
+            self._front, self._new_front = self._new_front, self._front
+            self._n_front = n_burning
+            return n_burning
          
         #Displacement from a cell to its nearest neighbours
 
@@ -59,6 +144,20 @@ class Forest(common.Simulation):
         number_burning = (self.inside(self.values) == _burning).sum()
         return number_burning
 
+    def _run_compiled(self, n_iterations: int) -> dict:
+        AvalancheSize = np.zeros(n_iterations, dtype=np.int64)
+        number_of_iterations = np.empty(n_iterations, dtype=np.int64)
+        if self.engine == "cluster":
+            run_block_cluster(self.values, self.visited, self._parent, self._cluster_size, self._front,
+                              self.p, self.f, self.BC, AvalancheSize, number_of_iterations)
+        elif self.engine == "front":
+            # the front engine never marks `visited`, so AvalancheSize stays 0 as in `AvalancheLoop`
+            self._n_front = run_block_front(self.values, self._front, self._n_front, self._new_front,
+                                            self.p, self.f, self.BC, number_of_iterations)
+        else:
+            raise ValueError("Compiled runs need engine='front' or engine='cluster'")
+        return dict(AvalancheSize=AvalancheSize, number_of_iterations=number_of_iterations)
+
 _neighbours = ((-1,-1), (-1,0), (-1,1), (0,-1), (0, 1), (1,-1), (1,0), (1,1))
 @numba.njit
 def burn_trees(new_values: np.ndarray, values: np.ndarray, f: float, BC: int):
@@ -80,3 +179,227 @@ def burn_trees(new_values: np.ndarray, values: np.ndarray, f: float, BC: int):
                         if values[ix+dx, iy+dy] == _burning:
                             new_values[ix,iy] = _burning
                             break
+
+
+@numba.njit
+def _skip(probability: float) -> int:
+    """
+    Number of cells to skip until the next success of independent Bernoulli(`probability`) trials.
+    """
+    if probability >= 1:
+        return 0
+    if probability <= 0:
+        return -1
+    return int(np.log(1 - np.random.random()) / np.log1p(-probability))
+
+
+@numba.njit
+def step_front(values: np.ndarray, front: np.ndarray, n_front: int, new_front: np.ndarray,
+               p: float, f: float, BC: int) -> int:
+    """
+    One fused, in-place step of the forest fire, driven by the list of burning cells.
+
+    Fire spreads from `front` to neighbouring trees, lightning strikes and tree growth
+    are sampled by skipping geometrically distributed runs of cells, and the old front
+    turns into ash. Statistically equivalent to one `Forest.topple_dissipate` step of
+    the "lattice" engine.
+
+    :param values: Array of current values, updated in place.
+    :param front: flat indices of the burning cells
+    :param n_front: number of burning cells in `front`
+    :param new_front: output buffer for the flat indices of the cells burning after the step
+    :param p: probability of a new tree growth per empty cell
+    :param f: probability of thunder strike
+    :param BC: size of boundary
+    :return: number of burning cells after the step
+    """
+    height = values.shape[1]
+    flat = values.reshape(values.size)
+    N = 0
+    # T -> B next to the fire
+    for i in range(n_front):
+        ix, iy = front[i] // height, front[i] % height
+        for dx, dy in _neighbours:
+            site = (ix + dx) * height + iy + dy
+            if flat[site] == _tree:
+                flat[site] = _burning
+                new_front[N] = site
+                N += 1
+
+    inner = height - 2 * BC
+    size = (values.shape[0] - 2 * BC) * inner
+    # T -> B by lightning
+    skip = _skip(f)
+    k = skip
+    while 0 <= k < size:
+        site = (k // inner + BC) * height + k % inner + BC
+        if flat[site] == _tree:
+            flat[site] = _burning
+            new_front[N] = site
+            N += 1
+        k += 1 + _skip(f)
+
+    # A -> T
+    k = _skip(p)
+    while 0 <= k < size:
+        site = (k // inner + BC) * height + k % inner + BC
+        if flat[site] == _ash:
+            flat[site] = _tree
+        k += 1 + _skip(p)
+
+    # B -> A
+    for i in range(n_front):
+        flat[front[i]] = _ash
+    return N
+
+
+@numba.njit
+def _find(parent: np.ndarray, site: int) -> int:
+    while parent[site] != site:
+        parent[site] = parent[parent[site]]
+        site = parent[site]
+    return site
+
+
+@numba.njit
+def _union(parent: np.ndarray, cluster_size: np.ndarray, a: int, b: int):
+    a = _find(parent, a)
+    b = _find(parent, b)
+    if a == b:
+        return
+    if cluster_size[a] < cluster_size[b]:
+        a, b = b, a
+    parent[b] = a
+    cluster_size[a] += cluster_size[b]
+
+
+@numba.njit
+def build_clusters(values: np.ndarray, parent: np.ndarray, cluster_size: np.ndarray):
+    """
+    Label the tree clusters (connected through `_neighbours`) with union-find.
+
+    :param values: Array of current values.
+    :param parent: output union-find parent of every (flat) site
+    :param cluster_size: output cluster size, valid at the roots
+    """
+    width, height = values.shape
+    for site in range(values.size):
+        parent[site] = site
+        cluster_size[site] = 1
+    for ix in range(1, width - 1):
+        for iy in range(1, height - 1):
+            if values[ix, iy] == _tree:
+                for dx, dy in ((-1, -1), (-1, 0), (-1, 1), (0, -1)):
+                    if values[ix + dx, iy + dy] == _tree:
+                        _union(parent, cluster_size, ix * height + iy, (ix + dx) * height + iy + dy)
+
+
+@numba.njit
+def grow_trees(values: np.ndarray, parent: np.ndarray, cluster_size: np.ndarray, attempts: int, BC: int):
+    """
+    Try to grow a tree at `attempts` random sites, joining it to the neighbouring clusters.
+
+    :param values: Array of current values.
+    :param parent: union-find parents, from `build_clusters`
+    :param cluster_size: union-find cluster sizes, from `build_clusters`
+    :param attempts: number of random sites
+    :param BC: size of boundary
+    """
+    width, height = values.shape
+    for i in range(attempts):
+        ix = np.random.randint(BC, width - BC)
+        iy = np.random.randint(BC, height - BC)
+        if values[ix, iy] == _ash:
+            values[ix, iy] = _tree
+            for dx, dy in _neighbours:
+                if values[ix + dx, iy + dy] == _tree:
+                    _union(parent, cluster_size, ix * height + iy, (ix + dx) * height + iy + dy)
+
+
+@numba.njit
+def burn_cluster(values: np.ndarray, visited: np.ndarray, parent: np.ndarray, cluster_size: np.ndarray,
+                 queue: np.ndarray, BC: int) -> int:
+    """
+    Strike a random site with lightning and, if it holds a tree, burn its whole cluster at once.
+
+    Burnt sites are marked in `visited` and removed from the union-find forest.
+
+    :param values: Array of current values.
+    :param visited: boolean array, needs to be cleaned beforehand
+    :param parent: union-find parents, from `build_clusters`
+    :param cluster_size: union-find cluster sizes, from `build_clusters`
+    :param queue: scratch buffer, at least as long as the largest cluster
+    :param BC: size of boundary
+    :return: number of steps the fire would take to spread through the cluster (0 if nothing burnt),
+        and the number of burnt trees
+    """
+    width, height = values.shape
+    ix = np.random.randint(BC, width - BC)
+    iy = np.random.randint(BC, height - BC)
+    if values[ix, iy] != _tree:
+        return 0, 0
+
+    values[ix, iy] = _ash
+    queue[0] = ix * height + iy
+    start, stop = 0, 1
+    number_of_iterations = 0
+    while start < stop:
+        number_of_iterations += 1
+        end_of_ring = stop
+        for i in range(start, end_of_ring):
+            site = queue[i]
+            ix, iy = site // height, site % height
+            visited[ix, iy] = True
+            parent[site] = site
+            cluster_size[site] = 1
+            for dx, dy in _neighbours:
+                if values[ix + dx, iy + dy] == _tree:
+                    values[ix + dx, iy + dy] = _ash
+                    queue[stop] = (ix + dx) * height + iy + dy
+                    stop += 1
+        start = end_of_ring
+    return number_of_iterations, stop
+
+
+@numba.njit
+def run_block_front(values: np.ndarray, front: np.ndarray, n_front: int, new_front: np.ndarray,
+                    p: float, f: float, BC: int, number_of_iterations: np.ndarray) -> int:
+    """
+    Compiled equivalent of repeated `Forest.AvalancheLoop` calls with the "front" engine.
+
+    Runs as many steps as `number_of_iterations` is long, writing the number of burning
+    cells after each. The remaining parameters are as in `step_front`.
+
+    :param number_of_iterations: output column
+    :return: number of burning cells, whose indices are left in `front`
+    """
+    for i in range(number_of_iterations.shape[0]):
+        n_front = step_front(values, front, n_front, new_front, p, f, BC)
+        front, new_front = new_front, front
+        number_of_iterations[i] = n_front
+    if number_of_iterations.shape[0] % 2 == 1:
+        new_front[:n_front] = front[:n_front]
+    return n_front
+
+
+@numba.njit
+def run_block_cluster(values: np.ndarray, visited: np.ndarray, parent: np.ndarray, cluster_size: np.ndarray,
+                      queue: np.ndarray, p: float, f: float, BC: int,
+                      AvalancheSize: np.ndarray, number_of_iterations: np.ndarray):
+    """
+    Compiled equivalent of repeated `Forest.drive` and `Forest.AvalancheLoop` calls with the "cluster" engine.
+
+    Runs as many iterations as `AvalancheSize` is long, writing the fire size and
+    burning time of each. The remaining parameters are as in `burn_cluster`.
+
+    :param AvalancheSize: output column
+    :param number_of_iterations: output column
+    """
+    height = values.shape[1]
+    burnt = 0
+    for i in range(AvalancheSize.shape[0]):
+        grow_trees(values, parent, cluster_size, np.random.geometric(f / (p + f)) - 1, BC)
+        for j in range(burnt):
+            visited[queue[j] // height, queue[j] % height] = False
+        number_of_iterations[i], burnt = burn_cluster(values, visited, parent, cluster_size, queue, BC)
+        AvalancheSize[i] = burnt
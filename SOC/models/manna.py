@@ -4,11 +4,21 @@ from SOC import common
 import numpy as np
 import numba
 import random
+import time
 
 class Manna(common.Simulation):
     """Implements the Manna model."""
     
-    def __init__(self, critical_value: int = 1, abelian: bool = True, *args, **kwargs):
+    ENGINES = ("wave", "frontier", "tiled")
+    GEOMETRY = True
+    TILE_SIZE = 64
+    RANDOM_ARRAYS = ("_random_bits", "_random_state")
+    BATCH_ARRAYS = ("values", "visited", "_touched", "_current", "_upcoming", "_queued",
+                    "_random_bits", "_random_state")
+    CHECKPOINT_ATTRIBUTES = ("topplings", "toppling_time")
+
+    def __init__(self, critical_value: int = 1, abelian: bool = True, *args, engine: str = "wave",
+                 tile_size: int = TILE_SIZE, **kwargs):
         """
         :param L: linear size of lattice, without boundary layers
         :type L: int
@@ -16,11 +26,58 @@ class Manna(common.Simulation):
         :type critical_value: int
         :param abelian: True by default - abelian, False - nonabelian
         :type abelian: bool
+        :param engine: "wave" by default - rescans the lattice on every wave (`topple_dissipate`);
+            "frontier" only tracks active sites and draws directions from a buffer of
+            random bits (`topple_dissipate_frontier`); "tiled" relaxes tiles of `tile_size`
+            sites on all cores (`topple_tiled`), for huge abelian lattices. All are statistically
+            equivalent. Compiled runs (`run(..., compiled=True)`) need "frontier".
+        :type engine: str
+        :param tile_size: linear size of the tiles of the "tiled" engine; `TILE_SIZE` by default
+        :type tile_size: int
         """
         super().__init__(*args, **kwargs)
+        if engine not in self.ENGINES:
+            raise ValueError(f"engine must be one of {self.ENGINES}, got {engine!r}")
+        self.engine = engine
+        self.tile_size = tile_size
         self.values = np.zeros((self.L_with_boundary, self.L_with_boundary), dtype=int)
         self.critical_value = critical_value
         self.abelian = abelian
+        self.topplings = 0
+        self.toppling_time = 0.
+        if engine == "frontier":
+            self._current = np.empty(self.L_with_boundary**2, dtype=np.int64)
+            self._upcoming = np.empty(self.L_with_boundary**2, dtype=np.int64)
+            self._queued = np.zeros((self.L_with_boundary, self.L_with_boundary), dtype=bool)
+            self._random_bits = np.empty(RANDOM_BUFFER_SIZE, dtype=np.int64)
+            self._random_state = np.array([RANDOM_BUFFER_SIZE, 0], dtype=np.int64)
+        self._track_footprint(engine == "frontier")
+        if engine == "tiled":
+            if not abelian:
+                raise ValueError("The tiled engine needs the abelian model")
+            self._queued = np.zeros((self.L_with_boundary, self.L_with_boundary), dtype=bool)
+            self._active = common.tiles.tile_grid(self.L, self.tile_size)
+
+    @property
+    def params(self) -> dict:
+        params = dict(super().params, critical_value=self.critical_value, abelian=self.abelian, engine=self.engine)
+        if self.tile_size != self.TILE_SIZE:
+            params['tile_size'] = self.tile_size
+        return params
+
+    @property
+    def snapshot_dtype(self) -> np.dtype:
+        """
+        Stable heights never exceed the critical value.
+        """
+        return np.min_scalar_type(self.critical_value)
+
+    @property
+    def drive_threshold(self) -> int:
+        """
+        `drive` adds one grain to a random site, which topples above `critical_value`.
+        """
+        return self.critical_value
 
     def drive(self, num_particles: int = 1):
         """
@@ -32,19 +89,83 @@ class Manna(common.Simulation):
         location = np.random.randint(self.BOUNDARY_SIZE, self.L_with_boundary-1, size = (num_particles, 2))
         for x, y in location:
             self.values[x, y] += 1
+        self._driven_sites = location
 
     def topple_dissipate(self) -> int:
         """
         Distribute material from overloaded sites to neighbors.
 
-        Convenience wrapper for the numba.njitted `topple_dissipate` function defined in `manna.py`.
+        Convenience wrapper for the numba.njitted `topple_dissipate` (or
+        `topple_dissipate_frontier`) function defined in `manna.py`. The number
+        of topplings and the largest height are kept in `_avalanche`.
 
         :return: number of iterations it took to
         :rtype: bool
         """
-        return topple_dissipate(self.values, self.visited, self.critical_value, self.abelian, self.BOUNDARY_SIZE)
+        if self.engine == "tiled":
+            start = time.perf_counter()
+            number_of_iterations, *self._avalanche = topple_tiled(
+                self.values, self.visited, self.critical_value, self.BOUNDARY_SIZE,
+                self._pop_seeds(self.critical_value), self.tile_size, self._active, self._queued)
+            self.toppling_time += time.perf_counter() - start
+            self.topplings += self._avalanche[0]
+            return number_of_iterations
+        if self.engine == "frontier":
+            start = time.perf_counter()
+            number_of_iterations, *self._avalanche = topple_dissipate_frontier(
+                self.values, self.visited, self.critical_value, self.abelian, self.BOUNDARY_SIZE,
+                self._pop_seeds(self.critical_value),
+                self._current, self._upcoming, self._queued,
+                self._random_bits, self._random_state, self._touched)
+            self.toppling_time += time.perf_counter() - start
+            self.topplings += self._avalanche[0]
+            return number_of_iterations
+        number_of_iterations, *self._avalanche = topple_dissipate(self.values, self.visited, self.critical_value,
+                                                                  self.abelian, self.BOUNDARY_SIZE)
+        return number_of_iterations
+
+    def _run_compiled(self, n_iterations: int) -> dict:
+        if self.engine != "frontier":
+            raise ValueError("Compiled runs need engine='frontier'")
+        AvalancheSize = np.empty(n_iterations, dtype=np.int64)
+        number_of_iterations = np.empty(n_iterations, dtype=np.int64)
+        geometry = self._geometry_columns(n_iterations)
+        start = time.perf_counter()
+        self.topplings += run_block(self.values, self.visited, self.critical_value, self.abelian, self.BOUNDARY_SIZE,
+                                    self._current, self._upcoming, self._queued,
+                                    self._random_bits, self._random_state, self._touched,
+                                    AvalancheSize, number_of_iterations, *geometry.values())
+        self.toppling_time += time.perf_counter() - start
+        return dict(AvalancheSize=AvalancheSize, number_of_iterations=number_of_iterations, **geometry)
+
+    def _run_batch(self, replicas: list, arrays: dict, seeds: np.ndarray, n_iterations: int) -> dict:
+        if self.engine != "frontier":
+            raise ValueError("Batched runs need engine='frontier'")
+        AvalancheSize = np.empty((seeds.size, n_iterations), dtype=np.int64)
+        number_of_iterations = np.empty((seeds.size, n_iterations), dtype=np.int64)
+        geometry = self._geometry_columns((seeds.size, n_iterations))
+        topplings = np.empty(seeds.size, dtype=np.int64)
+        run_batch(arrays['values'], arrays['visited'], self.critical_value, self.abelian, self.BOUNDARY_SIZE,
+                  arrays['_current'], arrays['_upcoming'], arrays['_queued'],
+                  arrays['_random_bits'], arrays['_random_state'], arrays['_touched'], seeds,
+                  AvalancheSize, number_of_iterations, *geometry.values(), topplings)
+        for replica, n in zip(replicas, topplings):
+            replica.topplings += int(n)
+        return dict(AvalancheSize=AvalancheSize, number_of_iterations=number_of_iterations, **geometry)
+
+    @property
+    def topplings_per_second(self) -> float:
+        """
+        Throughput of the "frontier" engine so far: topplings divided by the time spent toppling.
+
+        :rtype: float
+        """
+        if self.toppling_time == 0:
+            return float("nan")
+        return self.topplings / self.toppling_time
 
 _DEBUG = True
+RANDOM_BUFFER_SIZE = 4096
 
 @numba.njit
 def topple_dissipate(values: np.ndarray, visited: np.ndarray, critical_value: int, abelian: bool, boundary_size: int) -> int:
@@ -64,11 +185,14 @@ def topple_dissipate(values: np.ndarray, visited: np.ndarray, critical_value: in
     :type abelian: bool
     :param boundary_size: size of boundary for the array
     :type boundary_size: int
-    :return: Number of steps it took stuff to topple
-    :rtype: int
+    :return: Number of steps it took stuff to topple, number of topplings
+        and the largest height of a toppling site at the start of its step
+    :rtype: tuple
     """
 
     number_of_topple_iterations = 0
+    topplings = 0
+    max_height = 0
     # find a boolean array of active (overloaded) sites
     active_sites = common.clean_boundary_inplace(values > critical_value, boundary_size)   # TODO speedup?
     # odrzucam 
@@ -77,6 +201,9 @@ def topple_dissipate(values: np.ndarray, visited: np.ndarray, critical_value: in
         indices = np.vstack(np.where(active_sites)).T   # TODO speedup?
         # a Nx2 array of integer indices for overloaded sites
         N = indices.shape[0]
+        topplings += N
+        for i in range(N):
+            max_height = max(max_height, values[indices[i, 0], indices[i, 1]])
 
         for i in range(N):
             x, y = index = indices[i]
@@ -108,5 +235,290 @@ def topple_dissipate(values: np.ndarray, visited: np.ndarray, critical_value: in
         active_sites = common.clean_boundary_inplace(values > critical_value, boundary_size)
     # dissipate would be here, after the while loop
     # but it's not necessary so we skip it
-    return number_of_topple_iterations
+    return number_of_topple_iterations, topplings, max_height
+
+
+
+@numba.njit
+def _random_direction(random_bits: np.ndarray, random_state: np.ndarray) -> int:
+    """
+    Take two random bits (one of the four diagonal directions) from the buffer.
+
+    Each 62-bit word of `random_bits` holds 31 directions; the whole buffer is
+    refilled in place once all of them are used up.
+
+    :param random_bits: buffer of random int64 words
+    :type random_bits: np.ndarray
+    :param random_state: [index of the current word, directions left in it]
+    :type random_state: np.ndarray
+    :rtype: int
+    """
+    if random_state[1] == 0:
+        random_state[0] += 1
+        if random_state[0] >= random_bits.shape[0]:
+            for i in range(random_bits.shape[0]):
+                random_bits[i] = np.random.randint(0, 1 << 62)
+            random_state[0] = 0
+        random_state[1] = 31
+    random_state[1] -= 1
+    return (random_bits[random_state[0]] >> (2 * random_state[1])) & 3
+
+
+@numba.njit
+def topple_dissipate_frontier(values: np.ndarray, visited: np.ndarray, critical_value: int, abelian: bool,
+                              boundary_size: int, seeds: np.ndarray, current: np.ndarray, upcoming: np.ndarray,
+                              queued: np.ndarray, random_bits: np.ndarray, random_state: np.ndarray,
+                              touched: np.ndarray):
+    """
+    Allocation-free equivalent of `topple_dissipate`.
+
+    Topples in the same waves as `topple_dissipate`, but keeps an explicit list
+    of active sites instead of rescanning the lattice, and takes neighbour
+    directions from `random_bits` instead of `np.random.choice`.
+
+    :param values: data array of the simulation
+    :type values: np.ndarray
+    :param visited: visited array, boolean or bit-packed (see `common.footprint`), needs to be cleaned beforehand
+    :type visited: np.ndarray
+    :param critical_value: nodes topple above this value
+    :type critical_value: int
+    :param abelian: True by default - abelian, False - nonabelian
+    :type abelian: bool
+    :param boundary_size: size of boundary for the array
+    :type boundary_size: int
+    :param seeds: Nx2 array of sites that may have become unstable since the last relaxation
+    :type seeds: np.ndarray
+    :param current: scratch buffer of flat indices, at least `values.size` long
+    :type current: np.ndarray
+    :param upcoming: scratch buffer of flat indices, at least `values.size` long
+    :type upcoming: np.ndarray
+    :param queued: boolean array, all False; left all False on return
+    :type queued: np.ndarray
+    :param random_bits: buffer of random words, see `_random_direction`
+    :type random_bits: np.ndarray
+    :param random_state: position in `random_bits`, see `_random_direction`
+    :type random_state: np.ndarray
+    :param touched: touched list of `visited`, see `common.footprint`
+    :type touched: np.ndarray
+    :return: number of waves, total number of topplings and the largest height, as `topple_dissipate`
+    :rtype: tuple
+    """
+    width, height = values.shape
+    n_upcoming = 0
+    for i in range(seeds.shape[0]):
+        x, y = seeds[i, 0], seeds[i, 1]
+        if (not queued[x, y]
+                and boundary_size <= x < width - boundary_size
+                and boundary_size <= y < height - boundary_size):
+            queued[x, y] = True
+            upcoming[n_upcoming] = x * height + y
+            n_upcoming += 1
 
+    number_of_topple_iterations = 0
+    topplings = 0
+    max_height = 0
+    while True:
+        # the wave consists of the queued sites that are overloaded right now
+        current, upcoming = upcoming, current
+        N = 0
+        for i in range(n_upcoming):
+            site = current[i]
+            x, y = site // height, site % height
+            queued[x, y] = False
+            if values[x, y] > critical_value:
+                current[N] = site
+                N += 1
+                max_height = max(max_height, values[x, y])
+        n_upcoming = 0
+        if N == 0:
+            break
+
+        for i in range(N):
+            site = current[i]
+            x, y = site // height, site % height
+            if abelian:
+                n_to_distribute = 2
+                values[x, y] -= n_to_distribute
+                if values[x, y] > critical_value and not queued[x, y]:
+                    queued[x, y] = True
+                    upcoming[n_upcoming] = site
+                    n_upcoming += 1
+            else:
+                n_to_distribute = values[x, y]
+                values[x, y] = 0
+            topplings += 1
+
+            for j in range(n_to_distribute):
+                direction = _random_direction(random_bits, random_state)
+                xn = x + 2 * (direction & 1) - 1
+                yn = y + (direction & 2) - 1
+                values[xn, yn] += 1
+                common.footprint.mark(visited, touched, xn, yn)
+                if (values[xn, yn] > critical_value and not queued[xn, yn]
+                        and boundary_size <= xn < width - boundary_size
+                        and boundary_size <= yn < height - boundary_size):
+                    queued[xn, yn] = True
+                    upcoming[n_upcoming] = xn * height + yn
+                    n_upcoming += 1
+
+        number_of_topple_iterations += 1
+
+    return number_of_topple_iterations, topplings, max_height
+
+
+@numba.njit
+def run_block(values: np.ndarray, visited: np.ndarray, critical_value: int, abelian: bool, boundary_size: int,
+              current: np.ndarray, upcoming: np.ndarray, queued: np.ndarray,
+              random_bits: np.ndarray, random_state: np.ndarray, touched: np.ndarray,
+              AvalancheSize: np.ndarray, number_of_iterations: np.ndarray, Topplings: np.ndarray,
+              ExtentX: np.ndarray, ExtentY: np.ndarray, GyrationRadius: np.ndarray, MaxHeight: np.ndarray) -> int:
+    """
+    Compiled equivalent of repeated `Manna.drive` and `Manna.AvalancheLoop` calls.
+
+    Runs as many iterations as `AvalancheSize` is long, writing the observables
+    of each into `AvalancheSize`, `number_of_iterations` and the geometry columns
+    (see `common.Simulation._geometry`). The remaining parameters are as in
+    `topple_dissipate_frontier`.
+
+    :param AvalancheSize: output column
+    :type AvalancheSize: np.ndarray
+    :param number_of_iterations: output column
+    :type number_of_iterations: np.ndarray
+    :param Topplings: output column
+    :type Topplings: np.ndarray
+    :param ExtentX: output column
+    :type ExtentX: np.ndarray
+    :param ExtentY: output column
+    :type ExtentY: np.ndarray
+    :param GyrationRadius: output column
+    :type GyrationRadius: np.ndarray
+    :param MaxHeight: output column
+    :type MaxHeight: np.ndarray
+    :return: total number of topplings
+    :rtype: int
+    """
+    width, height = values.shape
+    seeds = np.empty((1, 2), dtype=np.int64)
+    topplings = 0
+    for i in range(AvalancheSize.shape[0]):
+        x = np.random.randint(boundary_size, width - boundary_size)
+        y = np.random.randint(boundary_size, height - boundary_size)
+        values[x, y] += 1
+        seeds[0, 0], seeds[0, 1] = x, y
+        common.footprint.clear(visited, touched)
+        number_of_iterations[i], Topplings[i], MaxHeight[i] = topple_dissipate_frontier(
+            values, visited, critical_value, abelian, boundary_size, seeds, current, upcoming, queued,
+            random_bits, random_state, touched)
+        topplings += Topplings[i]
+        AvalancheSize[i] = common.footprint.size(visited, touched, boundary_size, width, height)
+        ExtentX[i], ExtentY[i], GyrationRadius[i] = common.footprint.geometry(
+            visited, touched, boundary_size, width, height)
+    return topplings
+
+
+@numba.njit(parallel=True)
+def run_batch(values: np.ndarray, visited: np.ndarray, critical_value: int, abelian: bool, boundary_size: int,
+              current: np.ndarray, upcoming: np.ndarray, queued: np.ndarray,
+              random_bits: np.ndarray, random_state: np.ndarray, touched: np.ndarray, seeds: np.ndarray,
+              AvalancheSize: np.ndarray, number_of_iterations: np.ndarray, Topplings: np.ndarray,
+              ExtentX: np.ndarray, ExtentY: np.ndarray, GyrationRadius: np.ndarray, MaxHeight: np.ndarray,
+              topplings: np.ndarray):
+    """
+    `run_block` for a batch of independent replicas, in parallel.
+
+    Every array has an extra first axis over the replicas. Each replica's random
+    generator is seeded with its entry of `seeds`, so that the results do not
+    depend on how replicas are scheduled on threads.
+
+    :param seeds: seed for every replica
+    :type seeds: np.ndarray
+    :param topplings: output, total number of topplings of every replica
+    :type topplings: np.ndarray
+    """
+    for k in numba.prange(values.shape[0]):
+        np.random.seed(seeds[k])
+        topplings[k] = run_block(values[k], visited[k], critical_value, abelian, boundary_size,
+                                 current[k], upcoming[k], queued[k], random_bits[k], random_state[k], touched[k],
+                                 AvalancheSize[k], number_of_iterations[k], Topplings[k],
+                                 ExtentX[k], ExtentY[k], GyrationRadius[k], MaxHeight[k])
+
+
+@numba.njit
+def _relax_tile(values: np.ndarray, visited: np.ndarray, critical_value: int, boundary_size: int,
+                tile_size: int, active: np.ndarray, queued: np.ndarray, tx: int, ty: int, mode: int):
+    """
+    Topple tile (`tx`, `ty`) of the abelian model until all its sites are stable, sending
+    particles to the edges of the neighbouring tiles (and marking them active) or to the boundary.
+
+    An unstable site topples as many times in a row as it takes to become stable, each
+    toppling sending two particles to independently drawn diagonal neighbours.
+
+    :return: number of topplings and the largest height of a toppling site
+    """
+    width, height = values.shape
+    x0, x1, y0, y1 = common.tiles.tile_bounds(tx, ty, tile_size, boundary_size, width, height)
+    stack = np.empty((x1 - x0) * (y1 - y0), dtype=np.int64)
+    n = common.tiles.unstable_sites(values, critical_value, queued, stack, x0, x1, y0, y1, mode)
+    topplings = 0
+    max_height = 0
+    while n > 0:
+        n -= 1
+        x, y = divmod(stack[n], height)
+        queued[x, y] = False
+        k = (values[x, y] - critical_value + 1) // 2
+        max_height = max(max_height, values[x, y])
+        values[x, y] -= 2 * k
+        topplings += k
+        for _ in range(2 * k):
+            d = np.random.randint(0, 4)
+            xn = x + 2 * (d & 1) - 1
+            yn = y + (d & 2) - 1
+            values[xn, yn] += 1
+            visited[xn, yn] = True
+            if x0 <= xn < x1 and y0 <= yn < y1:
+                if values[xn, yn] > critical_value and not queued[xn, yn]:
+                    queued[xn, yn] = True
+                    stack[n] = xn * height + yn
+                    n += 1
+            else:
+                common.tiles.activate_site(active, xn, yn, tile_size, boundary_size, width, height)
+    return topplings, max_height
+
+
+@numba.njit(parallel=True)
+def topple_tiled(values: np.ndarray, visited: np.ndarray, critical_value: int, boundary_size: int,
+                 seeds: np.ndarray, tile_size: int, active: np.ndarray, queued: np.ndarray):
+    """
+    Distribute material from overloaded sites to neighbors in the abelian model,
+    relaxing tiles of the lattice in parallel (as `btw.topple_tiled`).
+
+    Statistically equivalent to `topple_dissipate` with abelian=True.
+
+    :param seeds: Nx2 array of the only possibly unstable sites
+    :type seeds: np.ndarray
+    :param tile_size: linear size of the tiles
+    :type tile_size: int
+    :param active: flags of the tiles, see `common.tiles.tile_grid`; left all zero
+    :type active: np.ndarray
+    :param queued: scratch boolean array, all False; left all False
+    :type queued: np.ndarray
+    :return: number of rounds, number of topplings and the largest height of a toppling site
+        (see `btw.topple_tiled`)
+    """
+    common.tiles.activate_seeds(active, seeds, tile_size, boundary_size)
+    rounds = 0
+    topplings = 0
+    max_height = 0
+    while active.any():
+        rounds += 1
+        for color in range(4):
+            for t in numba.prange(common.tiles.tiles_of_color(color, active)):
+                tx, ty = common.tiles.tile_index(t, color, active)
+                mode = active[tx, ty]
+                if mode:
+                    active[tx, ty] = 0
+                    n, height = _relax_tile(values, visited, critical_value, boundary_size, tile_size,
+                                            active, queued, tx, ty, mode)
+                    topplings += n
+                    max_height = max(max_height, height)
+    return rounds, topplings, max_height
@@ -17,10 +17,27 @@ class OFC(common.Simulation):
     :type critical_value: float
     :param conservation_lvl: 0.25 by default - fraction of the force from a toppling site going to its neighbour
     :type conservation_lvl: float
+    :param engine: "wave" by default - recomputes the set of active sites over the whole lattice (`topple`);
+        "incremental" only re-checks the four neighbours of each toppled site (`topple_incremental`);
+        "heap" additionally keeps the interior loads in an indexed max-heap, so that `drive` finds
+        the epicenter in O(1) and every load change costs O(log N). All give identical results.
+        With "heap", call `build_heap` after modifying `values` by hand.
+        Compiled runs (`run(..., compiled=True)`) need "heap".
+    :type engine: str
     """
 
-    def __init__(self, critical_value: float = 1., conservation_lvl: float = 0.25, *args, **kwargs):
+    ENGINES = ("wave", "incremental", "heap")
+    GEOMETRY = True
+    CHECKPOINT_ARRAYS = common.Simulation.CHECKPOINT_ARRAYS + ("releases", "_heap", "_heap_position")
+    CHECKPOINT_ATTRIBUTES = STATE_ATTRIBUTES = ("critical_value_current",)
+    BATCH_ARRAYS = ("values", "visited", "_touched", "releases", "_released", "_current", "_upcoming", "_queued",
+                    "_heap", "_heap_position", "_epicenters")
+
+    def __init__(self, critical_value: float = 1., conservation_lvl: float = 0.25, *args, engine: str = "wave", **kwargs):
         super().__init__(*args, **kwargs)
+        if engine not in self.ENGINES:
+            raise ValueError(f"engine must be one of {self.ENGINES}, got {engine!r}")
+        self.engine = engine
         self.critical_value = critical_value
         self.values = np.random.rand(
             self.L_with_boundary, self.L_with_boundary) * self.critical_value
@@ -29,6 +46,37 @@ class OFC(common.Simulation):
         self.critical_value_current = self.critical_value
         # zliczanie relaksacji
         self.releases = np.zeros((self.L_with_boundary, self.L_with_boundary), dtype=int)
+        if engine in ("incremental", "heap"):
+            self._current = np.empty(self.L_with_boundary**2, dtype=np.int64)
+            self._upcoming = np.empty(self.L_with_boundary**2, dtype=np.int64)
+            self._queued = np.zeros((self.L_with_boundary, self.L_with_boundary), dtype=bool)
+            # the sites with nonzero `releases`, listed like the footprint in `_touched`
+            self._released = common.footprint.touched_list(self.L_with_boundary)
+        self._track_footprint(engine in ("incremental", "heap"))
+        self._heap = self._heap_position = _NO_HEAP
+        if engine == "heap":
+            self._epicenters = np.empty((self.size, 2), dtype=np.int64)
+            self.build_heap()
+
+    @property
+    def params(self) -> dict:
+        return dict(super().params, critical_value=self.critical_value,
+                    conservation_lvl=self.conservation_lvl, engine=self.engine)
+
+    def build_heap(self):
+        """
+        (Re)build the max-heap of interior loads used by the "heap" engine.
+        """
+        self._heap, self._heap_position = build_heap(self.values, self.BC)
+
+    def build_engine(self):
+        if self.engine == "heap":
+            self.build_heap()
+
+    def _relist_footprint(self):
+        super()._relist_footprint()
+        if hasattr(self, '_released'):
+            common.footprint.relist(self.releases != 0, self._released, self.releases.shape[1])
 
     def drive(self):
         """
@@ -36,6 +84,12 @@ class OFC(common.Simulation):
 
         """
 
+        if self.engine == "heap":
+            n_epicenters = heap_maxima(self.values, self._heap, self._epicenters)
+            self._driven_sites = self._epicenters[:n_epicenters]
+            self.critical_value_current = self.values.flat[self._heap[0]]
+            return
+
         # decreasing critical_value to the max_value
         max_value = np.max(self.inside((self.values)))
         self.critical_value_current = max_value
@@ -44,33 +98,91 @@ class OFC(common.Simulation):
         """
         Distribute material from overloaded sites to neighbors.
 
-        Convenience wrapper for the numba.njitted `topple` function defined in `ofc.py`.
+        Convenience wrapper for the numba.njitted `topple` (or `topple_incremental`)
+        function defined in `ofc.py`. The number of releases and the largest load
+        are kept in `_avalanche`.
 
+        :return: number of waves
         :rtype: int
         """
-        return topple(self.values, self.visited, self.releases, self.critical_value_current, self.critical_value, self.conservation_lvl, self.BC)
+        if self.engine != "wave":
+            seeds, self._driven_sites = self._driven_sites, None
+            if seeds is None:
+                seeds = np.argwhere(self.inside(self.values) >= self.critical_value_current) + self.BC
+            number_of_iterations, *self._avalanche = topple_incremental(
+                self.values, self.visited, self.releases, self.critical_value_current,
+                self.critical_value, self.conservation_lvl, self.BC,
+                seeds, self._current, self._upcoming, self._queued,
+                self._heap, self._heap_position, self._touched, self._released)
+            return number_of_iterations
+        number_of_iterations, *self._avalanche = topple(
+            self.values, self.visited, self.releases, self.critical_value_current,
+            self.critical_value, self.conservation_lvl, self.BC)
+        return number_of_iterations
+
+    def _run_compiled(self, n_iterations: int) -> dict:
+        if self.engine != "heap":
+            raise ValueError("Compiled runs need engine='heap'")
+        AvalancheSize = np.empty(n_iterations, dtype=np.int64)
+        number_of_iterations = np.empty(n_iterations, dtype=np.int64)
+        geometry = self._geometry_columns(n_iterations)
+        NumberOfReleases = geometry.pop('Topplings')
+        self.critical_value_current = run_block(
+            self.values, self.visited, self.releases, self.critical_value, self.conservation_lvl, self.BC,
+            self._current, self._upcoming, self._queued, self._heap, self._heap_position, self._epicenters,
+            self._touched, self._released, AvalancheSize, NumberOfReleases, number_of_iterations,
+            *geometry.values())
+        return dict(AvalancheSize=AvalancheSize, NumberOfReleases=NumberOfReleases,
+                    number_of_iterations=number_of_iterations, **geometry)
+
+    def _run_batch(self, replicas: list, arrays: dict, seeds: np.ndarray, n_iterations: int) -> dict:
+        if self.engine != "heap":
+            raise ValueError("Batched runs need engine='heap'")
+        AvalancheSize = np.empty((seeds.size, n_iterations), dtype=np.int64)
+        number_of_iterations = np.empty((seeds.size, n_iterations), dtype=np.int64)
+        geometry = self._geometry_columns((seeds.size, n_iterations))
+        NumberOfReleases = geometry.pop('Topplings')
+        critical_value_current = np.empty(seeds.size)
+        run_batch(arrays['values'], arrays['visited'], arrays['releases'],
+                  self.critical_value, self.conservation_lvl, self.BC,
+                  arrays['_current'], arrays['_upcoming'], arrays['_queued'],
+                  arrays['_heap'], arrays['_heap_position'], arrays['_epicenters'],
+                  arrays['_touched'], arrays['_released'], AvalancheSize, NumberOfReleases, number_of_iterations,
+                  *geometry.values(), critical_value_current)
+        for replica, value in zip(replicas, critical_value_current):
+            replica.critical_value_current = value
+        return dict(AvalancheSize=AvalancheSize, NumberOfReleases=NumberOfReleases,
+                    number_of_iterations=number_of_iterations, **geometry)
 
-    def _save_snapshot(self, i):
-        self.saved_snapshots[i // self.save_every] = self.values - \
-            self.critical_value_current
+    def _snapshot(self) -> np.ndarray:
+        return self.values - self.critical_value_current
 
     def AvalancheLoop(self) -> dict:
         """
         Bring the current simulation's state to equilibrium by repeatedly
         toppling and dissipating.
 
-        Returns a dictionary with the total size of the avalanche
-        and the number of iterations the avalanche took.
+        Returns a dictionary with the total size of the avalanche, the number
+        of releases and the number of iterations the avalanche took, followed
+        by its geometry (see `common.Simulation._geometry`; the topplings are
+        the releases, and the heights the loads).
 
         :rtype: dict
         """
-        self.visited[...] = False
-        self.releases[...] = 0
-        number_of_iterations = self.topple_dissipate()
-        
-        AvalancheSize = self.inside(self.visited).sum()
-        NumberOfReleases = self.inside(self.releases).sum()
-        return dict(AvalancheSize=AvalancheSize, NumberOfReleases=NumberOfReleases, number_of_iterations=number_of_iterations)
+        if self.engine == "wave":
+            self.visited[...] = False
+            self.releases[...] = 0
+            number_of_iterations = self.topple_dissipate()
+            AvalancheSize = self.inside(self.visited).sum()
+        else:
+            common.footprint.clear(self.visited, self._touched)
+            common.footprint.clear_counts(self.releases, self._released)
+            number_of_iterations = self.topple_dissipate()
+            AvalancheSize = common.footprint.size(self.visited, self._touched, self.BC, *self.values.shape)
+        geometry = self._geometry()
+        NumberOfReleases = geometry.pop('Topplings')
+        return dict(AvalancheSize=AvalancheSize, NumberOfReleases=NumberOfReleases,
+                    number_of_iterations=number_of_iterations, **geometry)
 
 
 @numba.njit
@@ -91,7 +203,10 @@ def topple(values: np.ndarray, visited: np.ndarray, releases: np.ndarray, critic
     :type conservation_lvl: float
     :param boundary_size: size of boundary for the array
     :type boundary_size: int
-    :rtype: int
+    :return: number of waves, number of releases and the largest load of a relaxing site at
+        the start of its wave, relative to the threshold as in `OFC._snapshot` (so at least
+        `critical_value`; 0 if no site relaxes)
+    :rtype: tuple
     """
 
     # find a boolean array of active (overloaded) sites
@@ -99,6 +214,8 @@ def topple(values: np.ndarray, visited: np.ndarray, releases: np.ndarray, critic
     active_sites = common.clean_boundary_inplace(
         values >= critical_value_current, boundary_size)
     number_of_iterations = 0
+    number_of_releases = 0
+    max_load = -np.inf
 
     while active_sites.any():
         
@@ -106,6 +223,9 @@ def topple(values: np.ndarray, visited: np.ndarray, releases: np.ndarray, critic
         indices = np.vstack(np.where(active_sites)).T
           # a Nx2 array of integer indices for overloaded sites
         N = indices.shape[0]
+        number_of_releases += N
+        for i in range(N):
+            max_load = max(max_load, values[indices[i, 0], indices[i, 1]] - critical_value_current + critical_value)
         for i in range(N):
             x, y = index = indices[i]
 
@@ -119,4 +239,282 @@ def topple(values: np.ndarray, visited: np.ndarray, releases: np.ndarray, critic
             active_sites = common.clean_boundary_inplace(values >= critical_value_current, boundary_size)
         number_of_iterations += 1
 
-    return number_of_iterations
+    if number_of_releases == 0:
+        max_load = 0.
+    return number_of_iterations, number_of_releases, max_load
+
+
+_NO_HEAP = np.empty(0, dtype=np.int64)
+
+
+@numba.njit
+def _sift_up(heap: np.ndarray, position: np.ndarray, keys: np.ndarray, i: int):
+    site = heap[i]
+    while i > 0:
+        parent = (i - 1) // 2
+        if keys[heap[parent]] >= keys[site]:
+            break
+        heap[i] = heap[parent]
+        position[heap[i]] = i
+        i = parent
+    heap[i] = site
+    position[site] = i
+
+
+@numba.njit
+def _sift_down(heap: np.ndarray, position: np.ndarray, keys: np.ndarray, i: int):
+    site = heap[i]
+    N = heap.shape[0]
+    while True:
+        child = 2 * i + 1
+        if child >= N:
+            break
+        if child + 1 < N and keys[heap[child + 1]] > keys[heap[child]]:
+            child += 1
+        if keys[heap[child]] <= keys[site]:
+            break
+        heap[i] = heap[child]
+        position[heap[i]] = i
+        i = child
+    heap[i] = site
+    position[site] = i
+
+
+@numba.njit
+def build_heap(values: np.ndarray, boundary_size: int):
+    """
+    Build an indexed max-heap of the interior sites of `values`.
+
+    :param values: data array of the simulation
+    :type values: np.ndarray
+    :param boundary_size: size of boundary for the array
+    :type boundary_size: int
+    :return: heap of flat site indices, and the position in the heap of every site (-1 outside)
+    :rtype: tuple
+    """
+    width, height = values.shape
+    keys = values.reshape(values.size)
+    heap = np.empty((width - 2 * boundary_size) * (height - 2 * boundary_size), dtype=np.int64)
+    position = np.full(values.size, -1, dtype=np.int64)
+    N = 0
+    for x in range(boundary_size, width - boundary_size):
+        for y in range(boundary_size, height - boundary_size):
+            heap[N] = x * height + y
+            position[x * height + y] = N
+            N += 1
+    for i in range(N // 2 - 1, -1, -1):
+        _sift_down(heap, position, keys, i)
+    return heap, position
+
+
+@numba.njit
+def heap_maxima(values: np.ndarray, heap: np.ndarray, out: np.ndarray) -> int:
+    """
+    Find all the sites that share the maximal load, walking only the top of the heap.
+
+    :param values: data array of the simulation
+    :type values: np.ndarray
+    :param heap: heap from `build_heap`
+    :type heap: np.ndarray
+    :param out: Nx2 output array for the site indices
+    :type out: np.ndarray
+    :return: number of sites written to `out`
+    :rtype: int
+    """
+    height = values.shape[1]
+    keys = values.reshape(values.size)
+    top = keys[heap[0]]
+    stack = [0]
+    N = 0
+    while len(stack) > 0:
+        i = stack.pop()
+        out[N, 0] = heap[i] // height
+        out[N, 1] = heap[i] % height
+        N += 1
+        for child in (2 * i + 1, 2 * i + 2):
+            if child < heap.shape[0] and keys[heap[child]] == top:
+                stack.append(child)
+    return N
+
+
+@numba.njit
+def topple_incremental(values: np.ndarray, visited: np.ndarray, releases: np.ndarray, critical_value_current: float,
+                       critical_value: float, conservation_lvl: float, boundary_size: int,
+                       seeds: np.ndarray, current: np.ndarray, upcoming: np.ndarray, queued: np.ndarray,
+                       heap: np.ndarray, heap_position: np.ndarray, touched: np.ndarray, released: np.ndarray):
+    """
+    Incremental equivalent of `topple`.
+
+    Keeps the list of sites to relax in the current wave and only re-checks the
+    four neighbours of each relaxed site. Sites within a wave are relaxed in the
+    same (row-major) order as in `topple`, so the results are identical.
+
+    :param values: data array of the simulation
+    :type values: np.ndarray
+    :param visited: visited array, boolean or bit-packed (see `common.footprint`), needs to be cleaned beforehand
+    :type visited: np.ndarray
+    :param releases: integer array, incremented at every relaxed site
+    :type releases: np.ndarray
+    :param critical_value_current: nodes topple at or above this value
+    :type critical_value_current: float
+    :param critical_value: threshold force, as in `topple`
+    :type critical_value: float
+    :param conservation_lvl: fraction of the force from a toppling site going to its neighbour
+    :type conservation_lvl: float
+    :param boundary_size: size of boundary for the array
+    :type boundary_size: int
+    :param seeds: Nx2 array of the sites that are active at the start
+    :type seeds: np.ndarray
+    :param current: scratch buffer of flat indices, at least `values.size` long
+    :type current: np.ndarray
+    :param upcoming: scratch buffer of flat indices, at least `values.size` long
+    :type upcoming: np.ndarray
+    :param queued: boolean array, all False; left all False on return
+    :type queued: np.ndarray
+    :param heap: heap from `build_heap`, kept up to date with the loads; pass an empty array to skip
+    :type heap: np.ndarray
+    :param heap_position: positions in `heap`, as returned by `build_heap`
+    :type heap_position: np.ndarray
+    :param touched: touched list of `visited`, see `common.footprint`
+    :type touched: np.ndarray
+    :param released: list of the sites with nonzero `releases`, kept like `touched`
+    :type released: np.ndarray
+    :return: number of waves, total number of releases and the largest load, as `topple`
+    :rtype: tuple
+    """
+    width, height = values.shape
+    keys = values.reshape(values.size)
+    use_heap = heap.shape[0] > 0
+    n_upcoming = 0
+    for i in range(seeds.shape[0]):
+        x, y = seeds[i, 0], seeds[i, 1]
+        if (not queued[x, y]
+                and boundary_size <= x < width - boundary_size
+                and boundary_size <= y < height - boundary_size):
+            queued[x, y] = True
+            upcoming[n_upcoming] = x * height + y
+            n_upcoming += 1
+
+    number_of_iterations = 0
+    number_of_releases = 0
+    max_load = -np.inf
+    while True:
+        # the wave consists of the queued sites that are active right now
+        current, upcoming = upcoming, current
+        N = 0
+        for i in range(n_upcoming):
+            site = current[i]
+            x, y = site // height, site % height
+            queued[x, y] = False
+            if values[x, y] >= critical_value_current:
+                current[N] = site
+                N += 1
+                max_load = max(max_load, values[x, y] - critical_value_current + critical_value)
+        n_upcoming = 0
+        if N == 0:
+            break
+        current[:N].sort()
+
+        for i in range(N):
+            site = current[i]
+            x, y = site // height, site % height
+            common.footprint.increment(releases, released, x, y)
+            number_of_releases += 1
+            transfer = conservation_lvl * (values[x, y] - critical_value_current + critical_value)   # Grassberger (1994), eqns (1)
+            for xn, yn in ((x, y + 1), (x - 1, y), (x + 1, y), (x, y - 1)):
+                values[xn, yn] += transfer
+                common.footprint.mark(visited, touched, xn, yn)
+                if (boundary_size <= xn < width - boundary_size
+                        and boundary_size <= yn < height - boundary_size):
+                    if use_heap:
+                        _sift_up(heap, heap_position, keys, heap_position[xn * height + yn])
+                    if values[xn, yn] >= critical_value_current and not queued[xn, yn]:
+                        queued[xn, yn] = True
+                        upcoming[n_upcoming] = xn * height + yn
+                        n_upcoming += 1
+
+            values[x, y] = critical_value_current - critical_value  # Grassberger (1994), eqns (1)
+            if use_heap:
+                _sift_down(heap, heap_position, keys, heap_position[site])
+        number_of_iterations += 1
+
+    if number_of_releases == 0:
+        max_load = 0.
+    return number_of_iterations, number_of_releases, max_load
+
+
+@numba.njit
+def run_block(values: np.ndarray, visited: np.ndarray, releases: np.ndarray,
+              critical_value: float, conservation_lvl: float, boundary_size: int,
+              current: np.ndarray, upcoming: np.ndarray, queued: np.ndarray,
+              heap: np.ndarray, heap_position: np.ndarray, epicenters: np.ndarray,
+              touched: np.ndarray, released: np.ndarray,
+              AvalancheSize: np.ndarray, NumberOfReleases: np.ndarray, number_of_iterations: np.ndarray,
+              ExtentX: np.ndarray, ExtentY: np.ndarray, GyrationRadius: np.ndarray, MaxHeight: np.ndarray) -> float:
+    """
+    Compiled equivalent of repeated `OFC.drive` and `OFC.AvalancheLoop` calls with the "heap" engine.
+
+    Runs as many iterations as `AvalancheSize` is long, writing the observables
+    of each into the output columns. The remaining parameters are as in
+    `topple_incremental` and `heap_maxima`.
+
+    :param AvalancheSize: output column
+    :type AvalancheSize: np.ndarray
+    :param NumberOfReleases: output column
+    :type NumberOfReleases: np.ndarray
+    :param number_of_iterations: output column
+    :type number_of_iterations: np.ndarray
+    :param ExtentX: output column
+    :type ExtentX: np.ndarray
+    :param ExtentY: output column
+    :type ExtentY: np.ndarray
+    :param GyrationRadius: output column
+    :type GyrationRadius: np.ndarray
+    :param MaxHeight: output column, the largest load relative to the threshold, as in `topple`
+    :type MaxHeight: np.ndarray
+    :return: the current critical value after the last iteration
+    :rtype: float
+    """
+    width, height = values.shape
+    keys = values.reshape(values.size)
+    critical_value_current = keys[heap[0]]
+    for i in range(AvalancheSize.shape[0]):
+        n_epicenters = heap_maxima(values, heap, epicenters)
+        critical_value_current = keys[heap[0]]
+        common.footprint.clear(visited, touched)
+        common.footprint.clear_counts(releases, released)
+        number_of_iterations[i], NumberOfReleases[i], MaxHeight[i] = topple_incremental(
+            values, visited, releases, critical_value_current, critical_value, conservation_lvl, boundary_size,
+            epicenters[:n_epicenters], current, upcoming, queued, heap, heap_position, touched, released)
+        AvalancheSize[i] = common.footprint.size(visited, touched, boundary_size, width, height)
+        ExtentX[i], ExtentY[i], GyrationRadius[i] = common.footprint.geometry(
+            visited, touched, boundary_size, width, height)
+    return critical_value_current
+
+
+@numba.njit(parallel=True)
+def run_batch(values: np.ndarray, visited: np.ndarray, releases: np.ndarray,
+              critical_value: float, conservation_lvl: float, boundary_size: int,
+              current: np.ndarray, upcoming: np.ndarray, queued: np.ndarray,
+              heap: np.ndarray, heap_position: np.ndarray, epicenters: np.ndarray,
+              touched: np.ndarray, released: np.ndarray,
+              AvalancheSize: np.ndarray, NumberOfReleases: np.ndarray, number_of_iterations: np.ndarray,
+              ExtentX: np.ndarray, ExtentY: np.ndarray, GyrationRadius: np.ndarray, MaxHeight: np.ndarray,
+              critical_value_current: np.ndarray):
+    """
+    `run_block` for a batch of independent replicas, in parallel.
+
+    Every array has an extra first axis over the replicas. The OFC model is
+    deterministic once its initial loads are drawn, so no seeds are needed.
+
+    :param critical_value_current: output, current critical value of every replica after the last iteration
+    :type critical_value_current: np.ndarray
+    """
+    for k in numba.prange(values.shape[0]):
+        critical_value_current[k] = run_block(values[k], visited[k], releases[k],
+                                              critical_value, conservation_lvl, boundary_size,
+                                              current[k], upcoming[k], queued[k],
+                                              heap[k], heap_position[k], epicenters[k],
+                                              touched[k], released[k], AvalancheSize[k], NumberOfReleases[k],
+                                              number_of_iterations[k], ExtentX[k], ExtentY[k], GyrationRadius[k],
+                                              MaxHeight[k])
@@ -27,3 +27,83 @@ def test_deterministic_result():
               [3, 4, 4, 4, 4, 4, 3],]
     np.testing.assert_allclose(b.values, output)
 
+
+def test_worklist_deterministic_result():
+    b = BTW(5, save_every = 1, engine = "worklist")
+
+    b.values[...] = 3
+    b.values[3, 3] += 1
+
+    reference = BTW(5, save_every = 1)
+    reference.values[...] = b.values
+
+    assert b.topple_dissipate() == reference.topple_dissipate()
+    np.testing.assert_allclose(b.values, reference.values)
+    np.testing.assert_allclose(b.visited, reference.visited)
+
+def test_worklist_matches_wave_engine():
+    np.random.seed(0)
+    wave = BTW(10)
+    worklist = BTW(10, engine = "worklist")
+    for i in range(2000):
+        wave.drive()
+        worklist.values[...] = wave.values
+        worklist._driven_sites = wave._driven_sites
+        assert wave.AvalancheLoop() == worklist.AvalancheLoop()
+        np.testing.assert_allclose(wave.values, worklist.values)
+        np.testing.assert_allclose(wave.visited, worklist.visited)
+
+def test_unknown_engine():
+    with pytest.raises(ValueError):
+        BTW(10, engine = "magic")
+
+def test_compiled_run():
+    sim = BTW(10, save_every = 10, engine = "worklist")
+    sim.run(90, compiled = True)
+    df = sim.data_df
+    assert len(df) == 90
+    assert list(df.columns) == ['AvalancheSize', 'number_of_iterations', 'Topplings',
+                                'ExtentX', 'ExtentY', 'GyrationRadius', 'MaxHeight']
+    assert (sim.inside(sim.values) <= sim.z_c).all()
+
+def test_compiled_run_needs_worklist():
+    with pytest.raises(ValueError):
+        BTW(10).run(10, compiled = True)
+
+@pytest.mark.parametrize("L, tile_size", [(10, 2), (37, 4), (33, 64)])
+def test_tiled_matches_wave_engine(L, tile_size):
+    np.random.seed(1)
+    wave = BTW(L)
+    tiled = BTW(L, engine = "tiled", tile_size = tile_size)
+    for i in range(20):
+        wave.values[1:-1, 1:-1] = np.random.randint(0, 12, size = (L, L))
+        wave._driven_sites = None
+        tiled.values[...] = wave.values
+        tiled._driven_sites = None
+        wave.visited[...] = tiled.visited[...] = False
+        wave.topple_dissipate()
+        tiled.topple_dissipate()
+        np.testing.assert_allclose(wave.values, tiled.values)
+        np.testing.assert_allclose(wave.visited, tiled.visited)
+        assert not tiled._active.any() and not tiled._queued.any()
+
+@pytest.mark.parametrize("L, grains", [(5, 4), (41, 10000), (70, None)])
+def test_stabilize_matches_topple(L, grains):
+    np.random.seed(2)
+    sim = BTW(L)
+    if grains is None:
+        sim.values[1:-1, 1:-1] = np.random.randint(0, 40, size = (L, L))
+    else:
+        sim.values[L // 2 + 1, L // 2 + 1] = grains
+    initial = sim.values.copy()
+    reference = BTW(L)
+    reference.values[...] = initial
+    reference.topple_dissipate()
+
+    values, odometer = sim.stabilize()
+    np.testing.assert_array_equal(values, reference.values)
+    np.testing.assert_array_equal(sim.visited, reference.visited)
+    padded = np.pad(odometer, 1)
+    laplacian = padded[:-2, 1:-1] + padded[2:, 1:-1] + padded[1:-1, :-2] + padded[1:-1, 2:] - 4 * odometer
+    np.testing.assert_array_equal(initial + laplacian, values)
+    assert (odometer >= 0).all() and (sim.inside(odometer) > 0).any()
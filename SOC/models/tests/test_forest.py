@@ -0,0 +1,66 @@
+from SOC.models import Forest
+import numpy as np
+import pytest
+
+def test_run():
+    sim = Forest(L=20)
+    sim.run(5)
+
+def test_front_burns_out_cluster():
+    sim = Forest(p=0, f=0, L=10, engine="front")
+    sim.values[...] = 0
+    sim.values[3:6, 3:6] = 1
+    sim.values[4, 4] = 2
+    sim.build_front()
+    assert sim.topple_dissipate() == 8
+    assert sim.topple_dissipate() == 0
+    assert (sim.values == 0).all()
+
+def test_front_statistically_equivalent():
+    burning = []
+    for engine in ["lattice", "front"]:
+        np.random.seed(0)
+        sim = Forest(p=0.05, f=0.001, L=50, engine=engine)
+        numbers = [sim.AvalancheLoop()['number_of_iterations'] for i in range(1500)]
+        burning.append(np.mean(numbers[500:]))
+    np.testing.assert_allclose(*burning, rtol=0.2)
+
+def test_cluster_burns_whole_cluster():
+    sim = Forest(p=1, f=1, L=10, engine="cluster")
+    sim.values[...] = 0
+    sim.values[1:-1, 1:-1] = 1
+    sim.values[5, 1:-1] = 0
+    sim.build_clusters()
+    assert sorted(sim.cluster_sizes()) == [40, 50]
+    results = sim.AvalancheLoop()
+    while results['number_of_iterations'] == 0:     # lightning hit the empty row
+        assert results['AvalancheSize'] == 0
+        results = sim.AvalancheLoop()
+    burnt = results['AvalancheSize']
+    assert burnt in (40, 50)
+    assert results['number_of_iterations'] > 1
+    assert (sim.inside(sim.values) == 1).sum() == 90 - burnt
+    assert list(sim.cluster_sizes()) == [90 - burnt]
+
+def test_cluster_sizes_stay_consistent():
+    sim = Forest(p=0.5, f=0.01, L=30, engine="cluster")
+    sim.run(100)
+    sizes = sorted(sim.cluster_sizes())
+    assert sum(sizes) == (sim.values == 1).sum()
+    sim.build_clusters()
+    assert sorted(sim.cluster_sizes()) == sizes
+
+def test_cluster_needs_lightning():
+    with pytest.raises(ValueError):
+        Forest(f=0, L=10, engine="cluster")
+
+@pytest.mark.parametrize("engine", ["front", "cluster"])
+def test_compiled_run(engine):
+    sim = Forest(p=0.5, f=0.01, L=20, engine=engine, save_every=10)
+    sim.run(90, compiled=True)
+    assert len(sim.data_df) == 90
+    if engine == "front":
+        np.testing.assert_array_equal(np.sort(sim._front[:sim._n_front]),
+                                      np.flatnonzero(sim.values == 2))
+    else:
+        assert sum(sim.cluster_sizes()) == (sim.values == 1).sum()
@@ -1,4 +1,5 @@
 from SOC.models import Manna
+from SOC.common.checkpoints import seed
 import numpy as np
 import pytest
 
@@ -63,3 +64,47 @@ def test_resurrect_default_name():
     sim2 = Manna.from_file(filename)
     np.testing.assert_allclose(sim2.values, saved)
     assert sim2.save_every == save_every_orig
+
+@pytest.mark.parametrize("abelian", [True, False])
+def test_frontier_toppling_reduces_middle_to_max_one(abelian):
+    sim = Manna(L=10, abelian=abelian, engine="frontier")
+    sim.values[1:-1, 1:-1] = 6
+    sim.AvalancheLoop()
+    assert (0 <= sim.values[1:-1, 1:-1]).all()
+    assert (sim.values[1:-1, 1:-1] <= 1).all()
+    assert sim.topplings > 0
+    assert sim.topplings_per_second > 0
+
+@pytest.mark.parametrize("abelian", [True, False])
+def test_frontier_statistically_equivalent(abelian):
+    mean_sizes = []
+    for engine in ["wave", "frontier"]:
+        seed(0)
+        sim = Manna(L=20, abelian=abelian, engine=engine)
+        sizes = []
+        for i in range(6000):
+            sim.drive()
+            sizes.append(sim.AvalancheLoop()['AvalancheSize'])
+        mean_sizes.append(np.mean(sizes[1000:]))
+    np.testing.assert_allclose(*mean_sizes, rtol=0.2)
+
+@pytest.mark.parametrize("abelian", [True, False])
+def test_compiled_run(abelian):
+    sim = Manna(L=10, abelian=abelian, engine="frontier", save_every=10)
+    sim.run(90, compiled=True)
+    assert len(sim.data_df) == 90
+    assert (sim.inside(sim.values) <= 1).all()
+    assert sim.topplings > 0
+
+def test_tiled_toppling_reduces_middle_to_max_one():
+    sim = Manna(L=20, engine="tiled", tile_size=4)
+    sim.values[1:-1, 1:-1] = 6
+    sim.AvalancheLoop()
+    assert (0 <= sim.values[1:-1, 1:-1]).all()
+    assert (sim.values[1:-1, 1:-1] <= 1).all()
+    assert sim.values.sum() == 6 * 20**2
+    assert sim.topplings > 0
+
+def test_tiled_needs_abelian():
+    with pytest.raises(ValueError):
+        Manna(L=10, abelian=False, engine="tiled")
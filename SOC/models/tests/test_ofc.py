@@ -5,3 +5,47 @@ import pytest
 def test_run():
     sim = OFC(1.,0.2, L=20)
     sim.run(5)
+
+@pytest.mark.parametrize("engine", ["incremental", "heap"])
+@pytest.mark.parametrize("conservation_lvl", [0.2, 0.25])
+def test_incremental_matches_wave_engine(conservation_lvl, engine):
+    np.random.seed(0)
+    wave = OFC(1., conservation_lvl, L=15)
+    incremental = OFC(1., conservation_lvl, L=15, engine=engine)
+    incremental.values[...] = wave.values
+    if engine == "heap":
+        incremental.build_heap()
+    for i in range(1000):
+        wave.drive()
+        incremental.drive()
+        assert wave.critical_value_current == incremental.critical_value_current
+        assert wave.AvalancheLoop() == incremental.AvalancheLoop()
+        np.testing.assert_array_equal(wave.values, incremental.values)
+        np.testing.assert_array_equal(wave.releases, incremental.releases)
+
+def test_unknown_engine():
+    with pytest.raises(ValueError):
+        OFC(L=10, engine="magic")
+
+def test_compiled_run_matches_python_loop():
+    np.random.seed(0)
+    python = OFC(L=10, engine="heap", save_every=10)
+    compiled = OFC(L=10, engine="heap", save_every=10)
+    compiled.values[...] = python.values
+    compiled.build_heap()
+    python.run(90)
+    compiled.run(90, compiled=True)
+    np.testing.assert_array_equal(python.data_df.values, compiled.data_df.values)
+    np.testing.assert_array_equal(python.values, compiled.values)
+    assert python.critical_value_current == compiled.critical_value_current
+
+@pytest.mark.parametrize("engine, compiled", [("wave", False), ("heap", False), ("heap", True)])
+def test_max_height_relative_to_threshold(engine, compiled):
+    np.random.seed(0)
+    sim = OFC(L=16, engine=engine, save_every=100)
+    sim.run(3000, compiled=compiled, wait_for_n_iters=0)
+    data = sim.data_df
+    relaxed = data.MaxHeight[data.NumberOfReleases > 0]
+    assert len(relaxed) == 3000
+    assert (relaxed >= sim.critical_value).all()
+    assert relaxed.median() > sim.critical_value
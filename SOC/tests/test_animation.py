@@ -0,0 +1,80 @@
+from SOC.common import Snapshots
+from SOC.models import BTW, Manna
+import matplotlib
+import matplotlib.image
+import numpy as np
+import os
+import pytest
+import shutil
+
+@pytest.mark.parametrize("snapshot_format", ["full", "compact"])
+def test_frames_read_lazily(tmp_path, snapshot_format):
+    np.random.seed(0)
+    sim = BTW(10, save_every=3)
+    sim.SNAPSHOT_CHUNK_BYTES = 7 * 12 * 12 * 8
+    sim.run(290, filename=str(tmp_path / "run.zarr"), snapshot_format=snapshot_format)
+    snapshots = Snapshots.open(str(tmp_path / "run.zarr"), mode='r')
+    everything = snapshots[:]
+    with snapshots.frames(crop=1, max_chunks=2) as frames:
+        for i in list(range(len(frames))) + [50, 3, -1]:
+            np.testing.assert_array_equal(frames[i], everything[i, 1:-1, 1:-1])
+        assert len(frames._chunks) <= 3
+    assert frames._executor._shutdown and not frames._chunks
+    np.testing.assert_array_equal(snapshots.read(4, 9, crop=0), everything[4:9])
+    assert snapshots.value_range == (everything[:, 1:-1, 1:-1].min(), everything[:, 1:-1, 1:-1].max())
+
+def test_value_range_without_attrs():
+    np.random.seed(0)
+    sim = Manna(L=8, save_every=2)
+    sim.run(100)
+    stored = sim.saved_snapshots.attrs['value_range']
+    del sim.saved_snapshots.attrs['value_range']
+    assert sim.saved_snapshots.value_range == tuple(stored)
+    assert sim.saved_snapshots.attrs['value_range'] == stored
+
+@pytest.mark.parametrize("snapshot_format", ["full", "compact"])
+def test_value_range_stored_by_run(tmp_path, snapshot_format):
+    np.random.seed(0)
+    sim = Manna(L=8, save_every=2)
+    sim.run(100, filename=str(tmp_path / "run.zarr"), snapshot_format=snapshot_format)
+    snapshots = Snapshots.open(str(tmp_path / "run.zarr"), mode='r')
+    inside = snapshots[:, 1:-1, 1:-1]
+    assert snapshots.attrs['value_range'] == [inside.min(), inside.max()]
+
+@pytest.mark.parametrize("max_workers", [0, 1])
+def test_export_image_sequence(tmp_path, max_workers):
+    np.random.seed(0)
+    sim = BTW(8, save_every=5)
+    sim.run(100, filename=str(tmp_path / "run.zarr"))
+    directory = str(tmp_path / "frames")
+    sim.export_animation(directory, max_workers=max_workers)
+    names = sorted(os.listdir(directory))
+    assert len(names) == len(sim.saved_snapshots) == 22
+    image = matplotlib.image.imread(os.path.join(directory, names[-1]))
+    vmin, vmax = sim.saved_snapshots.value_range
+    colors = matplotlib.colormaps['viridis']((sim.saved_snapshots[-1, 1:-1, 1:-1] - vmin) / (vmax - vmin))
+    np.testing.assert_allclose(image[..., :3], colors[..., :3], atol=1 / 255)
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="needs ffmpeg")
+def test_export_video(tmp_path):
+    np.random.seed(0)
+    sim = BTW(9, save_every=5)
+    sim.run(100)
+    filename = sim.export_animation(str(tmp_path / "run.mp4"), max_workers=0)
+    assert os.path.getsize(filename) > 0
+
+def test_export_video_needs_ffmpeg(tmp_path, monkeypatch):
+    monkeypatch.setattr(shutil, "which", lambda name: None)
+    sim = BTW(8, save_every=5)
+    sim.run(100)
+    with pytest.raises(RuntimeError):
+        sim.export_animation(str(tmp_path / "run.mp4"))
+
+def test_animate_states():
+    np.random.seed(0)
+    sim = BTW(8, save_every=5)
+    sim.run(100)
+    anim = sim.animate_states()
+    anim._func(7)
+    np.testing.assert_array_equal(anim._fig.axes[0].images[0].get_array(), sim.saved_snapshots[7, 1:-1, 1:-1])
+    matplotlib.pyplot.close(anim._fig)
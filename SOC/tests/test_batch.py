@@ -0,0 +1,41 @@
+from SOC.common import Batch
+from SOC.common.checkpoints import seed
+from SOC.models import BTW, Manna, OFC, Forest
+import numpy as np
+import pytest
+
+@pytest.mark.parametrize("model, kwargs", [
+    (BTW, dict(engine="worklist")),
+    (Manna, dict(engine="frontier")),
+    (OFC, dict(engine="heap")),
+])
+def test_batch_runs_independent_replicas(model, kwargs):
+    np.random.seed(0)
+    batch = Batch(model, 3, L=8, **kwargs)
+    batch.run(200, wait_for_n_iters=20)
+    assert batch.arrays['values'].shape == (3, 10, 10)
+    assert np.shares_memory(batch.replicas[1].values, batch.arrays['values'])
+    df = batch.data_df
+    assert len(df) == 600 and set(df.replica) == {0, 1, 2}
+    assert not batch.replicas[0].data_df.equals(batch.replicas[1].data_df)
+
+    # every replica evolves as a single compiled run seeded with its seed
+    single = model(L=8, **kwargs)
+    for name in model.BATCH_ARRAYS:
+        getattr(single, name)[...] = batch.arrays[name][2]
+    for name in model.CHECKPOINT_ATTRIBUTES:
+        setattr(single, name, getattr(batch.replicas[2], name))
+    np.random.seed(1)
+    seeds = np.random.randint(2**31, size=3)
+    np.random.seed(1)
+    batch.run(50, wait_for_n_iters=0)
+    seed(int(seeds[2]))
+    columns = single._run_compiled(50)
+    np.testing.assert_array_equal(batch.replicas[2].values, single.values)
+    np.testing.assert_array_equal(batch.replicas[2].data_df.AvalancheSize[-50:], columns['AvalancheSize'])
+
+def test_batch_needs_batched_kernel():
+    with pytest.raises(ValueError):
+        Batch(BTW, 2, L=4)
+    with pytest.raises(ValueError):
+        Batch(Forest, 2, L=4)
@@ -0,0 +1,100 @@
+from SOC.common import StateCache
+from SOC.models import BTW, Manna, OFC, Forest
+import numpy as np
+import os
+
+def test_thermalize_stores_and_reuses_state(tmp_path):
+    cache = StateCache(str(tmp_path))
+    sim = BTW(L=8, engine="worklist")
+    assert sim.thermalize(500, cache) == 500
+    assert len(cache) == 1
+
+    other = BTW(L=8, engine="worklist", save_every=5)
+    assert other.thermalize(500, cache, burn_in=0) == 0
+    np.testing.assert_array_equal(other.values, sim.values)
+    # a longer thermalization continues from the cached state
+    assert other.thermalize(800, cache) == 300
+    assert cache.load(BTW(L=8, engine="worklist")) == 800
+
+def test_keys_depend_on_parameters(tmp_path):
+    cache = StateCache(str(tmp_path))
+    assert cache.key(Manna(L=8)) == cache.key(Manna(L=8, save_every=2))
+    assert cache.key(Manna(L=8)) != cache.key(Manna(L=8, critical_value=2))
+    assert cache.key(Manna(L=8)) != cache.key(Manna(L=9))
+    assert cache.key(Manna(L=8)) != cache.key(BTW(L=8))
+    assert cache.key(Manna(L=8)) == cache.key(Manna(L=8, engine="frontier"))
+
+def test_states_shared_across_engines(tmp_path):
+    cache = StateCache(str(tmp_path))
+    OFC(L=8, engine="wave").thermalize(300, cache)
+    sim = OFC(L=8, engine="heap")
+    assert cache.load(sim) == 300
+    assert sim.values.flat[sim._heap[0]] == sim.inside(sim.values).max()
+    sim.run(100, wait_for_n_iters=0)
+
+    Forest(L=8, f=0.1).thermalize(20, cache)
+    fire = Forest(L=8, f=0.1, engine="front")
+    assert cache.load(fire) == 20
+    assert fire._n_front == (fire.inside(fire.values) == 2).sum()
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = StateCache(str(tmp_path), max_bytes=0)
+    for L in [4, 5, 6]:
+        BTW(L=L).thermalize(10, cache)
+    assert len(cache) == 1
+    assert cache.load(BTW(L=6)) == 10
+    assert cache.load(BTW(L=4)) == 0
+
+def test_run_with_state_cache(tmp_path):
+    cache = StateCache(str(tmp_path))
+    sim = BTW(L=8, engine="worklist")
+    sim.run(100, wait_for_n_iters=200, state_cache=cache)
+    assert len(sim.data_df) == 100
+    assert len(cache) == 1
+
+def test_auto_thermalization_time_does_not_grow_with_cache(tmp_path):
+    np.random.seed(0)
+    cache = StateCache(str(tmp_path))
+    sim = BTW(L=8, engine="worklist")
+    sim.run(10, wait_for_n_iters="auto", state_cache=cache)
+    assert sim.thermalization_time > 0
+    for _ in range(2):
+        other = BTW(L=8, engine="worklist")
+        other.run(10, wait_for_n_iters="auto", state_cache=cache)
+        assert other.thermalization_time == sim.thermalization_time
+    assert cache.load(BTW(L=8, engine="worklist")) == sim.thermalization_time
+
+def test_concurrent_stores_keep_one_complete_entry(tmp_path, monkeypatch):
+    cache = StateCache(str(tmp_path))
+    first, second = BTW(L=8, engine="worklist"), BTW(L=8, engine="worklist")
+    first.values[1:-1, 1:-1] = 1
+    second.values[1:-1, 1:-1] = 2
+    rename = os.rename
+    def interleaved(source, destination):
+        # another replica stores the same entry between our two renames
+        if source.endswith(".tmp") and not interleaved.done:
+            interleaved.done = True
+            cache.store(second, 20)
+        rename(source, destination)
+    interleaved.done = False
+    monkeypatch.setattr(os, "rename", interleaved)
+    cache.store(first, 10)
+    loaded = BTW(L=8)
+    assert cache.load(loaded) == 20
+    np.testing.assert_array_equal(loaded.values, second.values)
+    assert os.listdir(str(tmp_path)) == [cache.key(loaded) + ".zarr"]
+
+def test_entries_hold_model_state_only(tmp_path):
+    cache = StateCache(str(tmp_path))
+    sim = Manna(L=8, engine="frontier")
+    sim.thermalize(300, cache)
+    assert sim.topplings > 0
+    fresh = Manna(L=8, engine="frontier")
+    assert cache.load(fresh) == 300
+    assert fresh.topplings == 0 and fresh.toppling_time == 0
+
+    ofc = OFC(L=8, engine="heap")
+    ofc.thermalize(300, cache)
+    loaded = OFC(L=8, engine="heap")
+    cache.load(loaded)
+    assert loaded.critical_value_current == ofc.critical_value_current
@@ -0,0 +1,72 @@
+from SOC.common.checkpoints import seed
+from SOC.models import BTW, Manna, OFC
+import numpy as np
+import pytest
+import zarr
+
+def _interrupt_at(sim, iteration):
+    save_snapshot = sim._save_snapshot
+    def interrupted(i):
+        save_snapshot(i)
+        if i >= iteration:
+            raise KeyboardInterrupt
+    sim._save_snapshot = interrupted
+
+@pytest.mark.parametrize("model, kwargs", [
+    (BTW, dict(engine="worklist")),
+    (Manna, dict(engine="frontier")),
+    (OFC, dict(engine="heap")),
+])
+@pytest.mark.parametrize("compiled", [False, True])
+def test_resume_matches_uninterrupted_run(tmp_path, model, kwargs, compiled):
+    seed(0)
+    sim = model(L=10, save_every=5, **kwargs)
+    sim.run(490, filename=str(tmp_path / "full.zarr"), compiled=compiled)
+
+    seed(0)
+    interrupted = model(L=10, save_every=5, **kwargs)
+    _interrupt_at(interrupted, 320)
+    checkpoint = str(tmp_path / "checkpoint.zarr")
+    with pytest.raises(KeyboardInterrupt):
+        interrupted.run(490, filename=str(tmp_path / "resumed.zarr"), compiled=compiled,
+                        checkpoint_filename=checkpoint, checkpoint_every=100)
+    assert "_touched" not in zarr.open_group(checkpoint, mode='r')['arrays']
+    resumed = model.from_checkpoint(checkpoint)
+    assert resumed.iteration == 300
+    resumed.resume()
+
+    np.testing.assert_array_equal(resumed.values, sim.values)
+    np.testing.assert_array_equal(resumed.visited, sim.visited)
+    np.testing.assert_array_equal(resumed.data_df, sim.data_df)
+    np.testing.assert_array_equal(zarr.open(str(tmp_path / "resumed.zarr"))[:], zarr.open(str(tmp_path / "full.zarr"))[:])
+
+def test_resume_streamed_observables_and_memory_snapshots(tmp_path):
+    seed(1)
+    sim = BTW(L=8, save_every=10, engine="worklist")
+    sim.run(490)
+
+    seed(1)
+    interrupted = BTW(L=8, save_every=10, engine="worklist")
+    _interrupt_at(interrupted, 250)
+    checkpoint = str(tmp_path / "checkpoint.zarr")
+    with pytest.raises(KeyboardInterrupt):
+        interrupted.run(490, observables_filename=str(tmp_path / "observables.zarr"),
+                        checkpoint_filename=checkpoint, checkpoint_every=200)
+    resumed = BTW.from_checkpoint(checkpoint)
+    resumed.resume()
+    np.testing.assert_array_equal(resumed.data_df, sim.data_df)
+    np.testing.assert_array_equal(resumed.saved_snapshots[:], sim.saved_snapshots[:])
+
+def test_save_and_open(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    sim = OFC(L=6, conservation_lvl=0.2)
+    sim.run(20)
+    other = OFC(L=6)
+    sim.save()
+    other.open()
+    assert other.conservation_lvl == 0.2
+    assert other.critical_value_current == sim.critical_value_current
+    np.testing.assert_array_equal(other.values, sim.values)
+    np.testing.assert_array_equal(other.data_df, sim.data_df)
+    with pytest.raises(ValueError):
+        BTW.from_checkpoint("state/sim.zarr")
@@ -0,0 +1,61 @@
+from SOC.common import driving
+from SOC.common.checkpoints import seed
+from SOC.models import BTW, Manna, OFC
+import numpy as np
+import pytest
+
+def test_deposit_quiet_grains_stops_before_threshold():
+    seed(0)
+    values = np.zeros((10, 10), dtype=np.int64)
+    mask = np.zeros(values.shape, dtype=bool)
+    at_threshold = 0
+    total = 0
+    for _ in range(20):
+        quiet, at_threshold = driving.deposit_quiet_grains(values, 3, 1, mask, at_threshold, 1000)
+        total += quiet
+        assert values.max() <= 3
+        assert at_threshold == driving.count_at_threshold(values, 3, 1)
+        np.testing.assert_array_equal(mask, values == 3)
+        assert values.sum() == total
+        if quiet < 1000:
+            location = driving.drive_at_threshold(values, 3, 1, mask)
+            assert values[location[0, 0], location[0, 1]] == 4
+            values[location[0, 0], location[0, 1]] = 0
+            at_threshold -= 1
+            total -= 3
+
+@pytest.mark.parametrize("model, kwargs", [
+    (BTW, dict(engine="worklist")),
+    (Manna, dict(engine="frontier")),
+])
+def test_skip_ahead_statistically_equivalent(model, kwargs):
+    statistics = []
+    for skip_ahead in [False, True]:
+        np.random.seed(0)
+        seed(0)
+        sim = model(L=16, save_every=100, **kwargs)
+        sim.run(20000, wait_for_n_iters=2000, skip_ahead=skip_ahead)
+        sizes = sim.data_df.AvalancheSize
+        assert len(sizes) == 20000
+        assert (sim.inside(sim.values) <= sim.drive_threshold).all()
+        statistics.append([sizes.mean(), (sizes == 0).mean(), sim.inside(sim.values).mean()])
+    np.testing.assert_allclose(*statistics, rtol=0.1)
+
+@pytest.mark.parametrize("model, kwargs", [
+    (BTW, dict(engine="worklist")),
+    (BTW, dict(engine="worklist", packed_visited=True)),
+    (Manna, dict(engine="frontier")),
+    (Manna, dict(engine="wave")),
+])
+def test_skip_ahead_keeps_count_at_threshold(model, kwargs):
+    seed(0)
+    sim = model(L=16, save_every=100, **kwargs)
+    sim.run(5000, wait_for_n_iters=0, skip_ahead=True)
+    assert sim._at_threshold == driving.count_at_threshold(sim.values, sim.drive_threshold, sim.BC)
+    np.testing.assert_array_equal(sim._threshold_mask, np.pad(sim.inside(sim.values) == sim.drive_threshold, sim.BC))
+
+def test_skip_ahead_needs_uniform_drive():
+    with pytest.raises(ValueError):
+        OFC(L=8).run(10, skip_ahead=True)
+    with pytest.raises(ValueError):
+        BTW(8, engine="worklist").run(10, compiled=True, skip_ahead=True)
@@ -0,0 +1,47 @@
+from SOC.common import run_ensemble, job_name, read_observables, StateCache, ensemble
+from SOC.models import BTW, Manna
+import numpy as np
+import os
+import zarr
+
+def test_ensemble_runs_every_job_once(tmp_path):
+    directory = str(tmp_path)
+    table = run_ensemble(Manna, dict(L=[4, 6]), 50, directory, replicas=2, max_workers=2, model_kwargs=dict(engine="frontier"))
+    assert list(table.index) == [4, 6]
+    assert (table.replicas == 2).all() and (table.rows == 100).all()
+    assert (table.AvalancheSize_mean[6] > table.AvalancheSize_mean[4])
+
+    first = read_observables(os.path.join(directory, job_name(Manna, dict(L=4, engine="frontier"), 0) + ".zarr"))
+    second = read_observables(os.path.join(directory, job_name(Manna, dict(L=4, engine="frontier"), 1) + ".zarr"))
+    assert len(first) == 50
+    assert not first.equals(second)
+
+    pooled = np.concatenate([first.AvalancheSize, second.AvalancheSize])
+    np.testing.assert_allclose(table.AvalancheSize_mean[4], pooled.mean())
+    np.testing.assert_allclose(table.AvalancheSize_std[4], pooled.std(ddof=1))
+
+    # rerunning finds every job finished
+    modified = {path: os.path.getmtime(os.path.join(directory, path)) for path in os.listdir(directory)}
+    again = run_ensemble(Manna, dict(L=[4, 6]), 50, directory, replicas=2, max_workers=0, model_kwargs=dict(engine="frontier"))
+    assert again.equals(table)
+    assert modified == {path: os.path.getmtime(os.path.join(directory, path)) for path in os.listdir(directory)}
+
+def test_ensemble_with_state_cache(tmp_path):
+    cache = StateCache(str(tmp_path / "cache"))
+    table = run_ensemble(BTW, dict(L=[8]), 100, str(tmp_path / "jobs"), replicas=2, max_workers=0,
+                         state_cache=cache, filename=None)
+    assert (table.rows == 200).all()
+    assert len(cache) == 1
+
+def test_summary_read_a_chunk_at_a_time(tmp_path):
+    group = zarr.open_group(str(tmp_path / "job.zarr"), mode='w')
+    data = dict(AvalancheSize=np.arange(25), Topplings=np.arange(25)**2)
+    for name, values in data.items():
+        group.create_array(name, data=values, chunks=(4,))
+    group.create_array('Extra', data=np.ones(30), chunks=(7,))   # longer: a row still being written
+    summary = ensemble._summarize(str(tmp_path / "job.zarr"))
+    assert summary['count'] == 25
+    for name, values in data.items():
+        assert summary['sum'][name] == values.sum()
+        assert summary['sum_of_squares'][name] == (values.astype(float)**2).sum()
+    assert summary['sum']['Extra'] == 25
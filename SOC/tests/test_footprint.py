@@ -0,0 +1,96 @@
+from SOC.common import footprint
+from SOC.common.checkpoints import seed
+from SOC.models import BTW, Manna, OFC, Forest
+import numpy as np
+import pandas
+import pytest
+
+@pytest.mark.parametrize("packed", [False, True])
+def test_mark_clear_size(packed):
+    visited = footprint.visited_array(12, packed)
+    touched = footprint.touched_list(12)
+    for x, y in [(0, 0), (3, 9), (3, 9), (11, 11), (5, 7)]:
+        footprint.mark(visited, touched, x, y)
+    assert touched[0] == 4
+    unpacked = footprint.unpack(visited, 12)
+    assert unpacked.shape == (12, 12) and unpacked.sum() == 4 and unpacked[3, 9]
+    assert footprint.size(visited, touched, 1, 12, 12) == 2
+    footprint.clear(visited, touched)
+    assert touched[0] == 0 and not visited.any()
+
+@pytest.mark.parametrize("packed", [False, True])
+def test_relist_rebuilds_touched_list(packed):
+    visited = footprint.visited_array(12, packed)
+    touched = footprint.touched_list(12)
+    assert touched.dtype == np.int32
+    for x, y in [(1, 2), (3, 9), (11, 11)]:
+        footprint.mark(visited, touched, x, y)
+    relisted = footprint.touched_list(12)
+    footprint.relist(footprint.unpack(visited, 12), relisted, footprint.row_length(visited))
+    assert relisted[0] == 3
+    assert sorted(relisted[1:4]) == sorted(touched[1:4])
+    footprint.clear(visited, relisted)
+    assert not visited.any()
+
+@pytest.mark.parametrize("model, kwargs", [
+    (BTW, dict(engine="worklist")),
+    (Manna, dict(engine="frontier")),
+    (OFC, dict(engine="heap")),
+])
+@pytest.mark.parametrize("compiled", [False, True])
+def test_packed_visited_matches_boolean(model, kwargs, compiled):
+    results = []
+    for packed in [False, True]:
+        np.random.seed(0)
+        seed(0)
+        sim = model(L=16, save_every=100, packed_visited=packed, **kwargs)
+        sim.run(1000, wait_for_n_iters=100, compiled=compiled)
+        results.append(sim)
+    plain, packed = results
+    pandas.testing.assert_frame_equal(plain.data_df, packed.data_df)
+    np.testing.assert_array_equal(plain.values, packed.values)
+    np.testing.assert_array_equal(plain.visited, footprint.unpack(packed.visited, packed.L_with_boundary))
+    assert packed.params['packed_visited']
+
+def test_packed_visited_needs_footprint_engine():
+    with pytest.raises(ValueError):
+        BTW(8, packed_visited=True)
+    with pytest.raises(ValueError):
+        Forest(L=8, packed_visited=True)
+
+@pytest.mark.parametrize("packed", [False, True])
+def test_geometry_matches_mask(packed):
+    np.random.seed(3)
+    visited = footprint.visited_array(20, packed)
+    touched = footprint.touched_list(20)
+    for x, y in np.random.randint(0, 20, size=(50, 2)):
+        footprint.mark(visited, touched, x, y)
+    mask = footprint.unpack(visited, 20)
+    assert footprint.geometry(visited, touched, 1, 20, 20) == footprint.mask_geometry(mask, 1)
+    xs, ys = np.nonzero(mask[1:-1, 1:-1])
+    extent_x, extent_y, radius = footprint.mask_geometry(mask, 1)
+    assert (extent_x, extent_y) == (np.ptp(xs) + 1, np.ptp(ys) + 1)
+    np.testing.assert_allclose(radius, np.sqrt(xs.var() + ys.var()))
+
+def test_single_toppling_geometry():
+    sim = BTW(3, engine="worklist")
+    sim.values[2, 2] = 4
+    observables = sim.AvalancheLoop()
+    assert observables == dict(AvalancheSize=4, number_of_iterations=1, Topplings=1,
+                               ExtentX=3, ExtentY=3, GyrationRadius=1., MaxHeight=4)
+
+@pytest.mark.parametrize("model, engines", [
+    (BTW, ["wave", "worklist"]),
+    (OFC, ["wave", "incremental", "heap"]),
+])
+def test_geometry_same_across_engines(model, engines):
+    frames = []
+    for engine in engines:
+        np.random.seed(0)
+        sim = model(L=12, save_every=100, engine=engine)
+        sim.run(300, wait_for_n_iters=100)
+        frames.append(sim.data_df)
+    for frame in frames[1:]:
+        pandas.testing.assert_frame_equal(frames[0], frame)
+    assert {'ExtentX', 'ExtentY', 'GyrationRadius', 'MaxHeight'} <= set(frames[0].columns)
+    assert (frames[0].ExtentX <= 12).all() and (frames[0].GyrationRadius >= 0).all()
@@ -0,0 +1,76 @@
+from SOC.common import ObservableStore, read_observables
+from SOC.models import BTW
+import numpy as np
+import pytest
+
+def test_append_and_extend():
+    store = ObservableStore(capacity=2)
+    for i in range(5):
+        store.append(dict(AvalancheSize=np.int64(i), number_of_iterations=1))
+    store.extend(dict(AvalancheSize=np.arange(10), number_of_iterations=np.ones(10, dtype=int)))
+    assert len(store) == 15
+    df = store.to_dataframe()
+    assert df.AvalancheSize.dtype == np.uint32
+    assert df.number_of_iterations.dtype == np.uint16
+    assert list(df.AvalancheSize) == list(range(5)) + list(range(10))
+
+def test_columns_widen_when_needed():
+    store = ObservableStore()
+    store.append(dict(AvalancheSize=1, number_of_iterations=1))
+    store.append(dict(AvalancheSize=2**40, number_of_iterations=70000))
+    df = store.to_dataframe()
+    assert df.AvalancheSize.dtype == np.uint64
+    assert df.number_of_iterations.dtype == np.uint32
+    assert list(df.AvalancheSize) == [1, 2**40]
+
+def test_dataframe_is_cached_zero_copy_view():
+    store = ObservableStore()
+    store.extend(dict(AvalancheSize=np.arange(10), number_of_iterations=np.zeros(10, dtype=int)))
+    df = store.to_dataframe()
+    assert store.to_dataframe() is df
+    assert np.shares_memory(df.AvalancheSize.to_numpy(), store.columns['AvalancheSize'])
+    store.append(dict(AvalancheSize=3, number_of_iterations=0))
+    assert len(store.to_dataframe()) == 11
+
+def test_mismatched_observables():
+    store = ObservableStore()
+    store.append(dict(AvalancheSize=1, number_of_iterations=1))
+    with pytest.raises(KeyError):
+        store.append(dict(AvalancheSize=1))
+
+def test_simulation_data_df():
+    sim = BTW(10)
+    sim.run(20)
+    assert len(sim.data_df) == 20
+    assert sim.data_df is sim.data_df
+
+def test_stream_to_disk(tmp_path):
+    path = str(tmp_path / "observables.zarr")
+    store = ObservableStore()
+    store.append(dict(AvalancheSize=1, number_of_iterations=1))
+    store.stream_to(path, chunk_size=100)
+    for i in range(10):
+        store.extend(dict(AvalancheSize=np.arange(35), number_of_iterations=np.ones(35, dtype=int)))
+        assert store._length < 100
+    assert len(store) == 351
+    assert len(read_observables(path)) == 300
+    store.flush()
+    df = read_observables(path)
+    assert len(df) == 351
+    np.testing.assert_array_equal(df.AvalancheSize, store.to_dataframe().AvalancheSize)
+
+def test_stream_to_path_like(tmp_path):
+    store = ObservableStore()
+    store.stream_to(tmp_path / "observables.zarr", chunk_size=10)
+    store.extend(dict(AvalancheSize=np.arange(25), number_of_iterations=np.ones(25, dtype=int)))
+    store.flush()
+    assert store._path == str(tmp_path / "observables.zarr")
+    assert len(read_observables(str(tmp_path / "observables.zarr"))) == 25
+
+def test_run_streams_observables_next_to_snapshots(tmp_path):
+    filename = str(tmp_path / "btw.zarr")
+    sim = BTW(10, save_every=10, engine="worklist")
+    sim.run(990, filename=filename, compiled=True, observables_filename=True)
+    df = read_observables(str(tmp_path / "btw.observables.zarr"))
+    assert len(df) == 990
+    np.testing.assert_array_equal(df.AvalancheSize, sim.data_df.AvalancheSize)
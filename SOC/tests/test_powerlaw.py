@@ -0,0 +1,77 @@
+from SOC.common import powerlaw, ObservableStore
+from SOC.models import BTW
+import numpy as np
+import pytest
+import zarr
+
+def test_hurwitz_zeta():
+    assert powerlaw.hurwitz_zeta(2., 1.) == pytest.approx(np.pi**2 / 6, rel=1e-14)
+    k = np.arange(100000)
+    for s, q in [(1.5, 0.3), (2.7, 4.5), (3., 1e4)]:
+        direct = ((q + k) ** -s).sum() + (q + k[-1] + 0.5) ** (1 - s) / (s - 1)
+        assert powerlaw.hurwitz_zeta(s, q) == pytest.approx(direct, rel=1e-10)
+
+def test_histogram_accumulates_blocks():
+    values = np.random.zipf(2., 10000)
+    values[:10] = 0
+    whole, blocks = powerlaw.LogHistogram(), powerlaw.LogHistogram()
+    whole.add(values)
+    for block in np.array_split(values, 7):
+        blocks.add(block)
+    np.testing.assert_array_equal(whole.counts, blocks.counts)
+    assert whole.underflow == 10 and whole.total == 10000 and whole.discrete
+    restored = powerlaw.LogHistogram.from_dict(whole.to_dict())
+    np.testing.assert_array_equal(restored.counts, whole.counts)
+    edges = whole.edges
+    for i in [0, 5, 40]:
+        assert whole.counts[i] == ((edges[i] <= values) & (values < edges[i + 1])).sum()
+
+@pytest.mark.parametrize("alpha", [1.5, 2.5])
+def test_fit_recovers_exponent(alpha):
+    np.random.seed(0)
+    histogram = powerlaw.LogHistogram()
+    histogram.add(np.random.zipf(alpha, 100000))
+    fit = powerlaw.fit_power_law(histogram, n_bootstrap=10)
+    assert fit['exponent'] == pytest.approx(alpha, abs=0.03)
+    low, high = fit['confidence_interval']
+    assert low < high and (low + high) / 2 == pytest.approx(alpha, abs=0.05)
+    truncated = powerlaw.fit_power_law(histogram, xmin=2, xmax=1000)
+    assert truncated['xmin'] == 2 and truncated['xmax'] == 1000
+    assert truncated['exponent'] == pytest.approx(alpha, abs=0.03)
+
+def test_fit_continuous():
+    np.random.seed(0)
+    histogram = powerlaw.LogHistogram()
+    histogram.add(np.random.pareto(1., 100000) + 1.)
+    assert not histogram.discrete
+    assert powerlaw.fit_power_law(histogram)['exponent'] == pytest.approx(2., abs=0.03)
+
+def test_store_histograms_streamed_and_checkpointed(tmpdir):
+    store = ObservableStore()
+    store.stream_to(str(tmpdir / "observables.zarr"), chunk_size=64)
+    values = np.random.randint(0, 1000, size=1000)
+    for block in np.array_split(values, 9):
+        store.extend(dict(AvalancheSize=block))
+    expected = powerlaw.LogHistogram()
+    expected.add(values)
+    np.testing.assert_array_equal(store.histograms['AvalancheSize'].counts, expected.counts)
+    group = zarr.open_group(str(tmpdir / "checkpoint.zarr"), mode='w')
+    store.checkpoint(group)
+    restored = ObservableStore.from_checkpoint(group)
+    restored.extend(dict(AvalancheSize=values))
+    expected.add(values)
+    np.testing.assert_array_equal(restored.histograms['AvalancheSize'].counts, expected.counts)
+
+def test_fit_exponent():
+    np.random.seed(0)
+    sim = BTW(16, save_every=1000, engine="worklist")
+    sim.run(5000, compiled=True, wait_for_n_iters=1000)
+    assert sim.histograms['AvalancheSize'].total == 5000
+    fit = sim.fit_exponent(low=2, high=100, plot=False)
+    assert fit['xmin'] == 2 and fit['xmax'] == 100
+    assert 0.5 < fit['exponent'] < 2
+
+    with pytest.deprecated_call():
+        legacy = sim.get_exponent(low=2, high=100, plot=False)
+    assert set(legacy) == {'exponent', 'intercept'}
+    assert -2 < legacy['exponent'] < 0
@@ -0,0 +1,84 @@
+from SOC.common import pyramid
+from SOC.common.checkpoints import seed
+from SOC.models import BTW, Manna
+import matplotlib.pyplot as plt
+import numpy as np
+import pytest
+
+def test_reduce_matches_blocks():
+    np.random.seed(0)
+    frame = np.random.randint(0, 7, size=(13, 11)).astype(np.int16)
+    levels = pyramid.reduce(frame, pyramid.max_levels(frame.shape))
+    assert levels[-1][0].shape == (1, 1)
+    for level, (mean, maximum) in enumerate(levels, 1):
+        block = 2**level
+        assert mean.shape == pyramid.level_shape(frame.shape, level) and maximum.dtype == frame.dtype
+        for i, j in np.ndindex(mean.shape):
+            sites = frame[i * block:(i + 1) * block, j * block:(j + 1) * block]
+            assert mean[i, j] == pytest.approx(sites.mean(), rel=1e-6)
+            assert maximum[i, j] == sites.max()
+
+def test_choose_level():
+    assert pyramid.choose_level(16384, 800, 20) == 4
+    assert pyramid.choose_level(16384, 800, 2) == 2
+    assert pyramid.choose_level(500, 800, 20) == 0
+
+def test_pyramid_saved_with_snapshots(tmp_path):
+    np.random.seed(0)
+    sim = BTW(12, save_every=5)
+    filename = str(tmp_path / "run.zarr")
+    sim.run(100, filename=filename, pyramid_levels=2)
+    snapshots = sim.saved_snapshots[:, 1:-1, 1:-1]
+    loaded = BTW.from_file(filename)
+    assert loaded.pyramid.levels == 2
+    for level in [1, 2]:
+        expected = [pyramid.reduce(frame, 2)[level - 1] for frame in snapshots]
+        np.testing.assert_allclose(loaded.pyramid.level(level, "mean")[:], [mean for mean, _ in expected])
+        np.testing.assert_array_equal(loaded.pyramid.level(level, "max")[:], [maximum for _, maximum in expected])
+    with pytest.raises(ValueError):
+        BTW(12).run(10, pyramid_levels=5)
+
+def test_resume_memory_pyramid(tmp_path):
+    seed(1)
+    sim = Manna(L=8, save_every=10)
+    sim.run(490, pyramid_levels=3)
+
+    seed(1)
+    interrupted = Manna(L=8, save_every=10)
+    save_snapshot = interrupted._save_snapshot
+    def interrupt(i):
+        save_snapshot(i)
+        if i >= 250:
+            raise KeyboardInterrupt
+    interrupted._save_snapshot = interrupt
+    checkpoint = str(tmp_path / "checkpoint.zarr")
+    with pytest.raises(KeyboardInterrupt):
+        interrupted.run(490, pyramid_levels=3, checkpoint_filename=checkpoint, checkpoint_every=200)
+    resumed = Manna.from_checkpoint(checkpoint)
+    resumed.resume()
+    for level in [1, 2, 3]:
+        np.testing.assert_array_equal(resumed.pyramid.level(level, "max")[:], sim.pyramid.level(level, "max")[:])
+
+def test_plot_state_reduces_and_zooms():
+    np.random.seed(0)
+    sim = BTW(64)
+    sim.values[...] = np.random.randint(0, 4, size=sim.values.shape)
+    image = sim.plot_state(max_pixels=20, reduction="max").axes[0].images[0]
+    assert image.get_array().shape == (32, 32) and image.get_array().max() == 3
+    image = sim.plot_state(region=(8, 24, 40, None)).axes[0].images[0]
+    np.testing.assert_array_equal(image.get_array(), sim.inside(sim.values)[8:24, 40:])
+    assert image.get_extent() == [39.5, 63.5, 23.5, 7.5]
+    plt.close('all')
+
+def test_animate_states_reads_pyramid():
+    np.random.seed(0)
+    sim = BTW(32, save_every=50)
+    sim.run(490, pyramid_levels=3)
+    anim = sim.animate_states(max_pixels=8, reduction="max")
+    anim._func(4)
+    shown = anim._fig.axes[0].images[0].get_array()
+    np.testing.assert_array_equal(shown, sim.pyramid.level(2, "max")[4])
+    anim = sim.animate_states(max_pixels=8, with_boundaries=True, region=(0, 17, 0, 17))
+    anim._func(4)
+    assert anim._fig.axes[0].images[0].get_array().shape == (9, 9)
+    plt.close('all')
@@ -0,0 +1,38 @@
+from SOC.common import SnapshotWriter
+from SOC.models import BTW
+import numpy as np
+import zarr
+
+def test_writer_fills_array_including_partial_chunk():
+    array = zarr.open(None, shape=(25, 3, 3), chunks=(10, 3, 3), dtype=int)
+    writer = SnapshotWriter(array)
+    frame = np.zeros((3, 3), dtype=int)
+    for i in range(25):
+        frame[...] = i
+        writer.write(i, frame)
+    writer.close()
+    np.testing.assert_array_equal(array[:, 1, 1], np.arange(25))
+
+def test_background_snapshots_match_direct_writes():
+    snapshots = []
+    for background_snapshots in [False, True]:
+        np.random.seed(0)
+        sim = BTW(10, save_every=3)
+        sim.run(290, background_snapshots=background_snapshots)
+        snapshots.append(sim.saved_snapshots[:])
+    np.testing.assert_array_equal(*snapshots)
+
+def test_compact_snapshots_round_trip(tmp_path):
+    np.random.seed(0)
+    sim = BTW(10, save_every=3)
+    full = str(tmp_path / "full.zarr")
+    sim.run(290, filename=full)
+    np.random.seed(0)
+    sim = BTW(10, save_every=3)
+    compact = str(tmp_path / "compact.zarr")
+    sim.run(290, filename=compact, snapshot_format="compact")
+    assert sim.saved_snapshots.array.dtype == np.uint8
+    # only the inside of the lattice is stored
+    np.testing.assert_array_equal(BTW.from_file(compact).saved_snapshots[:, 1:-1, 1:-1], zarr.open(full)[:, 1:-1, 1:-1])
+    np.testing.assert_array_equal(BTW.inside(BTW.from_file(compact).values), BTW.inside(zarr.open(full)[-1]))
+    np.testing.assert_array_equal(sim.saved_snapshots[5:40:7, 2, 1:-1], zarr.open(full)[5:40:7, 2, 1:-1])
@@ -0,0 +1,30 @@
+from SOC.common import StationarityMonitor
+from SOC.common.checkpoints import seed
+from SOC.models import BTW, OFC
+import numpy as np
+import warnings
+
+def test_monitor_rejects_drift_and_accepts_noise():
+    rng = np.random.default_rng(0)
+    monitor = StationarityMonitor(window=10)
+    assert not any(monitor.update(0.01 * t + rng.normal(0, 0.01)) for t in range(100))
+    monitor = StationarityMonitor(window=10)
+    assert [monitor.update(rng.normal(0, 1)) for t in range(20)][-1]
+
+def test_run_detects_thermalization_time():
+    np.random.seed(0)
+    sim = BTW(L=10, engine="worklist")
+    sim.run(50, wait_for_n_iters="auto")
+    # the lattice has to fill up to the critical density of about 2.1 grains per site first
+    assert sim.thermalization_time > 200
+    assert sim.saved_snapshots.attrs['thermalization_iterations'] == sim.thermalization_time
+    assert len(sim.data_df) == 50
+    assert 1.8 < BTW.inside(sim.values).mean() < 2.4
+
+def test_ofc_thermalizes_despite_drifting_loads():
+    seed(0)
+    sim = OFC(L=12, engine="heap")
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        iterations = sim.thermalize_until_stationary(compiled=True)
+    assert 0 < iterations < 100 * 10 * sim.size
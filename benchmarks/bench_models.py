@@ -0,0 +1,107 @@
+"""Benchmarks of the drives and avalanches of every model and engine."""
+import time
+import numpy as np
+from .common import VARIANTS, SIZES, DRIVES, WARMUP_DRIVES, prepare, timed_run
+from SOC.common.checkpoints import seed
+
+
+class Throughput:
+    """
+    Drives per second in the steady state of runs that gather observables,
+    through the compiled driver of the engines that have one.
+    """
+    params = (list(VARIANTS), SIZES)
+    param_names = ("variant", "L")
+    timeout = 1200
+
+    def setup(self, variant, L):
+        self.sim, self.compiled = prepare(variant, L)
+
+    def track_drives_per_second(self, variant, L):
+        return DRIVES[L] / timed_run(self.sim, DRIVES[L], self.compiled)
+    track_drives_per_second.unit = "drives/s"
+
+    def peakmem_run(self, variant, L):
+        self.sim.run(DRIVES[L], compiled=self.compiled, wait_for_n_iters=0)
+
+
+class TopplingThroughput:
+    """
+    Topplings (releases, for OFC) per second in the same runs as `Throughput`.
+    Forest fires do not topple and are left out.
+    """
+    params = ([variant for variant in VARIANTS if not variant.startswith("Forest")], SIZES)
+    param_names = ("variant", "L")
+    timeout = 1200
+
+    def setup(self, variant, L):
+        self.sim, self.compiled = prepare(variant, L)
+
+    def track_topplings_per_second(self, variant, L):
+        seconds = timed_run(self.sim, DRIVES[L], self.compiled)
+        data = self.sim.data_df
+        column = "NumberOfReleases" if "NumberOfReleases" in data else "Topplings"
+        return data[column].sum() / seconds
+    track_topplings_per_second.unit = "topplings/s"
+
+
+#: avalanche sizes binned by decade
+BUCKETS = ["1-9", "10-99", "100-999", "1000-9999", "10000+"]
+
+_durations = {}
+
+
+def _avalanche_durations(variant: str, L: int) -> dict:
+    """
+    Seconds taken by `AvalancheLoop` after each of `DRIVES[L]` drives, by bucket of avalanche size.
+    Shared by the buckets benchmarked in the same process.
+    """
+    if (variant, L) not in _durations:
+        sim, _ = prepare(variant, L)
+        durations = {bucket: [] for bucket in BUCKETS}
+        for _ in range(DRIVES[L]):
+            sim.drive()
+            start = time.perf_counter()
+            size = sim.AvalancheLoop()['AvalancheSize']
+            seconds = time.perf_counter() - start
+            if size > 0:
+                durations[BUCKETS[min(int(np.log10(size)), len(BUCKETS) - 1)]].append(seconds)
+        _durations[variant, L] = durations
+    return _durations[variant, L]
+
+
+class AvalancheDuration:
+    """
+    Mean time to relax an avalanche, by decade of its size, with the engine's Python driver.
+    Buckets no avalanche fell into are skipped.
+    """
+    params = (list(VARIANTS), SIZES, BUCKETS)
+    param_names = ("variant", "L", "size")
+    timeout = 1200
+
+    def setup(self, variant, L, size):
+        self.durations = _avalanche_durations(variant, L)[size]
+        if not self.durations:
+            raise NotImplementedError(f"No avalanche of size {size}")
+
+    def track_seconds_per_avalanche(self, variant, L, size):
+        return float(np.mean(self.durations))
+    track_seconds_per_avalanche.unit = "seconds"
+
+
+class Warmup:
+    """
+    Time of the first drives of a model, mostly numba compilation, kept apart from the
+    steady-state benchmarks above. Meaningful when asv runs it in a fresh process, as it does by default.
+    """
+    params = list(VARIANTS)
+    param_names = ("variant",)
+    timeout = 600
+
+    def track_first_drives_seconds(self, variant):
+        model, kwargs, compiled = VARIANTS[variant]
+        seed(0)
+        start = time.perf_counter()
+        model(L=16, **kwargs).thermalize(WARMUP_DRIVES, compiled=compiled)
+        return time.perf_counter() - start
+    track_first_drives_seconds.unit = "seconds"
@@ -0,0 +1,58 @@
+"""Benchmarks of writing snapshots."""
+import shutil
+import tempfile
+import time
+import numpy as np
+from .common import SIZES
+from SOC.common import Simulation, SnapshotWriter, create_snapshots
+from SOC.common.snapshots import FORMATS
+
+#: number of snapshots written per lattice size
+FRAMES = {16: 5000, 64: 1000, 256: 200, 1024: 20}
+
+
+class SnapshotWrites:
+    """
+    Megabytes of lattice per second turned into a zarr array of snapshots on disk, as `Simulation.run` does.
+
+    Consecutive frames are BTW-like lattices that differ by a square patch, like the footprint
+    of an avalanche, so that compression sees realistic data.
+    """
+    params = (SIZES, list(FORMATS), [True, False])
+    param_names = ("L", "snapshot_format", "background")
+    timeout = 600
+
+    def setup(self, L, snapshot_format, background):
+        rng = np.random.default_rng(0)
+        width = L + 2
+        self.frames = np.zeros((8, width, width), dtype=int)
+        frame = np.zeros((width, width), dtype=int)
+        frame[1:-1, 1:-1] = rng.integers(0, 4, size=(L, L))
+        side = max(L // 8, 1)
+        for i in range(len(self.frames)):
+            x, y = rng.integers(1, L + 2 - side, size=2)
+            frame[x:x + side, y:y + side] = rng.integers(0, 4, size=(side, side))
+            self.frames[i] = frame
+        self.directory = tempfile.mkdtemp()
+
+    def teardown(self, L, snapshot_format, background):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def track_megabytes_per_second(self, L, snapshot_format, background):
+        n_frames = FRAMES[L]
+        chunk_length = int(np.clip(Simulation.SNAPSHOT_CHUNK_BYTES // self.frames[0].nbytes, 1, 100))
+        start = time.perf_counter()
+        snapshots = create_snapshots(f"{self.directory}/snapshots.zarr", n_frames, L + 2, self.frames.dtype,
+                                     chunk_length, snapshot_format=snapshot_format, compact_dtype=np.uint8)
+        writer = SnapshotWriter(snapshots.array) if background else None
+        for index in range(n_frames):
+            frame = snapshots.encode(index, self.frames[index % len(self.frames)])
+            if writer is not None:
+                writer.write(index, frame)
+            else:
+                snapshots.array[index] = frame
+        if writer is not None:
+            writer.close()
+        seconds = time.perf_counter() - start
+        return n_frames * self.frames[0].nbytes / seconds / 2**20
+    track_megabytes_per_second.unit = "MB/s"
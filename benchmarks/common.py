@@ -0,0 +1,72 @@
+"""Contains the models, lattice sizes and helpers shared by the benchmarks."""
+import time
+import numpy as np
+from SOC.common.checkpoints import seed
+from SOC.models import BTW, Manna, OFC, Forest
+
+#: model, keyword arguments and whether the engine has a compiled driver, by name
+VARIANTS = {
+    "BTW-wave": (BTW, dict(engine="wave"), False),
+    "BTW-worklist": (BTW, dict(engine="worklist"), True),
+    "BTW-tiled": (BTW, dict(engine="tiled"), False),
+    "Manna-wave": (Manna, dict(engine="wave"), False),
+    "Manna-frontier": (Manna, dict(engine="frontier"), True),
+    "Manna-tiled": (Manna, dict(engine="tiled"), False),
+    "Manna-nonabelian-wave": (Manna, dict(abelian=False, engine="wave"), False),
+    "Manna-nonabelian-frontier": (Manna, dict(abelian=False, engine="frontier"), True),
+    "OFC-wave": (OFC, dict(engine="wave"), False),
+    "OFC-incremental": (OFC, dict(engine="incremental"), False),
+    "OFC-heap": (OFC, dict(engine="heap"), True),
+    "Forest-lattice": (Forest, dict(f=1e-4, engine="lattice"), False),
+    "Forest-front": (Forest, dict(f=1e-4, engine="front"), True),
+    "Forest-cluster": (Forest, dict(f=1e-4, engine="cluster"), True),
+}
+
+SIZES = [16, 64, 256, 1024]
+
+#: number of timed drives per lattice size, so that every benchmark takes seconds
+DRIVES = {16: 10000, 64: 2000, 256: 200, 1024: 20}
+
+#: drives run after compiling and before timing
+WARMUP_DRIVES = 50
+
+
+def prepare(variant: str, L: int, save_every: int = None):
+    """
+    A simulation ready to be timed: seeded, filled near its stationary state and with its numba
+    kernels compiled, so that neither JIT compilation nor the initial transient is measured.
+
+    Sandpiles start from heights drawn uniformly up to their toppling threshold; the other models
+    from their own initial states. Kernels are compiled on a small lattice of the same model,
+    then the simulation is warmed up by `WARMUP_DRIVES` drives.
+
+    :param variant: key of `VARIANTS`
+    :type variant: str
+    :param L: linear size of the lattice
+    :type L: int
+    :param save_every: passed to the model; by default `DRIVES[L]`, a single snapshot per `timed_run`
+    :type save_every: int
+    :return: the simulation and whether to run it compiled
+    :rtype: tuple
+    """
+    model, kwargs, compiled = VARIANTS[variant]
+    seed(0)
+    model(L=8, **kwargs).thermalize(WARMUP_DRIVES, compiled=compiled)
+    seed(0)
+    sim = model(L=L, save_every=save_every or DRIVES[L], **kwargs)
+    if sim.drive_threshold is not None:
+        inside = sim.inside(sim.values)
+        inside[...] = np.random.randint(0, sim.drive_threshold + 1, size=inside.shape)
+    sim.thermalize(WARMUP_DRIVES, compiled=compiled)
+    return sim, compiled
+
+
+def timed_run(sim, n_drives: int, compiled: bool) -> float:
+    """
+    Wall-clock seconds of a run of `n_drives` drives, a multiple of `sim.save_every`, collecting observables.
+
+    :rtype: float
+    """
+    start = time.perf_counter()
+    sim.run(n_drives, compiled=compiled, wait_for_n_iters=0)
+    return time.perf_counter() - start